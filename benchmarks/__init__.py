@@ -0,0 +1,7 @@
+import os
+import sys
+
+_root = os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + '/..')
+for path in ['/src/layers/shared_files/python/', '/src/detect_related_tweet/']:
+    if _root + path not in sys.path:
+        sys.path.append(_root + path)
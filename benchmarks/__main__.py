@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import json
+import yaml
+import argparse
+
+from benchmarks import corpus, detection, to_storable
+from keyword_detector import KeywordDetector
+from news_bot_config import NewsBotConfig
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    commands = parser.add_subparsers(dest='command')
+
+    generate = commands.add_parser('generate', help='write a synthetic JSONL corpus')
+    _add_corpus_arguments(generate)
+    generate.add_argument('-o', '--output', required=True)
+
+    detect = commands.add_parser('detection', help='replay a corpus through RelatedTweetDetector')
+    detect.add_argument('--corpus', help='JSONL of CollectTweetsMessage or plain statuses (synthetic when omitted)')
+    _add_corpus_arguments(detect)
+    detect.add_argument('--config', help='config yaml whose keyword_config is used')
+    detect.add_argument('--iterations', type=int, default=5)
+    detect.add_argument('--warmup', type=int, default=100)
+    detect.add_argument('--no-allocations', action='store_true')
+    detect.add_argument('--output', help='write the result as JSON')
+    detect.add_argument('--baseline', help='result JSON of a previous run to compare against')
+    detect.add_argument('--max-regression', type=float, default=0.2)
+
+    storable = commands.add_parser('to_storable', help='compare DynamoDB item conversions on tweet fixtures')
+    storable.add_argument('--fixtures', default=to_storable.DEFAULT_FIXTURES, help='glob of status JSON files')
+    storable.add_argument('--iterations', type=int, default=1000)
+    storable.add_argument('--no-allocations', action='store_true')
+
+    args = parser.parse_args(argv)
+    if args.command == 'generate':
+        corpus.dump(corpus.generate(_spec(args)), args.output)
+        return 0
+    if args.command == 'detection':
+        return _detection(args)
+    if args.command == 'to_storable':
+        result = to_storable.run(
+            to_storable.load_fixtures(args.fixtures), args.iterations, trace_allocations=not args.no_allocations
+        )
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        return 0
+    parser.print_help()
+    return 2
+
+
+def _add_corpus_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('-n', '--size', type=int, default=1000)
+    parser.add_argument('--keyword-ratio', type=float, default=0.1)
+    parser.add_argument('--url-ratio', type=float, default=0.3)
+    parser.add_argument('--media-ratio', type=float, default=0.2)
+    parser.add_argument('--quote-ratio', type=float, default=0.1)
+    parser.add_argument('--keywords', nargs='*', default=corpus.DEFAULT_KEYWORDS)
+    parser.add_argument('--seed', type=int, default=0)
+
+
+def _spec(args) -> corpus.CorpusSpec:
+    return corpus.CorpusSpec(
+        size=args.size,
+        keyword_ratio=args.keyword_ratio,
+        url_ratio=args.url_ratio,
+        media_ratio=args.media_ratio,
+        quote_ratio=args.quote_ratio,
+        keywords=args.keywords,
+        seed=args.seed,
+    )
+
+
+def _keyword_detector(args) -> KeywordDetector:
+    if args.config is None:
+        return KeywordDetector(global_keywords=args.keywords)
+    with open(args.config, encoding='utf-8') as f:
+        return NewsBotConfig(yaml.safe_load(f)).keyword_detector
+
+
+def _detection(args) -> int:
+    if args.corpus is not None:
+        lines = corpus.load(args.corpus)
+    else:
+        lines = [json.dumps(r, ensure_ascii=False) for r in corpus.generate(_spec(args))]
+    result = detection.run(
+        lines,
+        _keyword_detector(args),
+        iterations=args.iterations,
+        warmup=args.warmup,
+        trace_allocations=not args.no_allocations,
+    ).dictionary
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+    if args.baseline is None:
+        return 0
+    with open(args.baseline, encoding='utf-8') as f:
+        regressions = detection.regressions(json.load(f), result, args.max_regression)
+    for regression in regressions:
+        print(regression, file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+import json
+import random
+from typing import Iterable, Iterator, List
+
+from twitter import TweetHandleOptions, TweetEvaluateOption
+
+DEFAULT_KEYWORDS = ['吉野', 'ゆっぴ', 'yoppinews']
+
+_VOCABULARY = [
+    '今日', '明日', 'ニュース', 'ライブ', '配信', '発表', '公開', '予定', '開催', '情報', 'お知らせ', '新曲', 'イベント',
+    'today', 'news', 'live', 'release', 'event', 'update', 'schedule', 'ticket', 'video', 'photo', 'the', 'and',
+]
+
+
+class CorpusSpec:
+    def __init__(
+        self,
+        size: int = 1000,
+        keyword_ratio: float = 0.1,
+        url_ratio: float = 0.3,
+        media_ratio: float = 0.2,
+        quote_ratio: float = 0.1,
+        keywords: List[str] = None,
+        words: int = 20,
+        seed: int = 0,
+    ):
+        self.size = size
+        self.keyword_ratio = keyword_ratio
+        self.url_ratio = url_ratio
+        self.media_ratio = media_ratio
+        self.quote_ratio = quote_ratio
+        self.keywords = keywords or DEFAULT_KEYWORDS
+        self.words = words
+        self.seed = seed
+
+
+def generate(spec: CorpusSpec) -> Iterator[dict]:
+    rnd = random.Random(spec.seed)
+    options = _replay_options()
+    for i in range(spec.size):
+        status_id = 1100000000000000000 + i
+        screen_name = f'user_{rnd.randrange(100)}'
+        status = {
+            'id': status_id,
+            'id_str': str(status_id),
+            'full_text': _text(rnd, spec, rnd.random() < spec.keyword_ratio),
+            'user': {'screen_name': screen_name},
+            'in_reply_to_status_id': None,
+            'retweeted': False,
+            'entities': {'urls': []},
+        }
+        if rnd.random() < spec.url_ratio:
+            status['entities']['urls'].append({'expanded_url': f'https://example.com/news/{status_id}'})
+        if rnd.random() < spec.media_ratio:
+            media = [
+                {'media_url_https': f'https://pbs.twimg.com/media/{status_id}_{n}.jpg'}
+                for n in range(rnd.randint(1, 4))
+            ]
+            status['entities']['media'] = media
+            status['extended_entities'] = {'media': media}
+        if rnd.random() < spec.quote_ratio:
+            status['is_quote_status'] = True
+            status['quoted_status'] = {
+                'id': status_id - 1,
+                'full_text': _text(rnd, spec, rnd.random() < spec.keyword_ratio),
+                'user': {'screen_name': f'user_{rnd.randrange(100)}'},
+            }
+        yield {'tweet': status, 'options': options.dictionary}
+
+
+def _text(rnd: random.Random, spec: CorpusSpec, with_keyword: bool) -> str:
+    words = [rnd.choice(_VOCABULARY) for _ in range(spec.words)]
+    if with_keyword:
+        words.insert(rnd.randrange(len(words) + 1), rnd.choice(spec.keywords))
+    return ' '.join(words)
+
+
+def load(path: str) -> List[str]:
+    with open(path, encoding='utf-8') as f:
+        return [_message_line(line) for line in (line.strip() for line in f) if line]
+
+
+def _message_line(line: str) -> str:
+    record = json.loads(line)
+    if 'tweet' in record:
+        return line
+    # plain statuses (e.g. dumped from lists/statuses) are replayed with evaluation enabled
+    return json.dumps({'tweet': record, 'options': _replay_options().dictionary}, ensure_ascii=False)
+
+
+def _replay_options() -> TweetHandleOptions:
+    return TweetHandleOptions(
+        include_quoted_text=True,
+        evaluate_image=TweetEvaluateOption.EVALUATE,
+        evaluate_url=TweetEvaluateOption.EVALUATE,
+    )
+
+
+def dump(records: Iterable[dict], path: str):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import json
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+from message import CollectTweetsMessage
+from keyword_detector import KeywordDetector
+from related_tweet_detector import RelatedTweetDetector, RelatedTweetDetectionResult
+
+
+class BenchmarkResult:
+    def __init__(
+        self,
+        tweets: int,
+        elapsed_sec: float,
+        latencies_us: Dict[str, List[float]],
+        allocated_bytes_per_tweet: Optional[float],
+        allocations_per_tweet: Optional[float],
+        peak_bytes_per_tweet: Optional[float],
+        decisions: Dict[str, int],
+    ):
+        self._tweets = tweets
+        self._elapsed_sec = elapsed_sec
+        self._latencies_us = latencies_us
+        self._allocated_bytes_per_tweet = allocated_bytes_per_tweet
+        self._allocations_per_tweet = allocations_per_tweet
+        self._peak_bytes_per_tweet = peak_bytes_per_tweet
+        self._decisions = decisions
+
+    @property
+    def tweets_per_sec(self) -> float:
+        return self._tweets / self._elapsed_sec if self._elapsed_sec > 0 else 0
+
+    def percentile_us(self, step: str, p: float) -> float:
+        return percentile(self._latencies_us[step], p)
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'tweets': self._tweets,
+            'elapsed_sec': round(self._elapsed_sec, 4),
+            'tweets_per_sec': round(self.tweets_per_sec, 1),
+            'latency_us': {
+                step: {
+                    'p50': round(self.percentile_us(step, 50), 1),
+                    'p99': round(self.percentile_us(step, 99), 1),
+                }
+                for step in self._latencies_us.keys()
+            },
+            'allocated_bytes_per_tweet': _round(self._allocated_bytes_per_tweet),
+            'allocations_per_tweet': _round(self._allocations_per_tweet),
+            'peak_bytes_per_tweet': _round(self._peak_bytes_per_tweet),
+            'decisions': self._decisions,
+        }
+
+
+def regressions(baseline: dict, current: dict, max_regression: float) -> List[str]:
+    found = []
+    if current['tweets_per_sec'] < baseline['tweets_per_sec'] * (1 - max_regression):
+        found.append(f"tweets_per_sec: {baseline['tweets_per_sec']} -> {current['tweets_per_sec']}")
+    for step, latency in current['latency_us'].items():
+        base = baseline.get('latency_us', {}).get(step, None)
+        if base is not None and latency['p99'] > base['p99'] * (1 + max_regression):
+            found.append(f"{step} p99 latency_us: {base['p99']} -> {latency['p99']}")
+    return found
+
+
+def percentile(values: List[float], p: float) -> float:
+    if len(values) == 0:
+        return 0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def run(
+    lines: List[str],
+    keyword_detector: KeywordDetector,
+    iterations: int = 1,
+    warmup: int = 100,
+    trace_allocations: bool = True,
+) -> BenchmarkResult:
+    detector = RelatedTweetDetector(keyword_detector)
+    for line in lines[:warmup]:
+        _replay(line, detector)
+
+    latencies: Dict[str, List[float]] = {'parse': [], 'detect': [], 'total': [], 'keyword': []}
+    decisions = {'retweet': 0, 'image_detection': 0, 'url_detection': 0}
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(iterations):
+            for line in lines:
+                t0 = time.perf_counter()
+                message = CollectTweetsMessage.of(json.loads(line))
+                t1 = time.perf_counter()
+                result = detector.detect(message.tweet, message.options)
+                t2 = time.perf_counter()
+                latencies['parse'].append((t1 - t0) * 1e6)
+                latencies['detect'].append((t2 - t1) * 1e6)
+                latencies['total'].append((t2 - t0) * 1e6)
+                decisions['retweet'] += result.retweet_needed
+                decisions['image_detection'] += result.image_detection_needed
+                decisions['url_detection'] += result.url_detection_needed
+        elapsed = time.perf_counter() - started
+
+        # KeywordDetector on its own, outside of the throughput figure
+        for line in lines:
+            message = CollectTweetsMessage.of(json.loads(line))
+            t0 = time.perf_counter()
+            keyword_detector.find_related_keyword(message.tweet.full_text, message.tweet.screen_name)
+            latencies['keyword'].append((time.perf_counter() - t0) * 1e6)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    allocated_bytes, allocations, peak_bytes = _trace_allocations(lines, detector) if trace_allocations \
+        else (None, None, None)
+    return BenchmarkResult(
+        len(lines) * iterations, elapsed, latencies, allocated_bytes, allocations, peak_bytes, decisions
+    )
+
+
+def _replay(line: str, detector: RelatedTweetDetector) -> Tuple[CollectTweetsMessage, RelatedTweetDetectionResult]:
+    message = CollectTweetsMessage.of(json.loads(line))
+    return message, detector.detect(message.tweet, message.options)
+
+
+def _trace_allocations(lines: List[str], detector: RelatedTweetDetector) -> Tuple[float, float, Optional[float]]:
+    # tracing slows the hot path down considerably, so it runs as a separate pass
+    if len(lines) == 0:
+        return 0, 0, None
+    ignore_tracemalloc = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    can_reset_peak = hasattr(tracemalloc, 'reset_peak')
+    kept = []
+    peak_bytes = 0
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+        for line in lines:
+            if can_reset_peak:
+                tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            # keep parsed messages alive so the snapshot diff covers every block they are made of
+            kept.append(_replay(line, detector))
+            peak_bytes += tracemalloc.get_traced_memory()[1] - current
+        after = tracemalloc.take_snapshot().filter_traces(ignore_tracemalloc)
+    finally:
+        tracemalloc.stop()
+    stats = [stat for stat in after.compare_to(before, 'filename') if stat.size_diff > 0]
+    allocated_bytes = sum(stat.size_diff for stat in stats)
+    allocations = sum(max(stat.count_diff, 0) for stat in stats)
+    n = len(lines)
+    return allocated_bytes / n, allocations / n, peak_bytes / n if can_reset_peak else None
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return round(value, 1) if value is not None else None
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+import gc
+import glob
+import json
+import time
+import decimal
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from key_value_store import to_storable
+from benchmarks.detection import percentile
+
+DEFAULT_FIXTURES = 'events/tweets/*.json'
+
+
+def json_round_trip(item: object) -> object:
+    # DDBTableWithLocalCache._to_storable before the structural converter
+    text = json.dumps(item, ensure_ascii=False)
+    text = text.replace(': ""', ':null')
+    return json.loads(text, parse_float=decimal.Decimal)
+
+
+IMPLEMENTATIONS: Dict[str, Callable[[object], object]] = {
+    'json_round_trip': json_round_trip,
+    'structural': to_storable,
+}
+
+
+def load_fixtures(pattern: str = DEFAULT_FIXTURES) -> List[dict]:
+    statuses = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, encoding='utf-8') as f:
+            statuses.append(json.load(f))
+    return statuses
+
+
+def run(statuses: List[dict], iterations: int = 1000, trace_allocations: bool = True) -> dict:
+    result = {'statuses': len(statuses), 'iterations': iterations, 'implementations': {}}
+    for name, convert in IMPLEMENTATIONS.items():
+        for status in statuses:
+            convert(status)
+        latencies: List[float] = []
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for _ in range(iterations):
+                for status in statuses:
+                    t0 = time.perf_counter()
+                    convert(status)
+                    latencies.append((time.perf_counter() - t0) * 1e6)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        result['implementations'][name] = {
+            'p50_us': round(percentile(latencies, 50), 2),
+            'p99_us': round(percentile(latencies, 99), 2),
+            'total_ms': round(sum(latencies) / 1000, 2),
+        }
+        if trace_allocations:
+            result['implementations'][name].update(_allocations(statuses, convert))
+    implementations = result['implementations']
+    structural_ms = implementations['structural']['total_ms']
+    round_trip_ms = implementations['json_round_trip']['total_ms']
+    result['speedup'] = round(round_trip_ms / structural_ms, 2) if structural_ms > 0 else None
+    return result
+
+
+def _allocations(statuses: List[dict], convert: Callable[[object], object]) -> Dict[str, Optional[float]]:
+    if len(statuses) == 0:
+        return {'retained_bytes_per_status': 0, 'peak_bytes_per_status': None}
+    can_reset_peak = hasattr(tracemalloc, 'reset_peak')
+    kept = []
+    peak_bytes = 0
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        for status in statuses:
+            if can_reset_peak:
+                tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            kept.append(convert(status))
+            # the peak includes transient objects such as the JSON text of the round trip
+            peak_bytes += tracemalloc.get_traced_memory()[1] - current
+        retained_bytes = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    n = len(statuses)
+    return {
+        'retained_bytes_per_status': round(retained_bytes / n, 1),
+        'peak_bytes_per_status': round(peak_bytes / n, 1) if can_reset_peak else None,
+    }
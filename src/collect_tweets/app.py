@@ -2,18 +2,25 @@
 
 import os
 import json
+import time
 import boto3
 import concurrent.futures
-from typing import List
-from logging import Logger
+from typing import List, Optional, Dict, Set, Tuple
 
 
 from TwitterAPI import TwitterAPI
+from TwitterAPI.TwitterError import TwitterRequestError
 
-from twitter import TwitterList, Tweet
+from twitter import TwitterList, Tweet, TweetHandleOptions
 from message import CollectTweetsMessage
-from key_value_store import DDBTableWithLocalCache
+from key_value_store import DDBTableWithLocalCache, BoundedInMemoryKeyValueStore
 from news_bot_config import NewsBotConfig, CollectTweetsListConfig
+from structured_logger import StructuredLogger
+from sns_publisher import BatchSNSPublisher
+from collector_state import CollectorStateStore, ListState
+from request_scheduler import ListScheduler, RequestBudget, LISTS_STATUSES
+from polling_policy import PollingPolicy
+from sharding import CollectTweetsShardMessage, partition, shard_allowance, shard_of
 
 # env_vars
 stage = os.environ['Stage']
@@ -25,98 +32,350 @@ access_token_key = os.environ['TwitterAccessTokenKey']
 access_token_secret = os.environ['TwitterAccessTokenSecret']
 target_topic = os.environ['TargetTopic']
 ddb_table_name = os.environ['DDBCacheTable']
+ddb_state_table_name = os.environ['DDBStateTable']
+shard_function = os.environ.get('ShardFunction', '')
 
 # api clients
 twitter_api = TwitterAPI(consumer_key, consumer_secret, access_token_key, access_token_secret)
 sns_client = boto3.client('sns') if stage != 'local' \
     else boto3.client('sns', endpoint_url='http://localstack:4575')
+lambda_client = boto3.client('lambda') if stage != 'local' \
+    else boto3.client('lambda', endpoint_url='http://localstack:4574')
 ddb = boto3.resource('dynamodb') if stage != 'local' \
     else boto3.resource('dynamodb', endpoint_url='http://localstack:4569')
 ddb_table = ddb.Table(ddb_table_name) if stage != 'local' \
     else ddb.Table('CollectTweets')
+ddb_state_table = ddb.Table(ddb_state_table_name) if stage != 'local' \
+    else ddb.Table('CollectTweetsState')
 
 # cache
-ddb_table_with_cache = DDBTableWithLocalCache('original_id', ddb_table)
+local_cache_max_entries = int(os.environ.get('LocalCacheMaxEntries', '20000'))
+local_cache_max_bytes = int(os.environ.get('LocalCacheMaxBytes', str(32 * 1024 * 1024)))
+local_cache = BoundedInMemoryKeyValueStore(max_entries=local_cache_max_entries, max_bytes=local_cache_max_bytes)
+ddb_table_with_cache = DDBTableWithLocalCache('original_id', ddb_table, local_cache)
+
+# state
+collector_state_store = CollectorStateStore(ddb_state_table)
 
 
 def lambda_handler(_, __):
     config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
-    ddb_table_with_cache.set_logger(config.logger)
+    ddb_table_with_cache.set_logger(config.log)
+    collector_state_store.set_logger(config.log)
+    if config.collect_tweets_shard_count > 1:
+        return coordinate(config, config.collect_tweets_shard_count)
     return handle(config)
 
 
+def shard_handler(event, __):
+    config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
+    ddb_table_with_cache.set_logger(config.log)
+    collector_state_store.set_logger(config.log)
+    return handle(config, shard=CollectTweetsShardMessage.of(event))
+
+
+def coordinate(config: NewsBotConfig, shard_count: int, invoke=None, now: Optional[float] = None):
+    invoke = invoke or invoke_shard
+    now = now if now is not None else time.time()
+    start = time.perf_counter()
+    shards = partition(config.twitter_target_lists, shard_count)
+
+    def fan_out(shard: int) -> Optional[str]:
+        try:
+            invoke(CollectTweetsShardMessage(shard, shard_count, now))
+            return None
+        except Exception as e:
+            return e.__str__()
+
+    with concurrent.futures.ThreadPoolExecutor() as pool:
+        errors = dict(zip(shards.keys(), pool.map(fan_out, shards.keys())))
+    failed = {shard: error for shard, error in errors.items() if error is not None}
+    if failed:
+        config.log.error('collect_tweets:coordinate:failed', failed)
+    config.log.info('collect_tweets:coordinate', {
+        'shard_count': shard_count,
+        'lists': {shard: len(lists) for shard, lists in sorted(shards.items())},
+        'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+    })
+    return {'Shards': sorted(shards.keys()), 'Failed': sorted(failed.keys())}
+
+
+def invoke_shard(message: CollectTweetsShardMessage):
+    lambda_client.invoke(
+        FunctionName=shard_function,
+        InvocationType='Event',
+        Payload=json.dumps(message.dictionary),
+    )
+
+
 def handle(
     config: NewsBotConfig,
     twitter: TwitterAPI = twitter_api,
     cached_ddb_table: DDBTableWithLocalCache = ddb_table_with_cache,
-    sns=sns_client
+    sns=sns_client,
+    state_store: CollectorStateStore = collector_state_store,
+    now: Optional[float] = None,
+    shard: Optional[CollectTweetsShardMessage] = None,
 ):
-    list_configs = config.twitter_target_lists
+    now = now if now is not None else time.time()
+    start = time.perf_counter()
+    list_configs = {
+        ListState.state_key(l.twitter_list): l for l in config.twitter_target_lists
+        if shard is None or shard_of(l.twitter_list, shard.shard_count) == shard.shard
+    }
+    max_pages = config.collect_tweets_max_pages
+    scheduler = ListScheduler(config.collect_tweets_rate_limit_window, config.collect_tweets_interval)
+    policy = PollingPolicy(
+        config.collect_tweets_adaptive_polling_enabled,
+        config.collect_tweets_interval,
+        config.collect_tweets_adaptive_polling_max_interval_sec,
+        config.collect_tweets_adaptive_polling_headroom,
+        config.collect_tweets_adaptive_polling_smoothing,
+        config.collect_tweets_adaptive_polling_max_count,
+    )
+    rate_limit = state_store.get_rate_limit_state(LISTS_STATUSES, config.collect_tweets_rate_limit)
+    allowance = scheduler.allowance(rate_limit, now)
+    if shard is not None:
+        # all shards draw from the same rate limit window
+        allowance = shard_allowance(allowance, shard.shard, shard.shard_count)
+    states = [state_store.get_list_state(l.twitter_list) for l in list_configs.values()]
+    scheduled, skipped = scheduler.schedule(states, allowance, now)
+    budget = RequestBudget(rate_limit, allowance, reserved=len(scheduled))
+    for state in skipped:
+        config.log.info('collect_tweets:handle:skipped', {
+            'list_slug': state.twitter_list.slug,
+            'list_owner': state.twitter_list.owner_screen_name,
+            'last_polled_at': state.last_polled_at,
+        })
+    # all pages are gathered first, so that a tweet found in several lists is published once
     with concurrent.futures.ThreadPoolExecutor() as pool:
-        pool.map(lambda l: handle_list(twitter, l, cached_ddb_table, sns, config.logger), list_configs)
+        fetched = list(pool.map(
+            lambda s: fetch_list(
+                twitter, list_configs[ListState.state_key(s.twitter_list)], s, max_pages, config.log, budget, policy
+            ),
+            scheduled
+        ))
+    polled = [(s, collected) for s, collected in zip(scheduled, fetched) if collected is not None]
+    failed = handle_tweets(
+        [(list_configs[ListState.state_key(s.twitter_list)], collected.tweets) for s, collected in polled],
+        cached_ddb_table, sns, config.log,
+    )
+    for state, collected in polled:
+        list_config = list_configs[ListState.state_key(state.twitter_list)]
+        update_list_state(list_config, state, collected, failed, state_store, config.log, int(now), policy)
+    state_store.put_rate_limit_state(budget.state, budget.used)
+    config.log.info('collect_tweets:handle:rate_limit', budget.dictionary)
+    config.log.info('collect_tweets:handle:local_cache', local_cache.stats)
+    if shard is not None:
+        config.log.info('collect_tweets:handle:shard', {
+            'shard': shard.shard,
+            'shard_count': shard.shard_count,
+            'lists': len(list_configs),
+            'scheduled': len(scheduled),
+            'lag_ms': round((now - shard.scheduled_at) * 1000, 1) if shard.scheduled_at is not None else None,
+            'elapsed_ms': round((time.perf_counter() - start) * 1000, 1),
+        })
     return {}
 
 
-def handle_list(
+class CollectedTweets:
+    def __init__(self, tweets: List[Tweet], requests: int, complete: bool):
+        self._tweets = tweets
+        self._requests = requests
+        self._complete = complete
+
+    @property
+    def tweets(self) -> List[Tweet]:
+        return self._tweets
+
+    @property
+    def requests(self) -> int:
+        return self._requests
+
+    @property
+    def complete(self) -> bool:
+        # False when paging stopped before it reached since_id
+        return self._complete
+
+
+def fetch_list(
     api: TwitterAPI,
     list_config: CollectTweetsListConfig,
-    cached_ddb_table: DDBTableWithLocalCache,
-    sns,
-    logger: Logger
+    state: ListState,
+    max_pages: int,
+    log: StructuredLogger,
+    budget: Optional[RequestBudget] = None,
+    policy: Optional[PollingPolicy] = None,
+) -> Optional[CollectedTweets]:
+    count = (policy or PollingPolicy(enabled=False)).fetch_count(state, list_config.count)
+    try:
+        collected = collect_tweets(
+            api, list_config.twitter_list, count, state.since_id, max_pages, budget, state.max_id
+        )
+    except Exception as e:
+        log.error('collect_tweets:fetch_list:error', {
+            'list_slug': list_config.twitter_list.slug,
+            'list_owner': list_config.twitter_list.owner_screen_name,
+            'error': e.__str__(),
+        })
+        return None
+    if collected.requests == 0:
+        # not actually polled, keep its priority and state for the next run
+        return None
+    if not collected.complete:
+        log.warning('collect_tweets:fetch_list:truncated', {
+            'list_slug': list_config.twitter_list.slug,
+            'list_owner': list_config.twitter_list.owner_screen_name,
+            'since_id': state.since_id,
+            'max_id': state.max_id,
+            'count': count,
+            'sum': len(collected.tweets)
+        })
+    return collected
+
+
+def update_list_state(
+    list_config: CollectTweetsListConfig,
+    state: ListState,
+    collected: CollectedTweets,
+    failed: Set[int],
+    state_store: CollectorStateStore,
+    log: StructuredLogger,
+    polled_at: Optional[int] = None,
+    policy: Optional[PollingPolicy] = None,
 ):
-    tweets = collect_tweets(api, list_config.twitter_list, list_config.count)
-    handle_tweets(tweets, list_config, cached_ddb_table, sns, logger)
+    tweets = collected.tweets
+    polled_at = polled_at if polled_at is not None else int(time.time())
+    # the activity is estimated before the watermark moves, so that the first poll is not counted
+    (policy or PollingPolicy(enabled=False)).update(state, polled_at, len(tweets), list_config.count)
+    unpublished = [t.id for t in tweets if t.original_id in failed]
+    top_id = state.top_id if state.max_id is not None else max((t.id for t in tweets), default=None)
+    if unpublished:
+        # keep unpublished tweets above the watermark so that they are fetched again
+        since_id = min(unpublished) - 1 if collected.complete else state.since_id
+        state.set_gap(None, None)
+    elif not collected.complete:
+        # the older part is fetched on the next run before the watermark moves
+        since_id = state.since_id
+        state.set_gap(min(t.id for t in tweets) - 1 if tweets else state.max_id, top_id)
+    else:
+        since_id = top_id
+        state.set_gap(None, None)
+    if since_id is not None and (state.since_id is None or since_id > state.since_id):
+        state.since_id = since_id
+    state_store.put_list_state(state)
+    log.debug('collect_tweets:update_list_state', state.dictionary)
 
 
-def collect_tweets(api: TwitterAPI, twitter_list: TwitterList, count: int) -> List[Tweet]:
-    res = api.request('lists/statuses', {
+def collect_tweets(
+    api: TwitterAPI,
+    twitter_list: TwitterList,
+    count: int,
+    since_id: Optional[int] = None,
+    max_pages: int = 1,
+    budget: Optional[RequestBudget] = None,
+    max_id: Optional[int] = None,
+) -> CollectedTweets:
+    params = {
         'owner_screen_name': twitter_list.owner_screen_name,
         'slug': twitter_list.slug,
         'count': count,
         'tweet_mode': 'extended',
-    })
-    return [Tweet(x) for x in res]
+    }
+    if since_id is not None:
+        params['since_id'] = since_id
+    if max_id is not None:
+        params['max_id'] = max_id
+    tweets: List[Tweet] = []
+    requests = 0
+    for i in range(max_pages):
+        if budget is not None and not budget.acquire(reserved=i == 0):
+            break
+        res = api.request(LISTS_STATUSES, params)
+        requests += 1
+        if budget is not None:
+            budget.observe(getattr(res, 'headers', None))
+        try:
+            page = [Tweet(x) for x in res]
+        except TwitterRequestError as e:
+            # out of requests for this window: skip the rest and pick up from the watermark next time
+            if e.status_code == 429 and budget is not None:
+                budget.exhaust()
+                break
+            raise
+        tweets += page
+        # without a watermark (first run) only the latest page is fetched
+        if since_id is None:
+            return CollectedTweets(tweets, requests, True)
+        # a page with room left holds everything down to the watermark
+        if len(page) < count:
+            return CollectedTweets(tweets, requests, True)
+        params['max_id'] = min(t.id for t in page) - 1
+    # the last page fetched was full or no page could be fetched, so older tweets may be left
+    return CollectedTweets(tweets, requests, False)
+
+
+def merge_tweets(
+    collected: List[Tuple[CollectTweetsListConfig, List[Tweet]]],
+) -> Dict[int, Tuple[Tweet, TweetHandleOptions]]:
+    merged: Dict[int, Tuple[Tweet, TweetHandleOptions]] = {}
+    for list_config, tweets in collected:
+        for status in tweets:
+            if status.original_id in merged:
+                # the first status found is published with the most permissive options of all lists
+                first, options = merged[status.original_id]
+                merged[status.original_id] = (first, options.merge(list_config.options))
+            else:
+                merged[status.original_id] = (status, list_config.options)
+    return merged
 
 
 def handle_tweets(
-    tweet_list: List[Tweet],
-    list_config: CollectTweetsListConfig,
+    collected: List[Tuple[CollectTweetsListConfig, List[Tweet]]],
     cached_ddb_table: DDBTableWithLocalCache,
     sns,
-    logger: Logger,
-):
-    new = 0
-    for status in tweet_list:
-        if cached_ddb_table.get(status.original_id):
-            continue
-        else:
-            message = CollectTweetsMessage(status, list_config.options)
-            notify_message(sns, target_topic, message, logger)
-            cached_ddb_table.put(status.dictionary)
-            new += 1
-    logger.info(json.dumps({
-        'event': 'collect_tweets:handle_tweets:count',
-        'details': {
-            'list_slug': list_config.twitter_list.slug,
-            'list_owner': list_config.twitter_list.owner_screen_name,
-            'new': new,
-            'sum': len(tweet_list)
-        }
-    }))
+    log: StructuredLogger,
+) -> Set[int]:
+    publisher = BatchSNSPublisher(sns, target_topic, log)
+    merged = merge_tweets(collected)
+    seen = 0
+    claimed: List[int] = []
+    # one batched read filters the tweets already seen, so that only new ones cost a conditional write
+    known = cached_ddb_table.batch_get(list(merged.keys()))
+    try:
+        for original_id, (status, options) in merged.items():
+            # the conditional write both checks and marks the tweet, so concurrent collectors publish it once
+            if original_id in known or not cached_ddb_table.put_if_absent(status.dictionary):
+                seen += 1
+                continue
+            claimed.append(original_id)
+            notify_message(publisher, CollectTweetsMessage(status, options), log)
+    finally:
+        # batches sent before an error are published, so their claims have to be kept
+        result = publisher.flush()
+        # unpublished tweets are released so that the next run, which fetches them again, publishes them
+        for original_id in claimed:
+            if original_id in result.successful:
+                continue
+            try:
+                cached_ddb_table.delete(original_id)
+            except Exception as e:
+                log.error('collect_tweets:handle_tweets:release_failed', {
+                    'original_id': original_id,
+                    'error': e.__str__(),
+                })
+    log.info('collect_tweets:handle_tweets:count', {
+        'lists': len(collected),
+        'new': len(result.successful),
+        'seen': seen,
+        'failed': len(result.failed),
+        'unique': len(merged),
+        'sum': sum(len(tweets) for _, tweets in collected),
+    })
+    return set(result.failed)
 
 
-def notify_message(sns, topic: str, message: CollectTweetsMessage, logger: Logger):
+def notify_message(publisher: BatchSNSPublisher, message: CollectTweetsMessage, log: StructuredLogger):
     j = json.dumps(message.dictionary, ensure_ascii=False)
-    logger.debug(json.dumps({
-        'event': 'collect_tweets:notify_message:item',
-        'details': message.dictionary
-    }, ensure_ascii=False))
-    res = sns.publish(
-        TopicArn=topic,
-        Message=j,
-    )
-    logger.info(json.dumps({
-        'event': 'collect_tweets:notify_message:message_id',
-        'details': {'status_original_id': message.tweet.original_id, 'status_id': message.tweet.id, 'return': res}
-    }, ensure_ascii=False))
-
+    log.debug('collect_tweets:notify_message:item', lambda: message.dictionary)
+    publisher.publish(message.tweet.original_id, j)
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+from typing import Optional
+from decimal import Decimal
+from botocore.exceptions import ClientError
+
+from twitter import TwitterList
+from structured_logger import StructuredLogger
+
+
+class ListState:
+    def __init__(
+        self,
+        twitter_list: TwitterList,
+        since_id: Optional[int] = None,
+        last_polled_at: Optional[int] = None,
+        last_new: int = 0,
+        activity: Optional[float] = None,
+        next_poll_at: Optional[int] = None,
+        count: Optional[int] = None,
+        max_id: Optional[int] = None,
+        top_id: Optional[int] = None,
+    ):
+        self._twitter_list = twitter_list
+        self._since_id = since_id
+        self._max_id = max_id
+        self._top_id = top_id
+        self._last_polled_at = last_polled_at
+        self._last_new = last_new
+        self._activity = activity
+        self._next_poll_at = next_poll_at
+        self._count = count
+
+    @staticmethod
+    def state_key(twitter_list: TwitterList) -> str:
+        return f'list:{twitter_list.owner_screen_name}/{twitter_list.slug}'
+
+    @staticmethod
+    def of(twitter_list: TwitterList, d: dict) -> ListState:
+        since_id = d.get('since_id', None)
+        last_polled_at = d.get('last_polled_at', None)
+        activity = d.get('activity', None)
+        next_poll_at = d.get('next_poll_at', None)
+        count = d.get('count', None)
+        max_id = d.get('max_id', None)
+        top_id = d.get('top_id', None)
+        return ListState(
+            twitter_list,
+            int(since_id) if since_id is not None else None,
+            int(last_polled_at) if last_polled_at is not None else None,
+            int(d.get('last_new', 0)),
+            float(activity) if activity is not None else None,
+            int(next_poll_at) if next_poll_at is not None else None,
+            int(count) if count is not None else None,
+            int(max_id) if max_id is not None else None,
+            int(top_id) if top_id is not None else None,
+        )
+
+    @property
+    def twitter_list(self) -> TwitterList:
+        return self._twitter_list
+
+    @property
+    def since_id(self) -> Optional[int]:
+        return self._since_id
+
+    @since_id.setter
+    def since_id(self, since_id: Optional[int]):
+        self._since_id = since_id
+
+    @property
+    def max_id(self) -> Optional[int]:
+        # set while the tweets between since_id and max_id are still to be fetched
+        return self._max_id
+
+    @property
+    def top_id(self) -> Optional[int]:
+        # the newest tweet fetched before the gap, since_id moves here once the gap is filled
+        return self._top_id
+
+    def set_gap(self, max_id: Optional[int], top_id: Optional[int]):
+        self._max_id = max_id
+        self._top_id = top_id
+
+    @property
+    def last_polled_at(self) -> Optional[int]:
+        return self._last_polled_at
+
+    @property
+    def last_new(self) -> int:
+        return self._last_new
+
+    @property
+    def activity(self) -> Optional[float]:
+        # smoothed number of new tweets per minute
+        return self._activity
+
+    @property
+    def next_poll_at(self) -> Optional[int]:
+        return self._next_poll_at
+
+    @property
+    def count(self) -> Optional[int]:
+        return self._count
+
+    def is_due(self, now: float) -> bool:
+        return self._next_poll_at is None or self._next_poll_at <= now
+
+    def polled(
+        self,
+        polled_at: int,
+        new: int,
+        activity: Optional[float] = None,
+        next_poll_at: Optional[int] = None,
+        count: Optional[int] = None,
+    ):
+        self._last_polled_at = polled_at
+        self._last_new = new
+        self._activity = activity
+        self._next_poll_at = next_poll_at
+        self._count = count
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'state_key': ListState.state_key(self._twitter_list),
+            'since_id': self._since_id,
+            'last_polled_at': self._last_polled_at,
+            'last_new': self._last_new,
+            # DynamoDB does not accept float
+            'activity': Decimal(str(round(self._activity, 4))) if self._activity is not None else None,
+            'next_poll_at': self._next_poll_at,
+            'count': self._count,
+            'max_id': self._max_id,
+            'top_id': self._top_id,
+        }
+
+
+class RateLimitState:
+    def __init__(self, resource: str, limit: int, remaining: Optional[int] = None, reset: int = 0):
+        self._resource = resource
+        self._limit = limit
+        self._remaining = remaining if remaining is not None else limit
+        self._reset = reset
+
+    @staticmethod
+    def state_key(resource: str) -> str:
+        return f'ratelimit:{resource}'
+
+    @staticmethod
+    def of(resource: str, default_limit: int, d: dict) -> RateLimitState:
+        limit = int(d.get('limit', default_limit))
+        remaining = d.get('remaining', None)
+        return RateLimitState(
+            resource,
+            limit,
+            int(remaining) if remaining is not None else None,
+            int(d.get('reset', 0)),
+        )
+
+    @property
+    def resource(self) -> str:
+        return self._resource
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    @property
+    def remaining(self) -> int:
+        return self._remaining
+
+    @property
+    def reset(self) -> int:
+        return self._reset
+
+    def update(self, limit: int, remaining: int, reset: int):
+        # within a window responses may arrive out of order, so the lowest count wins
+        if reset != self._reset:
+            self._limit, self._remaining, self._reset = limit, remaining, reset
+        else:
+            self._remaining = min(self._remaining, remaining)
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'state_key': RateLimitState.state_key(self._resource),
+            'limit': self._limit,
+            'remaining': self._remaining,
+            'reset': self._reset,
+        }
+
+
+class CollectorStateStore:
+    def __init__(self, ddb_table):
+        self._table = ddb_table
+        self._log: Optional[StructuredLogger] = None
+
+    def set_logger(self, log: StructuredLogger):
+        self._log = log
+
+    def get_list_state(self, twitter_list: TwitterList) -> ListState:
+        try:
+            res = self._table.get_item(Key={'state_key': ListState.state_key(twitter_list)})
+            return ListState.of(twitter_list, res.get('Item', {}))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return ListState(twitter_list)
+            raise
+
+    def put_list_state(self, state: ListState):
+        self._table.put_item(Item=state.dictionary)
+        if self._log is not None:
+            self._log.debug('CollectorStateStore:put_list_state', state.dictionary)
+
+    def get_rate_limit_state(self, resource: str, default_limit: int) -> RateLimitState:
+        try:
+            res = self._table.get_item(Key={'state_key': RateLimitState.state_key(resource)})
+            return RateLimitState.of(resource, default_limit, res.get('Item', {}))
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return RateLimitState(resource, default_limit)
+            raise
+
+    def put_rate_limit_state(self, state: RateLimitState, used: int = 0):
+        # shards run concurrently, so within a window only the requests used by this run are subtracted
+        key = {'state_key': RateLimitState.state_key(state.resource)}
+        names = {'#reset': 'reset', '#remaining': 'remaining'}
+        try:
+            res = self._table.update_item(
+                Key=key,
+                UpdateExpression='ADD #remaining :used',
+                ConditionExpression='#reset = :reset',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={':used': -used, ':reset': state.reset},
+                ReturnValues='UPDATED_NEW',
+            )
+            if state.remaining < int(res['Attributes']['remaining']):
+                # the response headers also count requests made outside of this run
+                self._table.update_item(
+                    Key=key,
+                    UpdateExpression='SET #remaining = :remaining',
+                    ConditionExpression='#reset = :reset AND #remaining > :remaining',
+                    ExpressionAttributeNames=names,
+                    ExpressionAttributeValues={':remaining': state.remaining, ':reset': state.reset},
+                )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            self._put_rate_limit_window(state)
+        if self._log is not None:
+            self._log.debug('CollectorStateStore:put_rate_limit_state', {**state.dictionary, 'used': used})
+
+    def _put_rate_limit_window(self, state: RateLimitState):
+        # the first run of a new window starts it, a shard still in an older window must not overwrite it
+        try:
+            self._table.put_item(
+                Item=state.dictionary,
+                ConditionExpression='attribute_not_exists(state_key) OR #reset < :reset',
+                ExpressionAttributeNames={'#reset': 'reset'},
+                ExpressionAttributeValues={':reset': state.reset},
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+
+import math
+from typing import Optional
+
+from collector_state import ListState
+
+
+class PollingPolicy:
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_interval_sec: int = 60,
+        max_interval_sec: int = 15 * 60,
+        headroom: float = 2.0,
+        smoothing: float = 0.3,
+        max_count: int = 200,
+    ):
+        self._enabled = enabled
+        self._min_interval_sec = min_interval_sec
+        self._max_interval_sec = max(min_interval_sec, max_interval_sec)
+        self._headroom = headroom
+        self._smoothing = smoothing
+        self._max_count = max_count
+
+    def activity(self, state: ListState, polled_at: int, new: int) -> Optional[float]:
+        # the first poll only fetches the latest page, which says nothing about the rate
+        if state.since_id is None or state.last_polled_at is None:
+            return state.activity
+        elapsed_min = max(1.0, (polled_at - state.last_polled_at) / 60)
+        observed = new / elapsed_min
+        if state.activity is None:
+            return observed
+        return self._smoothing * observed + (1 - self._smoothing) * state.activity
+
+    def interval_sec(self, activity: Optional[float], configured_count: int) -> int:
+        if not self._enabled or activity is None:
+            return self._min_interval_sec
+        if activity <= 0:
+            return self._max_interval_sec
+        # poll again before the expected number of new tweets fills a fraction of the configured page
+        sec = configured_count / self._headroom / activity * 60
+        return int(min(self._max_interval_sec, max(self._min_interval_sec, sec)))
+
+    def count(self, activity: Optional[float], interval_sec: int, configured_count: int) -> int:
+        if not self._enabled or activity is None:
+            return configured_count
+        expected = math.ceil(activity * interval_sec / 60 * self._headroom)
+        return min(self._max_count, max(configured_count, expected))
+
+    def fetch_count(self, state: ListState, configured_count: int) -> int:
+        # a count stored while adaptive polling was enabled must not outlive it
+        if not self._enabled or state.count is None:
+            return configured_count
+        return state.count
+
+    def update(self, state: ListState, polled_at: int, new: int, configured_count: int):
+        activity = self.activity(state, polled_at, new)
+        interval_sec = self.interval_sec(activity, configured_count)
+        count = self.count(activity, interval_sec, configured_count)
+        # scheduled invocations drift by a few seconds, so a list becomes due half an invocation early
+        next_poll_at = polled_at + interval_sec - self._min_interval_sec // 2
+        state.polled(polled_at, new, activity, next_poll_at, count)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import math
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from collector_state import ListState, RateLimitState
+
+LISTS_STATUSES = 'lists/statuses'
+
+
+class RequestBudget:
+    def __init__(self, state: RateLimitState, allowance: int, reserved: int = 0):
+        self._state = state
+        self._allowance = allowance
+        self._reserved = min(reserved, allowance)
+        self._used = 0
+        self._exhausted = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> RateLimitState:
+        return self._state
+
+    @property
+    def allowance(self) -> int:
+        return self._allowance
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    @property
+    def exhausted(self) -> bool:
+        return self._exhausted
+
+    def acquire(self, reserved: bool = False) -> bool:
+        with self._lock:
+            if self._state.remaining <= 0:
+                # another list or shard has used up the window
+                self._exhausted = True
+            if self._exhausted:
+                return False
+            if reserved and self._reserved > 0:
+                self._reserved -= 1
+            elif self._used + self._reserved >= self._allowance:
+                # further pages must not eat into the requests held for lists still waiting for their first page
+                return False
+            self._used += 1
+            self._state.update(self._state.limit, self._state.remaining - 1, self._state.reset)
+            return True
+
+    def observe(self, headers: Optional[Dict[str, str]]):
+        if not headers:
+            return
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except (KeyError, ValueError):
+            return
+        with self._lock:
+            self._state.update(limit, remaining, reset)
+            if self._state.remaining <= 0:
+                self._exhausted = True
+
+    def exhaust(self):
+        with self._lock:
+            self._exhausted = True
+            self._state.update(self._state.limit, 0, self._state.reset)
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'resource': self._state.resource,
+            'allowance': self._allowance,
+            'used': self._used,
+            'exhausted': self._exhausted,
+            'remaining': self._state.remaining,
+            'reset': self._state.reset,
+        }
+
+
+class ListScheduler:
+    def __init__(self, window_sec: int = 15 * 60, interval_sec: int = 60):
+        self._window_sec = window_sec
+        self._interval_sec = interval_sec
+
+    def allowance(self, state: RateLimitState, now: float) -> int:
+        if state.reset <= now:
+            # the previous window is over, the next response will tell the actual reset time
+            state.update(state.limit, state.limit, int(now) + self._window_sec)
+        # spread the rest of the window evenly over the scheduled invocations left in it
+        runs_left = max(1, math.ceil((state.reset - now) / self._interval_sec))
+        return max(0, math.ceil(state.remaining / runs_left))
+
+    @staticmethod
+    def priority(state: ListState, now: float) -> float:
+        if state.last_polled_at is None:
+            return float('inf')
+        return max(0.0, now - state.last_polled_at) * (1 + (state.activity or 0))
+
+    def schedule(
+        self,
+        states: List[ListState],
+        allowance: int,
+        now: float,
+    ) -> Tuple[List[ListState], List[ListState]]:
+        # lists which are not due yet are left out, only due lists over the allowance are skipped
+        due = [s for s in states if s.is_due(now)]
+        ordered = sorted(due, key=lambda s: ListScheduler.priority(s, now), reverse=True)
+        return ordered[:allowance], ordered[allowance:]
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import hashlib
+from typing import Dict, List, Optional
+
+from twitter import TwitterList
+from news_bot_config import CollectTweetsListConfig
+
+
+def shard_of(twitter_list: TwitterList, shard_count: int) -> int:
+    # hash() is salted per process, so the shard would change between invocations
+    key = f'{twitter_list.owner_screen_name}/{twitter_list.slug}'.lower()
+    return int(hashlib.sha1(key.encode('utf-8')).hexdigest(), 16) % shard_count
+
+
+def partition(
+    list_configs: List[CollectTweetsListConfig],
+    shard_count: int,
+) -> Dict[int, List[CollectTweetsListConfig]]:
+    shards: Dict[int, List[CollectTweetsListConfig]] = {}
+    for l in list_configs:
+        shards.setdefault(shard_of(l.twitter_list, shard_count), []).append(l)
+    return shards
+
+
+def shard_allowance(allowance: int, shard: int, shard_count: int) -> int:
+    # the remainder goes to the lowest shards so that the shards never use more than the whole
+    return allowance // shard_count + (1 if shard < allowance % shard_count else 0)
+
+
+class CollectTweetsShardMessage:
+    def __init__(self, shard: int, shard_count: int, scheduled_at: Optional[float] = None):
+        self._shard = shard
+        self._shard_count = shard_count
+        self._scheduled_at = scheduled_at
+
+    @staticmethod
+    def of(d: dict) -> CollectTweetsShardMessage:
+        scheduled_at = d.get('scheduled_at', None)
+        return CollectTweetsShardMessage(
+            int(d['shard']),
+            int(d['shard_count']),
+            float(scheduled_at) if scheduled_at is not None else None,
+        )
+
+    @property
+    def shard(self) -> int:
+        return self._shard
+
+    @property
+    def shard_count(self) -> int:
+        return self._shard_count
+
+    @property
+    def scheduled_at(self) -> Optional[float]:
+        return self._scheduled_at
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'shard': self._shard,
+            'shard_count': self._shard_count,
+            'scheduled_at': self._scheduled_at,
+        }
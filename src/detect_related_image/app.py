@@ -1,47 +1,88 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
 import boto3
+import hashlib
 import requests
-from logging import Logger
+from typing import Dict, Optional
 from botocore.exceptions import ClientError
 
-from message import DetectRelatedImageMessage
+from message import DetectRelatedImageMessage, DetectRelatedImageBatchMessage
 from news_bot_config import NewsBotConfig
+from structured_logger import StructuredLogger
+from result_cache import ResultCache, DDBResultCache, SQLiteResultCache
+from early_exit import evaluate_until_match
 
 stage = os.environ['Stage']
 config_bucket = os.environ['ConfigBucket']
 config_key_name = os.environ['ConfigKeyName']
+ddb_result_cache_table_name = os.environ['DDBResultCacheTable']
 
 rekognition_cli = boto3.client('rekognition', region_name='us-east-1')
+result_cache: ResultCache = DDBResultCache(boto3.resource('dynamodb').Table(ddb_result_cache_table_name)) \
+    if stage != 'local' else SQLiteResultCache('/tmp/detection_result_cache.sqlite3')
 
-source_img = None
+source_images: Dict[str, bytes] = {}
 
 
 def lambda_handler(event, _):
     config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
-    config.logger.info(json.dumps({
-        'event': 'detect_related_image:lambda_handler:event',
-        'details': event,
-    }))
+    config.log.info('detect_related_image:lambda_handler:event', event)
     try:
-        global source_img
-        if source_img is None:
-            source_img = requests.get(config.detect_face_source_image_url).content
-        return handle(event, source_img, config.detect_face_similarity_threshold, rekognition_cli, config.logger)
+        return handle(
+            event,
+            load_source_image(config.detect_face_source_image_url),
+            config.detect_face_similarity_threshold,
+            rekognition_cli,
+            config.log,
+            result_cache if config.detect_face_result_cache_ttl > 0 else None,
+            config.image_detection_version,
+            config.detect_face_result_cache_ttl,
+            config.detect_face_max_concurrency,
+        )
     except Exception as e:
-        config.logger.error(json.dumps({
-            'event': 'detect_related_image:detect_related_image',
-            'details': e.__str__()
-        }))
+        config.log.error('detect_related_image:detect_related_image', e.__str__())
         raise e
 
 
-def handle(event: dict, source_image: bytes, similarity_threshold: int, rekognition, logger: Logger):
+def load_source_image(url: str) -> bytes:
+    # the config may point at another source image between warm invocations
+    if url not in source_images:
+        source_images.clear()
+        source_images[url] = requests.get(url).content
+    return source_images[url]
+
+
+def handle(
+    event: dict,
+    source_image: bytes,
+    similarity_threshold: int,
+    rekognition,
+    log: StructuredLogger,
+    cache: Optional[ResultCache] = None,
+    cache_version: str = '',
+    cache_ttl: int = 0,
+    max_workers: int = 4,
+):
+    def evaluate(image_url: str) -> int:
+        return detect_related_image(
+            DetectRelatedImageMessage(image_url),
+            source_image, similarity_threshold, rekognition, log, cache, cache_version, cache_ttl
+        )
+
+    batch = DetectRelatedImageBatchMessage.of(event)
+    if batch is not None:
+        result = evaluate_until_match(batch.image_urls, evaluate, lambda s: s >= similarity_threshold, max_workers)
+        for image_url, e in result.errors.items():
+            log.error('detect_related_image:handle:error', {'image_url': image_url, 'error': e.__str__()})
+        return {
+            'similarities': result.results,
+            'matched_image_url': result.matched,
+            'failed_image_urls': list(result.errors.keys()),
+        }
+
     message = DetectRelatedImageMessage.of(event)
-    similarity = detect_related_image(message, source_image, similarity_threshold, rekognition, logger)
-    return {'similarity': similarity}
+    return {'similarity': evaluate(message.image_url)}
 
 
 def detect_related_image(
@@ -49,19 +90,43 @@ def detect_related_image(
     source_image: bytes,
     similarity_threshold: int,
     rekognition,
-    logger: Logger
+    log: StructuredLogger,
+    cache: Optional[ResultCache] = None,
+    cache_version: str = '',
+    cache_ttl: int = 0,
+) -> int:
+    target_image = requests.get(message.image_url).content
+    # the same photo is often re-uploaded under another media URL
+    cache_key = 'image:sha256:' + hashlib.sha256(target_image).hexdigest()
+    if cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None and cached.get('version') == cache_version:
+            log.debug('detect_related_image:detect_related_image:cache_hit', {'cache_key': cache_key})
+            return cached['similarity']
+    similarity = compare_faces(source_image, target_image, similarity_threshold, rekognition, log)
+    if cache is not None:
+        cache.put(cache_key, {
+            'similarity': similarity,
+            'similarity_threshold': similarity_threshold,
+            'version': cache_version,
+        }, cache_ttl)
+    return similarity
+
+
+def compare_faces(
+    source_image: bytes,
+    target_image: bytes,
+    similarity_threshold: int,
+    rekognition,
+    log: StructuredLogger
 ) -> int:
     try:
-        target_image = requests.get(message.image_url).content
         res = rekognition.compare_faces(
             SourceImage={'Bytes': source_image},
             TargetImage={'Bytes': target_image},
             SimilarityThreshold=similarity_threshold
         )
-        logger.debug(json.dumps({
-            'event': 'detect_related_image:detect_related_image',
-            'details': res
-        }))
+        log.debug('detect_related_image:compare_faces', res)
         if res['FaceMatches'] is None or len(list(res['FaceMatches'])) == 0:
             return 0
         return res['FaceMatches'][0]['Similarity']
@@ -4,15 +4,21 @@ import os
 import json
 import boto3
 import string
+import functools
 import concurrent.futures
-from typing import Optional
-from logging import Logger
+from typing import Callable, Dict, Optional, List, Set, Tuple
 
 from tweet_handlers import TweetHandlers
+from detection_pipeline import Deadline, DetectionMode, DetectionPipeline, Stage, StageCancelPolicy, StageContext, \
+    StageResult
 from message import CollectTweetsMessage, RetweetMessage, TweetMessage, \
-    DetectRelatedImageMessage, DetectRelatedURLMessage
+    DetectRelatedImageMessage, DetectRelatedImageBatchMessage, DetectRelatedURLMessage, DeferredDetectionMessage
 from news_bot_config import NewsBotConfig
+from structured_logger import StructuredLogger
 from related_tweet_detector import RelatedTweetDetector
+from sns_publisher import BatchSNSPublisher
+from result_cache import ResultCache, DDBResultCache, SQLiteResultCache, canonicalize_url
+from early_exit import evaluate_until_match
 
 stage = os.environ['Stage']
 config_bucket = os.environ['ConfigBucket']
@@ -21,123 +27,327 @@ tweet_topic = os.environ['TweetTopic']
 retweet_topic = os.environ['RetweetTopic']
 detect_related_image = os.environ['DetectImageFunction']
 detect_related_url = os.environ['DetectURLFunction']
+deferred_detection_queue = os.environ['DeferredDetectionQueue']
+ddb_result_cache_table_name = os.environ['DDBResultCacheTable']
 
 # api clients
 sns_client = boto3.client('sns') if stage != 'local' \
     else boto3.client('sns', endpoint_url='http://localstack:4575')
 lambda_client = boto3.client('lambda') if stage != 'local' \
     else boto3.client('lambda', endpoint_url='http://localstack:4574')
+sqs_client = boto3.client('sqs') if stage != 'local' \
+    else boto3.client('sqs', endpoint_url='http://localstack:4576')
 
+# cache
+result_cache: ResultCache = DDBResultCache(boto3.resource('dynamodb').Table(ddb_result_cache_table_name)) \
+    if stage != 'local' else SQLiteResultCache('/tmp/detection_result_cache.sqlite3')
 
-def lambda_handler(event, _):
+
+def lambda_handler(event, context):
+    config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
+    return handle_event(event, context, config, DetectionMode[config.detection_mode])
+
+
+def worker_handler(event, context):
     config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
+    # the worker runs deferred stages itself; stages it cannot finish in time are queued again
+    return handle_event(event, context, config, DetectionMode.SYNC)
+
+
+def handle_event(event: dict, context, config: NewsBotConfig, mode: DetectionMode) -> dict:
+    retweet_publisher = BatchSNSPublisher(sns_client, retweet_topic, config.log)
+    tweet_publisher = BatchSNSPublisher(sns_client, tweet_topic, config.log)
     handlers = TweetHandlers(
-        retweet_handler=lambda m, k: retweet_handler(m, k, config.logger),
-        image_handler=lambda m: image_handler(m, config),
-        url_handler=lambda m: url_handler(m, config),
+        retweet_handler=lambda m, k: retweet_handler(m, k, retweet_publisher, config.log),
+        image_handler=lambda m, s: image_handler(m, config, retweet_publisher, tweet_publisher, result_cache, s),
+        url_handler=lambda m, s: url_handler(m, config, retweet_publisher, tweet_publisher, result_cache, s),
+    )
+    deadline = Deadline.of(context, config.detection_deadline_margin_ms)
+    return handle(
+        event,
+        config,
+        handlers,
+        [retweet_publisher, tweet_publisher],
+        deadline,
+        lambda m: defer(m, config.log),
+        mode,
     )
-    return handle(event, config, handlers)
 
 
-def handle(event: dict, config: NewsBotConfig, handlers: TweetHandlers):
-    keyword_detector = config.keyword_detector
-    tweet_detector = RelatedTweetDetector(keyword_detector)
+def handle(
+    event: dict,
+    config: NewsBotConfig,
+    handlers: TweetHandlers,
+    publishers: Optional[List[BatchSNSPublisher]] = None,
+    deadline: Optional[Deadline] = None,
+    deferrer: Optional[Callable[[DeferredDetectionMessage], None]] = None,
+    mode: DetectionMode = DetectionMode.SYNC,
+) -> dict:
+    log = config.log
+    tweet_detector = RelatedTweetDetector(config.keyword_detector)
     records = event['Records']
-    messages = [CollectTweetsMessage.of(json.loads(r['body'])) for r in records]
-    with concurrent.futures.ThreadPoolExecutor() as pool:
-        pool.map(lambda m: handle_message(m, tweet_detector, handlers, config.logger), messages)
-    return {}
+    policy = StageCancelPolicy[config.detection_stage_cancel_policy]
+    messages: Dict[str, CollectTweetsMessage] = {}
+    deferrals: Dict[str, int] = {}
+    outcomes: Dict[str, str] = {}
+    try:
+        with DetectionPipeline(
+            policy,
+            max_workers=2 * max(len(records), 1),
+            deadline=deadline,
+            budgets_ms=config.detection_stage_budget_ms,
+        ) as pipeline, concurrent.futures.ThreadPoolExecutor() as pool:
+            futures = {}
+            for record in records:
+                message_id = record['messageId']
+                parsed = parse_record(record, log)
+                if parsed is None:
+                    outcomes[message_id] = 'invalid'
+                    continue
+                message, stages, attempts = parsed
+                messages[message_id] = message
+                deferrals[message_id] = attempts
+                futures[message_id] = pool.submit(
+                    handle_message, message, tweet_detector, handlers, pipeline, log, stages, mode
+                )
+            for message_id, future in futures.items():
+                outcomes[message_id] = message_outcome(
+                    message_id, messages[message_id], future, policy, deferrer, log,
+                    deferrals[message_id], config.detection_max_deferrals,
+                )
+    finally:
+        publish_failed: Set[str] = set()
+        for publisher in publishers or []:
+            publish_failed.update(str(k) for k in publisher.flush().failed)
+    for message_id, message in messages.items():
+        if outcomes[message_id] in ['succeeded', 'deferred'] and str(message.tweet.original_id) in publish_failed:
+            outcomes[message_id] = 'publish_failed'
+
+    counts = {'records': len(records), 'succeeded': 0, 'deferred': 0, 'failed': 0, 'publish_failed': 0, 'invalid': 0}
+    for outcome in outcomes.values():
+        counts[outcome] += 1
+    log.info('detect_related_tweet:handle:outcome', counts)
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': message_id} for message_id, outcome in outcomes.items()
+            if outcome not in ['succeeded', 'deferred']
+        ],
+    }
+
+
+def parse_record(
+    record: dict,
+    log: StructuredLogger,
+) -> Optional[Tuple[CollectTweetsMessage, Optional[List[str]], int]]:
+    parsed, error = None, None
+    try:
+        body = json.loads(record['body'])
+        # records from DeferredDetectionQueue only carry the stages left to run
+        if 'stages' in body:
+            deferred = DeferredDetectionMessage.of(body)
+            parsed = (deferred.message, deferred.stages, deferred.attempts) if deferred is not None else None
+        else:
+            message = CollectTweetsMessage.of(body)
+            parsed = (message, None, 0) if message is not None else None
+        if parsed is None:
+            error = 'invalid message'
+    except ValueError as e:
+        error = e.__str__()
+    if error is not None:
+        log.error('detect_related_tweet:parse_record:error', {'message_id': record['messageId'], 'error': error})
+    return parsed
+
+
+def message_outcome(
+    message_id: str,
+    message: CollectTweetsMessage,
+    future: concurrent.futures.Future,
+    policy: StageCancelPolicy,
+    deferrer: Optional[Callable[[DeferredDetectionMessage], None]],
+    log: StructuredLogger,
+    deferrals: int = 0,
+    max_deferrals: int = 3,
+) -> str:
+    try:
+        stage_results: List[StageResult] = future.result()
+    except Exception as e:
+        log.error('detect_related_tweet:handle_message:error', {'message_id': message_id, 'error': e.__str__()})
+        return 'failed'
+    retweeted = any(r.retweeted for r in stage_results)
+    # a stage error only matters when no other stage already retweeted the status
+    if any(r.error is not None for r in stage_results) and not retweeted:
+        return 'failed'
+    deferred_stages = [r.name for r in stage_results if r.deferred]
+    if len(deferred_stages) == 0 or (retweeted and policy == StageCancelPolicy.CANCEL_ON_RETWEET):
+        return 'succeeded'
+    if deferrer is None:
+        return 'failed'
+    if deferrals >= max_deferrals:
+        # a stage that never fits in the deadline would otherwise bounce between the queues forever
+        log.error('detect_related_tweet:defer:gave_up', {
+            'message_id': message_id,
+            'status_id': message.tweet.id,
+            'stages': deferred_stages,
+            'attempts': deferrals,
+        })
+        return 'failed'
+    try:
+        deferrer(DeferredDetectionMessage(message, deferred_stages, deferrals + 1))
+    except Exception as e:
+        log.error('detect_related_tweet:defer:error', {'message_id': message_id, 'error': e.__str__()})
+        return 'failed'
+    return 'deferred'
+
+
+def defer(m: DeferredDetectionMessage, log: StructuredLogger):
+    log.info('detect_related_tweet:defer', lambda: {
+        'status_id': m.message.tweet.id,
+        'stages': m.stages,
+        'attempts': m.attempts,
+    })
+    sqs_client.send_message(QueueUrl=deferred_detection_queue, MessageBody=json.dumps(m.dictionary, ensure_ascii=False))
 
 
 def handle_message(
     message: CollectTweetsMessage,
     detector: RelatedTweetDetector,
     handlers: TweetHandlers,
-    logger: Logger,
-):
-    result = detector.detect(message.tweet, message.options)
-    logger.info(json.dumps({
-        'event': 'detect_related_tweet:handle_message',
-        'details': {
+    pipeline: DetectionPipeline,
+    log: StructuredLogger,
+    stage_names: Optional[List[str]] = None,
+    mode: DetectionMode = DetectionMode.SYNC,
+) -> List[StageResult]:
+    if stage_names is None:
+        result = detector.detect(message.tweet, message.options)
+        log.info('detect_related_tweet:handle_message', {
             'status_id': message.tweet.id,
             'result': result.dictionary
-        }
-    }, ensure_ascii=False))
-    if result.retweet_needed:
-        handlers.retweet_handler(message, result.matched_keyword)
-    if result.image_detection_needed:
-        handlers.image_handler(message)
-    if result.url_detection_needed:
-        handlers.url_handler(message)
+        })
+        if result.retweet_needed:
+            handlers.retweet_handler(message, result.matched_keyword)
+        stage_names = []
+        if result.image_detection_needed:
+            stage_names.append('image')
+        if result.url_detection_needed:
+            stage_names.append('url')
+        # slow stages are left to DetectionWorkerFunction so keyword hits are not held back
+        if mode == DetectionMode.ASYNC:
+            return [StageResult(name, deferred=True) for name in stage_names]
+    stage_handlers = {
+        'image': handlers.image_handler,
+        'url': handlers.url_handler,
+    }
+    stages: List[Tuple[str, Stage]] = [
+        (name, functools.partial(stage_handlers[name], message)) for name in stage_names
+    ]
+    if len(stages) == 0:
+        return []
+    stage_results = pipeline.run(stages)
+    log.info('detect_related_tweet:handle_message:stages', lambda: {
+        'status_id': message.tweet.id,
+        'stages': [r.dictionary for r in stage_results],
+    })
+    return stage_results
 
 
-def retweet_handler(message: CollectTweetsMessage, detected_text: Optional[str], logger: Logger):
+def retweet_handler(
+    message: CollectTweetsMessage,
+    detected_text: Optional[str],
+    retweet_publisher: BatchSNSPublisher,
+    log: StructuredLogger,
+):
     m = RetweetMessage(str(message.tweet.original_id), {
         'detector': 'detect_related_tweet',
         'detected_text': detected_text,
     })
-    retweet(m, logger)
+    retweet(m, retweet_publisher, log)
 
 
-def image_handler(message: CollectTweetsMessage, config: NewsBotConfig):
-    logger = config.logger
+def image_handler(
+    message: CollectTweetsMessage,
+    config: NewsBotConfig,
+    retweet_publisher: BatchSNSPublisher,
+    tweet_publisher: BatchSNSPublisher,
+    cache: Optional[ResultCache] = None,
+    stage: Optional[StageContext] = None,
+) -> bool:
+    log = config.log
+    stage = stage or StageContext()
     if config.detect_face_source_image_url is None:
-        logger.warning(json.dumps({
-            'event': 'detect_related_tweet:image_handler',
-            'details': 'config.detect_face_source_image_url is None'
-        }, ensure_ascii=False))
-        return
+        log.warning('detect_related_tweet:image_handler', 'config.detect_face_source_image_url is None')
+        return False
 
-    for image_url in message.tweet.media_https_urls:
+    threshold = config.detect_face_similarity_threshold
+    image_urls = message.tweet.media_https_urls
+    if config.detect_face_batch_invocation and len(image_urls) > 1:
         try:
-            payload = json.dumps(DetectRelatedImageMessage(image_url).dictionary).encode('utf-8')
-            res = lambda_client.invoke(
-                FunctionName=detect_related_image,
-                InvocationType='RequestResponse',
-                Payload=payload,
-            )
-            similarity = json.loads(res['Payload'].read().decode("utf-8")).get('similarity', 0)
-            dic = {
-                'status_id': message.tweet.id,
-                'image_url': image_url,
-                'similarity': '{0:.2f}'.format(similarity),
-                'status_url': message.tweet.status_url,
-            }
-            logger.debug(json.dumps({
-                'event': 'detect_related_tweet:image_handler',
-                'details': dic,
-            }, ensure_ascii=False))
-            if similarity >= config.detect_face_similarity_threshold:
-                retweet_message = RetweetMessage(str(message.tweet.original_id), {
-                    'detector': 'detect_related_image',
-                    'image_url': image_url,
-                    'similarity': similarity,
-                })
-                retweet(retweet_message, logger)
-                if config.image_detection_message_template:
-                    template = string.Template(json.dumps(config.image_detection_message_template, ensure_ascii=False))
-                    status = template.substitute(dic).strip("\"")
-                    tweet_message = TweetMessage(status)
-                    tweet(tweet_message, logger)
-                return
+            similarities = detect_images(image_urls, config, cache)
         except Exception as e:
-            logger.error(json.dumps({
-                'event': 'detect_related_tweet:image_handler:error',
-                'details': e.__str__()
-            }, ensure_ascii=False))
+            log.error('detect_related_tweet:image_handler:error', e.__str__())
+            raise
+        matched = next((u for u in image_urls if similarities.get(u, 0) >= threshold), None)
+    else:
+        result = evaluate_until_match(
+            image_urls,
+            # images not started yet are skipped once another stage has retweeted
+            lambda u: 0 if stage.cancelled else detect_image(u, config, cache),
+            lambda similarity: similarity >= threshold,
+            config.detect_face_max_concurrency,
+        )
+        for image_url, error in result.errors.items():
+            log.error('detect_related_tweet:image_handler:error', {'image_url': image_url, 'error': error.__str__()})
+        similarities, matched = result.results, result.matched
+        if result.matched is None and result.errors:
+            raise RuntimeError(f'failed to evaluate {len(result.errors)} image(s)')
+
+    for image_url, similarity in similarities.items():
+        log.debug('detect_related_tweet:image_handler', {
+            'status_id': message.tweet.id,
+            'image_url': image_url,
+            'similarity': '{0:.2f}'.format(similarity),
+        })
+    if matched is None or not stage.claim_retweet():
+        return False
+
+    similarity = similarities[matched]
+    dic = {
+        'status_id': message.tweet.id,
+        'image_url': matched,
+        'similarity': '{0:.2f}'.format(similarity),
+        'status_url': message.tweet.status_url,
+    }
+    retweet_message = RetweetMessage(str(message.tweet.original_id), {
+        'detector': 'detect_related_image',
+        'image_url': matched,
+        'similarity': similarity,
+    })
+    retweet(retweet_message, retweet_publisher, log)
+    if config.image_detection_message_template:
+        template = string.Template(json.dumps(config.image_detection_message_template, ensure_ascii=False))
+        status = template.substitute(dic).strip("\"")
+        tweet_message = TweetMessage(status)
+        tweet(tweet_message, tweet_publisher, log, str(message.tweet.original_id))
+    return True
 
 
-def url_handler(message: CollectTweetsMessage, config: NewsBotConfig):
-    logger = config.logger
+def url_handler(
+    message: CollectTweetsMessage,
+    config: NewsBotConfig,
+    retweet_publisher: BatchSNSPublisher,
+    tweet_publisher: BatchSNSPublisher,
+    cache: Optional[ResultCache] = None,
+    stage: Optional[StageContext] = None,
+) -> bool:
+    log = config.log
+    stage = stage or StageContext()
+    errors = 0
     for url in message.tweet.get_urls():
+        if stage.cancelled:
+            return False
+        # URLs already evaluated are served from the result cache when the stage is retried
+        stage.ensure_time_for(config.detection_stage_budget_ms['url'])
         try:
-            payload = json.dumps(DetectRelatedURLMessage(url).dictionary).encode('utf-8')
-            res = lambda_client.invoke(
-                FunctionName=detect_related_url,
-                InvocationType='RequestResponse',
-                Payload=payload,
-            )
-            result = json.loads(res['Payload'].read().decode("utf-8"))
+            result = detect_url(url, config, cache)
             detected_text = result.get('detected_text', None)
             selector = result.get('selector', None)
             dic = {
@@ -147,57 +357,142 @@ def url_handler(message: CollectTweetsMessage, config: NewsBotConfig):
                 'selector': selector,
                 'status_url': message.tweet.status_url,
             }
-            logger.debug(json.dumps({
-                'event': 'detect_related_tweet:url_handler',
-                'details': dic
-            }, ensure_ascii=False))
+            log.debug('detect_related_tweet:url_handler', dic)
             if detected_text is not None:
+                if not stage.claim_retweet():
+                    return False
                 retweet_message = RetweetMessage(str(message.tweet.original_id), {
                     'detector': 'detect_related_url',
                     'image_url': url,
                     'detected_text': detected_text,
                 })
-                retweet(retweet_message, logger)
+                retweet(retweet_message, retweet_publisher, log)
                 if config.url_detection_message_template:
                     template = string.Template(json.dumps(config.url_detection_message_template, ensure_ascii=False))
                     status = template.substitute(dic).strip("\"")
                     tweet_message = TweetMessage(status)
-                    tweet(tweet_message, logger)
-                return
+                    tweet(tweet_message, tweet_publisher, log, str(message.tweet.original_id))
+                return True
         except Exception as e:
-            logger.error(json.dumps({
-                'event': 'detect_related_tweet:url_handler:error',
-                'details': e.__str__()
-            }, ensure_ascii=False))
+            log.error('detect_related_tweet:url_handler:error', e.__str__())
+            errors += 1
+    if errors > 0:
+        raise RuntimeError(f'failed to evaluate {errors} URL(s)')
+    return False
 
 
-def tweet(m: TweetMessage, logger: Logger):
-    j = json.dumps(m.dictionary, ensure_ascii=False)
-    logger.debug(json.dumps({
-        'event': 'detect_related_tweet:tweet:item',
-        'details': m.dictionary
-    }, ensure_ascii=False))
-    res = sns_client.publish(
-        TopicArn=tweet_topic,
-        Message=j,
+def detect_image(image_url: str, config: NewsBotConfig, cache: Optional[ResultCache]) -> float:
+    cached = cached_similarity(image_url, config, cache)
+    if cached is not None:
+        return cached
+    payload = json.dumps(DetectRelatedImageMessage(image_url).dictionary).encode('utf-8')
+    res = lambda_client.invoke(
+        FunctionName=detect_related_image,
+        InvocationType='RequestResponse',
+        Payload=payload,
     )
-    logger.info(json.dumps({
-        'event': 'detect_related_tweet:tweet:message_id',
-        'details': {'text': m.status, 'return': res}
-    }, ensure_ascii=False))
+    result = json.loads(res['Payload'].read().decode("utf-8"))
+    if 'FunctionError' in res:
+        raise RuntimeError(result.get('errorMessage', 'DetectRelatedImageFunction failed'))
+    similarity = result.get('similarity', 0)
+    cache_similarity(image_url, similarity, config, cache)
+    return similarity
 
 
-def retweet(m: RetweetMessage, logger: Logger):
-    j = json.dumps(m.dictionary, ensure_ascii=False)
-    logger.debug(json.dumps({
-        'event': 'detect_related_tweet:retweet:item',
-        'details': m.dictionary
-    }, ensure_ascii=False))
-    res = sns_client.publish(
-        TopicArn=retweet_topic,
-        Message=j,
+def detect_images(image_urls: List[str], config: NewsBotConfig, cache: Optional[ResultCache]) -> Dict[str, float]:
+    similarities = {}
+    for image_url in image_urls:
+        cached = cached_similarity(image_url, config, cache)
+        if cached is not None:
+            similarities[image_url] = cached
+            if cached >= config.detect_face_similarity_threshold:
+                return similarities
+    uncached = [u for u in image_urls if u not in similarities]
+    if len(uncached) == 0:
+        return similarities
+    payload = json.dumps(DetectRelatedImageBatchMessage(uncached).dictionary).encode('utf-8')
+    res = lambda_client.invoke(
+        FunctionName=detect_related_image,
+        InvocationType='RequestResponse',
+        Payload=payload,
     )
-    logger.info(json.dumps({
-        'event': 'detect_related_tweet:retweet:message_id',
-        'details': {'status_original_id': m.id_str, 'return': res}
-    }, ensure_ascii=False))
+    result = json.loads(res['Payload'].read().decode("utf-8"))
+    if 'FunctionError' in res:
+        raise RuntimeError(result.get('errorMessage', 'DetectRelatedImageFunction failed'))
+    for image_url, similarity in result.get('similarities', {}).items():
+        similarities[image_url] = similarity
+        cache_similarity(image_url, similarity, config, cache)
+    failed = result.get('failed_image_urls', [])
+    # an image that could not be evaluated may still be the match, so the message has to be retried
+    if failed and all(s < config.detect_face_similarity_threshold for s in similarities.values()):
+        raise RuntimeError(f'failed to evaluate {len(failed)} image(s): {failed}')
+    return similarities
+
+
+def cached_similarity(image_url: str, config: NewsBotConfig, cache: Optional[ResultCache]) -> Optional[float]:
+    if cache is None or config.detect_face_result_cache_ttl <= 0:
+        return None
+    cache_key = 'image:url:' + canonicalize_url(image_url)
+    cached = cache.get(cache_key)
+    # similarities computed against another source image or threshold are stale
+    if cached is None or cached.get('version') != config.image_detection_version:
+        return None
+    config.log.debug('detect_related_tweet:detect_image:cache_hit', {'url': image_url, 'cache_key': cache_key})
+    return cached['similarity']
+
+
+def cache_similarity(image_url: str, similarity: float, config: NewsBotConfig, cache: Optional[ResultCache]):
+    if cache is None or config.detect_face_result_cache_ttl <= 0:
+        return
+    cache.put('image:url:' + canonicalize_url(image_url), {
+        'similarity': similarity,
+        'source_image_url': config.detect_face_source_image_url,
+        'similarity_threshold': config.detect_face_similarity_threshold,
+        'version': config.image_detection_version,
+    }, config.detect_face_result_cache_ttl)
+
+
+def detect_url(url: str, config: NewsBotConfig, cache: Optional[ResultCache]) -> dict:
+    ttl = config.url_result_cache_ttl
+    version = config.url_detection_version
+    cache_key = 'url:' + canonicalize_url(url)
+    if cache is not None and ttl > 0:
+        cached = cache.get(cache_key)
+        # results computed with other keywords or selectors are stale
+        if cached is not None and cached.get('version') == version:
+            config.log.debug('detect_related_tweet:detect_url:cache_hit', {'url': url, 'cache_key': cache_key})
+            return cached
+    payload = json.dumps(DetectRelatedURLMessage(url).dictionary).encode('utf-8')
+    res = lambda_client.invoke(
+        FunctionName=detect_related_url,
+        InvocationType='RequestResponse',
+        Payload=payload,
+    )
+    result = json.loads(res['Payload'].read().decode("utf-8"))
+    if 'FunctionError' in res:
+        raise RuntimeError(result.get('errorMessage', 'DetectRelatedURLFunction failed'))
+    if cache is not None and ttl > 0:
+        value = {
+            'expanded_url': result.get('expanded_url', None),
+            'selector': result.get('selector', None),
+            'detected_text': result.get('detected_text', None),
+            'version': version,
+        }
+        cache.put(cache_key, value, ttl)
+        if value['expanded_url'] is not None:
+            expanded_cache_key = 'url:' + canonicalize_url(value['expanded_url'])
+            if expanded_cache_key != cache_key:
+                cache.put(expanded_cache_key, value, ttl)
+    return result
+
+
+def tweet(m: TweetMessage, publisher: BatchSNSPublisher, log: StructuredLogger, key: Optional[str] = None):
+    j = json.dumps(m.dictionary, ensure_ascii=False)
+    log.debug('detect_related_tweet:tweet:item', m.dictionary)
+    publisher.publish(key or m.status, j)
+
+
+def retweet(m: RetweetMessage, publisher: BatchSNSPublisher, log: StructuredLogger):
+    j = json.dumps(m.dictionary, ensure_ascii=False)
+    log.debug('detect_related_tweet:retweet:item', m.dictionary)
+    publisher.publish(m.id_str, j)
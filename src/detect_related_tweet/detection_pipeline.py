@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import sys
+import time
+import threading
+import concurrent.futures
+from enum import Enum
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class DetectionMode(Enum):
+    SYNC = 'SYNC'
+    ASYNC = 'ASYNC'
+
+
+class StageCancelPolicy(Enum):
+    NONE = 'NONE'
+    CANCEL_ON_RETWEET = 'CANCEL_ON_RETWEET'
+
+
+class Deadline:
+    def __init__(self, remaining_time_in_millis: Callable[[], int], margin_ms: int = 0):
+        self._remaining_time_in_millis = remaining_time_in_millis
+        self._margin_ms = margin_ms
+
+    @staticmethod
+    def of(context, margin_ms: int = 0) -> Deadline:
+        if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+            return Deadline.unlimited()
+        return Deadline(context.get_remaining_time_in_millis, margin_ms)
+
+    @staticmethod
+    def unlimited() -> Deadline:
+        return Deadline(lambda: sys.maxsize)
+
+    @property
+    def remaining_ms(self) -> int:
+        return self._remaining_time_in_millis() - self._margin_ms
+
+    def allows(self, budget_ms: int) -> bool:
+        return self.remaining_ms >= budget_ms
+
+
+class StageDeferred(Exception):
+    pass
+
+
+class StageContext:
+    def __init__(self, policy: StageCancelPolicy = StageCancelPolicy.NONE, deadline: Optional[Deadline] = None):
+        self._policy = policy
+        self._deadline = deadline or Deadline.unlimited()
+        self._cancelled = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    @property
+    def deadline(self) -> Deadline:
+        return self._deadline
+
+    def ensure_time_for(self, budget_ms: int):
+        if not self._deadline.allows(budget_ms):
+            raise StageDeferred(f'{self._deadline.remaining_ms}ms left, {budget_ms}ms needed')
+
+    def claim_retweet(self) -> bool:
+        with self._lock:
+            if self._cancelled.is_set():
+                return False
+            if self._policy == StageCancelPolicy.CANCEL_ON_RETWEET:
+                self._cancelled.set()
+            return True
+
+
+Stage = Callable[[StageContext], bool]
+
+
+class StageResult:
+    def __init__(
+        self,
+        name: str,
+        retweeted: bool = False,
+        elapsed_ms: float = 0,
+        cancelled: bool = False,
+        error: Optional[str] = None,
+        deferred: bool = False,
+    ):
+        self._name = name
+        self._retweeted = retweeted
+        self._elapsed_ms = elapsed_ms
+        self._cancelled = cancelled
+        self._error = error
+        self._deferred = deferred
+
+    @property
+    def name(self) -> str:
+        return self._name
+
+    @property
+    def retweeted(self) -> bool:
+        return self._retweeted
+
+    @property
+    def elapsed_ms(self) -> float:
+        return self._elapsed_ms
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    @property
+    def error(self) -> Optional[str]:
+        return self._error
+
+    @property
+    def deferred(self) -> bool:
+        return self._deferred
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'stage': self._name,
+            'retweeted': self._retweeted,
+            'elapsed_ms': round(self._elapsed_ms, 1),
+            'cancelled': self._cancelled,
+            'error': self._error,
+            'deferred': self._deferred,
+        }
+
+
+class DetectionPipeline:
+    def __init__(
+        self,
+        policy: StageCancelPolicy = StageCancelPolicy.NONE,
+        max_workers: int = 2,
+        deadline: Optional[Deadline] = None,
+        budgets_ms: Optional[Dict[str, int]] = None,
+    ):
+        self._policy = policy
+        self._deadline = deadline or Deadline.unlimited()
+        self._budgets_ms = budgets_ms or {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    @property
+    def policy(self) -> StageCancelPolicy:
+        return self._policy
+
+    def budget_ms(self, name: str) -> int:
+        return self._budgets_ms.get(name, 0)
+
+    def run(self, stages: List[Tuple[str, Stage]]) -> List[StageResult]:
+        context = StageContext(self._policy, self._deadline)
+        if len(stages) <= 1:
+            return [self._run_stage(name, stage, context) for name, stage in stages]
+        futures = [self._executor.submit(self._run_stage, name, stage, context) for name, stage in stages]
+        return [f.result() for f in futures]
+
+    def _run_stage(self, name: str, stage: Stage, context: StageContext) -> StageResult:
+        if context.cancelled:
+            return StageResult(name, cancelled=True)
+        # a stage which cannot finish before the function times out is handed to the follow-up queue
+        if not context.deadline.allows(self.budget_ms(name)):
+            return StageResult(name, deferred=True)
+        start = time.perf_counter()
+        retweeted, error, deferred = False, None, False
+        try:
+            retweeted = bool(stage(context))
+        except StageDeferred:
+            deferred = True
+        except Exception as e:
+            error = e.__str__()
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        return StageResult(name, retweeted, elapsed_ms, context.cancelled and not retweeted, error, deferred)
@@ -3,14 +3,15 @@
 from typing import Callable
 
 from message import CollectTweetsMessage
+from detection_pipeline import StageContext
 
 
 class TweetHandlers:
     def __init__(
         self,
         retweet_handler: Callable[[CollectTweetsMessage, str], None],
-        image_handler: Callable[[CollectTweetsMessage], None],
-        url_handler: Callable[[CollectTweetsMessage], None],
+        image_handler: Callable[[CollectTweetsMessage, StageContext], bool],
+        url_handler: Callable[[CollectTweetsMessage, StageContext], bool],
     ):
         self._retweet_handler = retweet_handler
         self._image_handler = image_handler
@@ -21,9 +22,9 @@ class TweetHandlers:
         return self._retweet_handler
 
     @property
-    def image_handler(self) -> Callable[[CollectTweetsMessage], None]:
+    def image_handler(self) -> Callable[[CollectTweetsMessage, StageContext], bool]:
         return self._image_handler
 
     @property
-    def url_handler(self) -> Callable[[CollectTweetsMessage], None]:
+    def url_handler(self) -> Callable[[CollectTweetsMessage, StageContext], bool]:
         return self._url_handler
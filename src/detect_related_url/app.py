@@ -1,9 +1,10 @@
 # -*- coding: utf-8 -*-
 
 import os
-import json
-from typing import Optional
-from logging import Logger
+import requests
+from typing import Optional, Dict, Any
+from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
 
 from selenium.webdriver import Chrome
 from selenium.webdriver.common.by import By
@@ -15,16 +16,31 @@ from selenium.webdriver.support import expected_conditions
 from message import DetectRelatedURLMessage
 from css_selectors import Selectors
 from news_bot_config import NewsBotConfig
+from structured_logger import StructuredLogger
 
 stage = os.environ['Stage']
 config_bucket = os.environ['ConfigBucket']
 config_key_name = os.environ['ConfigKeyName']
 
-web_driver = None
+web_driver: Optional[Chrome] = None
+
+# pooled http client for the fast path
+http_session = requests.Session()
+http_session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+http_session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+http_session.headers.update({'User-Agent': 'Mozilla/5.0 (compatible; yoppinews-bot)'})
+
+# compiled selectors of the current config version
+selectors_cache: Dict[str, Any] = {'config': None, 'selectors': None}
 
 
 def lambda_handler(event, _):
     config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
+    message = DetectRelatedURLMessage.of(event)
+    return handle(message, get_selectors(config), web_driver, config)
+
+
+def get_web_driver() -> Chrome:
     global web_driver
     if web_driver is None:
         options = Options()
@@ -42,18 +58,40 @@ def lambda_handler(event, _):
         options.add_argument("--ignore-certificate-errors")
         options.binary_location = "/opt/bin/headless-chromium"
         web_driver = Chrome(executable_path="/opt/bin/chromedriver", chrome_options=options)
-    message = DetectRelatedURLMessage.of(event)
-    s = Selectors(config.detect_url_selectors, config.detect_url_ignored_urls)
-    return handle(message, s, web_driver, config)
+    return web_driver
+
 
+def get_selectors(config: NewsBotConfig) -> Selectors:
+    if selectors_cache['config'] is not config:
+        selectors_cache['selectors'] = Selectors(
+            config.detect_url_selectors,
+            config.detect_url_ignored_urls,
+            config.detect_url_js_rendered_urls,
+        )
+        selectors_cache['config'] = config
+    return selectors_cache['selectors']
 
-def handle(message: DetectRelatedURLMessage, selectors: Selectors, driver: Chrome, config: NewsBotConfig):
+
+def handle(
+    message: DetectRelatedURLMessage,
+    selectors: Selectors,
+    driver: Optional[Chrome],
+    config: NewsBotConfig,
+    session: requests.Session = http_session,
+):
     url = message.url
-    logger = config.logger
-    res = get_selected_text(url, selectors, driver, logger)
+    log = config.log
+    res = None
+    if config.detect_url_http_fast_path:
+        res = fetch_selected_text(
+            url, selectors, session, config.detect_url_http_timeout, log, config.detect_url_http_max_bytes
+        )
+    if res is None:
+        # headless chrome is started only when the page could not be handled over plain http
+        res = get_selected_text(url, selectors, driver if driver is not None else get_web_driver(), log)
     expanded_url = res.get('url', None) if res is not None else None
     selector = res.get('selector', 'body') if res is not None else None
-    selected_text = res.get('selected_text', '') if res is not None else None
+    selected_text = res.get('selected_text', '') if res is not None else ''
     detected_text = config.keyword_detector.find_related_keyword(selected_text)
     res = {
         'url': url,
@@ -61,11 +99,70 @@ def handle(message: DetectRelatedURLMessage, selectors: Selectors, driver: Chrom
         'selector': selector,
         'detected_text': detected_text,
     }
-    logger.info(json.dumps(res, ensure_ascii=False))
+    log.info('detect_related_url:handle', res)
     return res
 
 
-def get_selected_text(url: str, selectors: Selectors, driver: Chrome, logger: Logger) -> Optional[dict]:
+def fetch_selected_text(
+    url: str,
+    selectors: Selectors,
+    session: requests.Session,
+    timeout: int,
+    log: StructuredLogger,
+    max_bytes: int = 2 * 1024 * 1024,
+) -> Optional[dict]:
+    # pages known to need javascript are not worth a request
+    if selectors.is_js_rendered(url):
+        return None
+    try:
+        # the body is streamed, so that PDFs and videos are not downloaded just to be ignored
+        res = session.get(url, timeout=timeout, allow_redirects=True, stream=True)
+    except requests.RequestException as e:
+        log.warning('detect_related_url:fetch_selected_text:error', {'url': url, 'error': e.__str__()})
+        return None
+    try:
+        res.raise_for_status()
+        current_url = res.url
+        if selectors.is_js_rendered(current_url):
+            return None
+        selector = selectors.get_selector(current_url)
+        if selector is None or 'html' not in res.headers.get('Content-Type', 'text/html'):
+            return {
+                'url': current_url,
+                'selector': selector,
+                'selected_text': '',
+            }
+        content = read_content(res, max_bytes)
+    except requests.RequestException as e:
+        log.warning('detect_related_url:fetch_selected_text:error', {'url': url, 'error': e.__str__()})
+        return None
+    finally:
+        res.close()
+    soup = BeautifulSoup(content, 'html.parser')
+    for tag in soup(['script', 'style', 'noscript', 'template']):
+        tag.decompose()
+    element = soup.select_one(selector)
+    if element is None:
+        log.debug('detect_related_url:fetch_selected_text:not_found', {'url': current_url, 'selector': selector})
+        return None
+    return {
+        'url': current_url,
+        'selector': selector,
+        'selected_text': element.get_text(' ', strip=True),
+    }
+
+
+def read_content(res: requests.Response, max_bytes: int) -> bytes:
+    # an oversized page is cut off, the article body is usually near the top
+    content = bytearray()
+    for chunk in res.iter_content(chunk_size=64 * 1024):
+        content += chunk
+        if len(content) >= max_bytes:
+            break
+    return bytes(content[:max_bytes])
+
+
+def get_selected_text(url: str, selectors: Selectors, driver: Chrome, log: StructuredLogger) -> Optional[dict]:
     current_url = None
     selector = None
     try:
@@ -81,12 +178,9 @@ def get_selected_text(url: str, selectors: Selectors, driver: Chrome, logger: Lo
             'selected_text': selected_text,
         }
     except TimeoutException as e:
-        logger.error(json.dumps({
-            'event': 'detect_related_url:get_selected_text:timeout',
-            'details': {
-                'url': current_url or url,
-                'selector': selector,
-                'error': e.__str__()
-            }
-        }, ensure_ascii=False))
+        log.error('detect_related_url:get_selected_text:timeout', {
+            'url': current_url or url,
+            'selector': selector,
+            'error': e.__str__()
+        })
         return None
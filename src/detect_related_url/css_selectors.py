@@ -1,19 +1,64 @@
 # -*- coding: utf-8 -*-
 
 import re
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Pattern, Tuple
+from urllib.parse import urlsplit
+
+# patterns like 'http(s)?://example.com/path' or r'https://www\.example\.com' start with a literal host
+_HOST_PATTERN = re.compile(r'^(?:https?|http\(s\)\?|https\?)://((?:[A-Za-z0-9\-]|\\?\.)+)(?:$|/|:)')
+
+
+class CompiledPatterns:
+    def __init__(self, patterns: List[Tuple[str, Optional[str]]]):
+        self._by_host: Dict[str, List[Tuple[int, Pattern, Optional[str]]]] = {}
+        self._fallback: List[Tuple[int, Pattern, Optional[str]]] = []
+        for i, (pattern, value) in enumerate(patterns):
+            entry = (i, re.compile(pattern), value)
+            host = CompiledPatterns._literal_host(pattern)
+            if host is None:
+                self._fallback.append(entry)
+            else:
+                self._by_host.setdefault(host, []).append(entry)
+
+    @staticmethod
+    def _literal_host(pattern: str) -> Optional[str]:
+        m = _HOST_PATTERN.match(pattern)
+        if m is None:
+            return None
+        return m.group(1).replace('\\.', '.').lower()
+
+    def match(self, url: str, host: str) -> Tuple[bool, Optional[str]]:
+        candidates = self._by_host.get(host, [])
+        if self._fallback:
+            candidates = sorted(candidates + self._fallback, key=lambda e: e[0])
+        for _, pattern, value in candidates:
+            if pattern.match(url):
+                return True, value
+        return False, None
 
 
 class Selectors:
-    def __init__(self, selectors: Dict[str, str], ignored_urls: List[str]):
+    def __init__(self, selectors: Dict[str, str], ignored_urls: List[str], js_rendered_urls: Optional[List[str]] = None):
         self._selectors = selectors
         self._ignored_urls = ignored_urls
+        self._compiled_selectors = CompiledPatterns(list(selectors.items()))
+        self._compiled_ignored_urls = CompiledPatterns([(u, None) for u in ignored_urls])
+        self._compiled_js_rendered_urls = CompiledPatterns([(u, None) for u in js_rendered_urls or []])
+
+    @staticmethod
+    def _host(url: str) -> str:
+        return (urlsplit(url).hostname or '').lower()
+
+    def is_js_rendered(self, url: str) -> bool:
+        matched, _ = self._compiled_js_rendered_urls.match(url, Selectors._host(url))
+        return matched
 
     def get_selector(self, url: str) -> Optional[str]:
-        for u in self._ignored_urls:
-            if re.match(u, url):
-                return None
-        for reg, selector in self._selectors.items():
-            if re.match(reg, url):
-                return selector
+        host = Selectors._host(url)
+        ignored, _ = self._compiled_ignored_urls.match(url, host)
+        if ignored:
+            return None
+        matched, selector = self._compiled_selectors.match(url, host)
+        if matched:
+            return selector
         return 'body'
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+from typing import Callable, Dict, Generic, Hashable, List, Optional, TypeVar
+
+import concurrent.futures
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class EarlyExitResult(Generic[K, V]):
+    def __init__(self):
+        self.results: Dict[K, V] = {}
+        self.errors: Dict[K, Exception] = {}
+        self.matched: Optional[K] = None
+        self.cancelled: List[K] = []
+
+
+def evaluate_until_match(
+    items: List[K],
+    evaluate: Callable[[K], V],
+    is_match: Callable[[V], bool],
+    max_workers: int = 4,
+) -> EarlyExitResult[K, V]:
+    result: EarlyExitResult[K, V] = EarlyExitResult()
+    if len(items) <= 1 or max_workers <= 1:
+        for item in items:
+            if result.matched is not None:
+                result.cancelled.append(item)
+                continue
+            _record(item, lambda: evaluate(item), is_match, result)
+        return result
+
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=min(max_workers, len(items)))
+    try:
+        futures = {executor.submit(evaluate, item): item for item in items}
+        pending = set(futures.keys())
+        while pending and result.matched is None:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                _record(futures[f], f.result, is_match, result)
+        for f in pending:
+            # calls already in flight cannot be interrupted; their results are ignored
+            f.cancel()
+            result.cancelled.append(futures[f])
+    finally:
+        executor.shutdown(wait=False)
+    return result
+
+
+def _record(item, get_value: Callable, is_match: Callable, result: EarlyExitResult):
+    try:
+        value = get_value()
+    except Exception as e:
+        result.errors[item] = e
+        return
+    result.results[item] = value
+    if result.matched is None and is_match(value):
+        result.matched = item
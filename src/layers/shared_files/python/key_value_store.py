@@ -1,12 +1,16 @@
 # -*- coding: utf-8 -*-
 
 import json
+import time
 import decimal
 import datetime
-from logging import Logger
-from typing import Optional
+import threading
+from collections import OrderedDict
+from typing import Optional, List, Dict, Callable
 from botocore.exceptions import ClientError
 
+from structured_logger import StructuredLogger
+
 
 class InMemoryKeyValueStore:
     def __init__(self, dic: Optional[dict] = None):
@@ -15,78 +19,260 @@ class InMemoryKeyValueStore:
     def get(self, key: object) -> Optional[object]:
         return self.dic.get(key, None)
 
-    def put(self, key: object, item: object):
+    def put(self, key: object, item: object, expires_at: Optional[float] = None):
         self.dic[key] = item
 
+    def delete(self, key: object):
+        self.dic.pop(key, None)
+
+
+def approximate_size(obj: object) -> int:
+    if isinstance(obj, str):
+        return len(obj)
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return 2 + sum(approximate_size(k) + approximate_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set)):
+        return 2 + sum(approximate_size(v) for v in obj)
+    return 8
+
+
+class BoundedInMemoryKeyValueStore(InMemoryKeyValueStore):
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        ttl: Optional[int] = None,
+        sizeof: Callable[[object], int] = approximate_size,
+        clock: Callable[[], float] = time.time,
+    ):
+        super().__init__()
+        self.dic: OrderedDict = OrderedDict()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._sizeof = sizeof
+        self._clock = clock
+        self._expires_at: Dict[object, Optional[float]] = {}
+        self._sizes: Dict[object, int] = {}
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'entries': len(self.dic),
+            'bytes': self._bytes,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+            'expirations': self._expirations,
+        }
+
+    def get(self, key: object) -> Optional[object]:
+        with self._lock:
+            if key not in self.dic:
+                self._misses += 1
+                return None
+            expires_at = self._expires_at[key]
+            if expires_at is not None and expires_at <= self._clock():
+                self._remove(key)
+                self._expirations += 1
+                self._misses += 1
+                return None
+            self.dic.move_to_end(key)
+            self._hits += 1
+            return self.dic[key]
+
+    def put(self, key: object, item: object, expires_at: Optional[float] = None):
+        with self._lock:
+            if key in self.dic:
+                self._remove(key)
+            if expires_at is None and self._ttl is not None:
+                expires_at = self._clock() + self._ttl
+            size = self._sizeof(item)
+            self.dic[key] = item
+            self._expires_at[key] = expires_at
+            self._sizes[key] = size
+            self._bytes += size
+            self._evict()
+
+    def delete(self, key: object):
+        with self._lock:
+            if key in self.dic:
+                self._remove(key)
+
+    def _remove(self, key: object):
+        del self.dic[key]
+        del self._expires_at[key]
+        self._bytes -= self._sizes.pop(key)
+
+    def _evict(self):
+        while self.dic and (
+            (self._max_entries is not None and len(self.dic) > self._max_entries) or
+            (self._max_bytes is not None and self._bytes > self._max_bytes)
+        ):
+            key = next(iter(self.dic))
+            self._remove(key)
+            self._evictions += 1
+
 
 class DDBTableWithLocalCache:
-    def __init__(self, hash_key_name: str, ddb_table, in_memory_cache: InMemoryKeyValueStore = InMemoryKeyValueStore({})):
+    def __init__(self, hash_key_name: str, ddb_table, in_memory_cache: Optional[InMemoryKeyValueStore] = None):
         self._hash_key_name = hash_key_name
-        self._in_memory_cache = in_memory_cache
+        self._in_memory_cache = in_memory_cache if in_memory_cache is not None else InMemoryKeyValueStore()
         self._table = ddb_table
-        self._logger: Optional[Logger] = None
+        self._log: Optional[StructuredLogger] = None
 
-    def set_logger(self, logger: Logger):
-        self._logger = logger
-
-    @property
-    def _has_logger(self) -> bool:
-        return self._logger is not None
+    def set_logger(self, log: StructuredLogger):
+        self._log = log
 
     def get(self, key: object) -> Optional[object]:
+        log = self._log
         local_cache = self._in_memory_cache.get(key)
         if local_cache:
-            if self._has_logger:
-                self._logger.debug(json.dumps({
-                    'event': 'DDBTableWithLocalCache:get',
-                    'details': {'key': key, 'local_cache': True, 'remote_cache': False}
-                }))
+            if log is not None:
+                log.debug('DDBTableWithLocalCache:get', {'key': key, 'local_cache': True, 'remote_cache': False})
             return local_cache
         try:
             res = self._table.get_item(Key={self._hash_key_name: key})
             if 'Item' not in res:
-                if self._has_logger:
-                    self._logger.debug(json.dumps({
-                        'event': 'DDBTableWithLocalCache:get',
-                        'details': {'key': key, 'local_cache': False, 'remote_cache': False}
-                    }))
+                if log is not None:
+                    log.debug('DDBTableWithLocalCache:get', {
+                        'key': key, 'local_cache': False, 'remote_cache': False,
+                    })
                 return None
 
-            if self._has_logger:
-                self._logger.debug(json.dumps({
-                    'event': 'DDBTableWithLocalCache:get',
-                    'details': {'key': key, 'local_cache': False, 'remote_cache': True}
-                }))
+            if log is not None:
+                log.debug('DDBTableWithLocalCache:get', {'key': key, 'local_cache': False, 'remote_cache': True})
             item = res['Item']
-            self._in_memory_cache.put(key, item)
+            self._in_memory_cache.put(key, item, DDBTableWithLocalCache._expires_at(item))
             return item
         except ClientError as e:
             if e.response['Error']['Code'] == 'ResourceNotFoundException':
-                if self._has_logger:
-                    self._logger.debug(json.dumps({
-                        'event': 'DDBTableWithLocalCache:get',
-                        'details': {'key': key, 'local_cache': False, 'remote_cache': False}
-                    }))
+                if log is not None:
+                    log.debug('DDBTableWithLocalCache:get', {
+                        'key': key, 'local_cache': False, 'remote_cache': False,
+                    })
                 return None
             else:
                 raise
 
+    def batch_get(self, keys: List[object], max_retries: int = 5) -> Dict[object, object]:
+        found: Dict[object, object] = {}
+        requested: Dict[object, object] = {}
+        for key in keys:
+            local_cache = self._in_memory_cache.get(key)
+            if local_cache:
+                found[key] = local_cache
+            else:
+                requested[key] = key
+        remote_keys = list(requested)
+        now = datetime.datetime.utcnow().timestamp()
+        for i in range(0, len(remote_keys), 100):
+            chunk = remote_keys[i:i + 100]
+            for item in self._batch_get_chunk(chunk, max_retries):
+                # keys come back as decimal.Decimal: map them to the requested objects
+                key = requested.get(item.get(self._hash_key_name))
+                if key is None:
+                    continue
+                # expired items may linger until DynamoDB TTL deletes them
+                expires_at = DDBTableWithLocalCache._expires_at(item)
+                if expires_at is not None and expires_at <= now:
+                    continue
+                self._in_memory_cache.put(key, item, DDBTableWithLocalCache._expires_at(item))
+                found[key] = item
+        log = self._log
+        if log is not None:
+            log.debug('DDBTableWithLocalCache:batch_get', {
+                'keys': len(keys), 'remote_keys': len(remote_keys), 'found': len(found),
+            })
+        return found
+
+    def _batch_get_chunk(self, keys: List[object], max_retries: int) -> List[dict]:
+        request = {self._table.name: {'Keys': [{self._hash_key_name: k} for k in keys]}}
+        items: List[dict] = []
+        attempt = 0
+        while request:
+            try:
+                res = self._table.meta.client.batch_get_item(RequestItems=request)
+            except ClientError as e:
+                if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                    return items
+                raise
+            items += res.get('Responses', {}).get(self._table.name, [])
+            request = res.get('UnprocessedKeys', {})
+            if request:
+                attempt += 1
+                if attempt > max_retries:
+                    raise RuntimeError('DDBTableWithLocalCache:batch_get: too many unprocessed keys')
+                time.sleep(min(0.05 * (2 ** attempt), 1.0))
+        return items
+
     def put(self, item: dict, ttl: int = 60 * 60 * 24 * 14):
+        self.put_if_absent(item, ttl)
+
+    def put_if_absent(self, item: dict, ttl: int = 60 * 60 * 24 * 14) -> bool:
         key = item.get(self._hash_key_name)
-        if self.get(key) is not None:
-            return
-        item['ttl'] = datetime.datetime.utcnow().timestamp() + ttl
+        if self._in_memory_cache.get(key):
+            return False
+        now = datetime.datetime.utcnow().timestamp()
+        # a copy, the caller may still publish the item itself
+        item = dict(item, ttl=now + ttl)
         storable = self._to_storable(item)
-        res = self._table.put_item(Item=storable)
-        self._in_memory_cache.put(key, storable)
-        if self._has_logger:
-            self._logger.debug(json.dumps({
-                'event': 'DDBTableWithLocalCache:put',
-                'details': {'key': key, 'ddb_response': res}
-            }))
+        try:
+            # expired items may linger until DynamoDB TTL deletes them, so they count as absent
+            self._table.put_item(
+                Item=storable,
+                ConditionExpression='attribute_not_exists(#hash_key) OR #ttl <= :now',
+                ExpressionAttributeNames={'#hash_key': self._hash_key_name, '#ttl': 'ttl'},
+                ExpressionAttributeValues={':now': decimal.Decimal(str(now))},
+            )
+            created = True
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            created = False
+        # either way the key is known to exist now
+        self._in_memory_cache.put(key, storable, item['ttl'])
+        log = self._log
+        if log is not None:
+            log.debug('DDBTableWithLocalCache:put_if_absent', {'key': key, 'created': created})
+        return created
+
+    def delete(self, key: object):
+        self._table.delete_item(Key={self._hash_key_name: key})
+        self._in_memory_cache.delete(key)
+        log = self._log
+        if log is not None:
+            log.debug('DDBTableWithLocalCache:delete', {'key': key})
+
+    @staticmethod
+    def _expires_at(item: dict) -> Optional[float]:
+        ttl = item.get('ttl', None)
+        return float(ttl) if ttl is not None else None
 
     @staticmethod
     def _to_storable(item: object) -> object:
-        text = json.dumps(item, ensure_ascii=False)
-        text = text.replace(': ""', ':null')
-        return json.loads(text, parse_float=decimal.Decimal)
+        return to_storable(item)
+
+
+def to_storable(value: object) -> object:
+    # DynamoDB does not accept float, and empty strings were rejected until 2020
+    if isinstance(value, dict):
+        return {
+            k if isinstance(k, str) else json.dumps(k): to_storable(v)
+            for k, v in value.items()
+        }
+    if isinstance(value, str):
+        return value if value else None
+    if isinstance(value, (list, tuple)):
+        return [to_storable(v) for v in value]
+    if isinstance(value, float):
+        return decimal.Decimal(repr(value))
+    return value
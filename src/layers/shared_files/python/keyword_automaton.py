@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from collections import deque
+from typing import Dict, Hashable, Iterable, Iterator, List, Tuple
+
+
+# Aho-Corasick automaton: finds every occurrence of every keyword in a single pass over the text
+class KeywordAutomaton:
+    def __init__(self, keywords: Iterable[Tuple[str, Hashable]]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._outputs: List[List[Hashable]] = [[]]
+        # an empty keyword is contained in any text (same as `'' in text`)
+        self._empty_keyword_labels: List[Hashable] = []
+        for keyword, label in keywords:
+            self._add(keyword, label)
+        self._build()
+
+    def _add(self, keyword: str, label: Hashable):
+        if keyword == '':
+            self._empty_keyword_labels.append(label)
+            return
+        state = 0
+        for ch in keyword:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._outputs.append([])
+                self._goto[state][ch] = next_state
+            state = next_state
+        self._outputs[state].append(label)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                fail_state = self._goto[f].get(ch, 0)
+                self._fail[next_state] = fail_state
+                if self._outputs[fail_state]:
+                    self._outputs[next_state] = self._outputs[next_state] + self._outputs[fail_state]
+
+    def iter_matches(self, text: str) -> Iterator[Hashable]:
+        yield from self._empty_keyword_labels
+        goto = self._goto
+        fail = self._fail
+        outputs = self._outputs
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if outputs[state]:
+                yield from outputs[state]
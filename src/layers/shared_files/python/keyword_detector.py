@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Tuple, Hashable
+
+from keyword_automaton import KeywordAutomaton
+
+_IGNORED = 'ignored'
+_GLOBAL = 'global'
+_USER_SPECIFIC = 'user_specific'
 
 
 class KeywordDetector:
@@ -15,6 +21,8 @@ class KeywordDetector:
         self._user_specific_keywords = user_specific_keywords or {}
         self._ignored_keywords = ignored_keywords or []
         self._ignored_users = ignored_users or []
+        self._ignored_user_set = frozenset(self._ignored_users)
+        self._automaton: Optional[KeywordAutomaton] = None
 
     @property
     def global_keywords(self) -> List[str]:
@@ -32,17 +40,45 @@ class KeywordDetector:
     def ignored_users(self) -> List[str]:
         return self._ignored_users
 
+    @property
+    def automaton(self) -> KeywordAutomaton:
+        if self._automaton is None:
+            keywords: List[Tuple[str, Hashable]] = []
+            keywords += [(k, (_IGNORED, None, i)) for i, k in enumerate(self._ignored_keywords)]
+            keywords += [(k, (_GLOBAL, None, i)) for i, k in enumerate(self._global_keywords)]
+            for user_id, user_keywords in self._user_specific_keywords.items():
+                keywords += [(k, (_USER_SPECIFIC, user_id, i)) for i, k in enumerate(user_keywords or [])]
+            self._automaton = KeywordAutomaton(keywords)
+        return self._automaton
+
     def matched_ignore_condition(self, text: str, user_id: str = '') -> bool:
-        return user_id in self._ignored_users or \
-               any([text.count(k) for k in self._ignored_keywords])
+        if user_id in self._ignored_user_set:
+            return True
+        return any(kind == _IGNORED for kind, _, _ in self.automaton.iter_matches(text))
+
+    def _scan(self, text: str, user_id: str) -> Tuple[bool, Optional[int], Optional[int]]:
+        global_index = None
+        user_index = None
+        for kind, owner, index in self.automaton.iter_matches(text):
+            if kind == _IGNORED:
+                return True, None, None
+            if kind == _GLOBAL:
+                if global_index is None or index < global_index:
+                    global_index = index
+            elif owner == user_id:
+                if user_index is None or index < user_index:
+                    user_index = index
+        return False, global_index, user_index
 
     def find_related_keyword(self, text: str, user_id: str = '') -> Optional[str]:
-        if self.matched_ignore_condition(text, user_id):
+        if user_id in self._ignored_user_set:
+            return None
+        ignored, global_index, user_index = self._scan(text, user_id)
+        if ignored:
             return None
-        for k in self.global_keywords:
-            if text.count(k):
-                return k
-        for k in self._user_specific_keywords.get(user_id, []):
-            if k in text:
-                return k
+        # keywords keep the config order: the first global keyword wins, then the first user specific one
+        if global_index is not None:
+            return self._global_keywords[global_index]
+        if user_index is not None:
+            return self._user_specific_keywords[user_id][user_index]
         return None
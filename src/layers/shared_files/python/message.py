@@ -1,10 +1,17 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-from typing import Optional
+from typing import List, Optional, Tuple
 
 from twitter import Tweet, TweetHandleOptions
 
 
+def unwrap_record(record: dict) -> Tuple[str, str]:
+    # functions subscribed to SNS may also consume their backoff SQS queue
+    if 'Sns' in record:
+        return record['Sns']['MessageId'], record['Sns']['Message']
+    return record['messageId'], record['body']
+
+
 class CollectTweetsMessage:
     def __init__(self, tweet: Tweet, options: TweetHandleOptions):
         self._tweet = tweet
@@ -35,6 +42,43 @@ class CollectTweetsMessage:
         return self._options
 
 
+class DeferredDetectionMessage:
+    def __init__(self, message: CollectTweetsMessage, stages: List[str], attempts: int = 1):
+        self._message = message
+        self._stages = stages
+        self._attempts = attempts
+
+    @staticmethod
+    def of(d: dict) -> Optional[DeferredDetectionMessage]:
+        try:
+            message = CollectTweetsMessage.of(d['message'])
+            if message is None:
+                return None
+            return DeferredDetectionMessage(message, list(d['stages']), int(d.get('attempts', 1)))
+        except KeyError:
+            return None
+
+    @property
+    def message(self) -> CollectTweetsMessage:
+        return self._message
+
+    @property
+    def stages(self) -> List[str]:
+        return self._stages
+
+    @property
+    def attempts(self) -> int:
+        return self._attempts
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'message': self._message.dictionary,
+            'stages': self._stages,
+            'attempts': self._attempts,
+        }
+
+
 class RetweetMessage:
     def __init__(self, id_str: str, cause: Optional[dict] = None):
         self._id_str = id_str
@@ -107,6 +151,28 @@ class DetectRelatedImageMessage:
         }
 
 
+class DetectRelatedImageBatchMessage:
+    def __init__(self, image_urls: List[str]):
+        self._image_urls = image_urls
+
+    @staticmethod
+    def of(d: dict) -> Optional[DetectRelatedImageBatchMessage]:
+        try:
+            return DetectRelatedImageBatchMessage(list(d['image_urls']))
+        except KeyError:
+            return None
+
+    @property
+    def image_urls(self) -> List[str]:
+        return self._image_urls
+
+    @property
+    def dictionary(self) -> dict:
+        return {
+            'image_urls': self._image_urls,
+        }
+
+
 class DetectRelatedURLMessage:
     def __init__(self, url: str):
         self._url = url
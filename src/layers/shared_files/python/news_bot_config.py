@@ -1,37 +1,55 @@
 # -*- coding: utf-8 -*-
 from __future__ import annotations
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple, Callable
 
+import json
+import time
 import yaml
+import hashlib
 import boto3
-import datetime
 import logging
+import threading
+from botocore.exceptions import ClientError
 
 from twitter import TwitterList, TweetHandleOptions
 from keyword_detector import KeywordDetector
+from structured_logger import StructuredLogger
 
 
 class NewsBotConfig:
-    def __init__(self, dic: dict):
+    def __init__(self, dic: dict, version: Optional[str] = None):
         self._dic = dic
+        self._version = version
+        self._keyword_detector: Optional[KeywordDetector] = None
         self._logger = NewsBotConfig._get_logger(self.log_level)
+        self._log = StructuredLogger(self._logger, self.log_max_length)
 
     @staticmethod
     def initialize(stage: str, config_bucket: str, config_key_name: str) -> NewsBotConfig:
-        bucket = boto3.resource('s3').Bucket(config_bucket) if stage != 'local' \
-            else boto3.resource('s3', endpoint_url='http://localstack:4572').Bucket(config_bucket)
-        timestamp = datetime.datetime.utcnow().timestamp()
-        config_path = '/tmp/config.' + str(timestamp)
-        bucket.download_file(config_key_name, config_path)
-        f = open(config_path, "r")
-        dic = yaml.load(f, Loader=yaml.SafeLoader)
-        f.close()
-        return NewsBotConfig(dic)
+        return config_loader.load(stage, config_bucket, config_key_name)
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._version
 
     @property
     def log_level(self) -> str:
         return self._dic.get('global_config', {}).get('log_level', 'INFO')
 
+    @property
+    def config_cache_ttl(self) -> int:
+        return self._dic.get('global_config', {}).get('config_cache_ttl', 0)
+
+    def _choice(self, section: str, key: str, choices: List[str], default: str) -> str:
+        value = self._dic.get(section, {}).get(key, default)
+        if value not in choices:
+            # a typo in the config must not fail every invocation
+            self._log.warning('NewsBotConfig:invalid_value', {
+                'key': f'{section}.{key}', 'value': value, 'choices': choices, 'default': default,
+            })
+            return default
+        return value
+
     @staticmethod
     def _get_logger(log_level):
         logger = logging.getLogger(__name__)
@@ -47,6 +65,14 @@ class NewsBotConfig:
     def logger(self):
         return self._logger
 
+    @property
+    def log(self) -> StructuredLogger:
+        return self._log
+
+    @property
+    def log_max_length(self) -> int:
+        return self._dic.get('global_config', {}).get('log_max_length', 16 * 1024)
+
     @property
     def detect_face_similarity_threshold(self) -> int:
         return self._dic.get('global_config', {}).get('detect_face_similarity_threshold', 99)
@@ -56,6 +82,22 @@ class NewsBotConfig:
         return self._dic.get('global_config', {})\
             .get('detect_face_source_image_url', None)
 
+    @property
+    def detect_face_result_cache_ttl(self) -> int:
+        return self._dic.get('global_config', {}).get('detect_face_result_cache_ttl', 60 * 60 * 24)
+
+    @property
+    def detect_face_max_concurrency(self) -> int:
+        return self._dic.get('global_config', {}).get('detect_face_max_concurrency', 4)
+
+    @property
+    def detect_face_batch_invocation(self) -> bool:
+        return self._dic.get('global_config', {}).get('detect_face_batch_invocation', False)
+
+    @property
+    def image_detection_version(self) -> str:
+        return NewsBotConfig._digest(self.detect_face_source_image_url, self.detect_face_similarity_threshold)
+
     @property
     def image_detection_message_template(self) -> Optional[str]:
         return self._dic.get('detect_related_tweet', {}).get('image_detection_message_template', None)
@@ -64,6 +106,55 @@ class NewsBotConfig:
     def url_detection_message_template(self) -> Optional[str]:
         return self._dic.get('detect_related_tweet', {}).get('url_detection_message_template', None)
 
+    @property
+    def detection_mode(self) -> str:
+        return self._choice('detect_related_tweet', 'detection_mode', ['SYNC', 'ASYNC'], 'SYNC')
+
+    @property
+    def detection_stage_cancel_policy(self) -> str:
+        return self._choice('detect_related_tweet', 'stage_cancel_policy', ['NONE', 'CANCEL_ON_RETWEET'], 'NONE')
+
+    @property
+    def detection_stage_budget_ms(self) -> Dict[str, int]:
+        budgets = {'image': 15 * 1000, 'url': 30 * 1000}
+        budgets.update(self._dic.get('detect_related_tweet', {}).get('stage_budget_ms', {}))
+        return budgets
+
+    @property
+    def detection_deadline_margin_ms(self) -> int:
+        return self._dic.get('detect_related_tweet', {}).get('deadline_margin_ms', 2 * 1000)
+
+    @property
+    def detection_max_deferrals(self) -> int:
+        return self._dic.get('detect_related_tweet', {}).get('max_deferrals', 3)
+
+    @property
+    def url_result_cache_ttl(self) -> int:
+        return self._dic.get('detect_related_tweet', {}).get('url_result_cache_ttl', 60 * 60 * 24)
+
+    @property
+    def url_detection_version(self) -> str:
+        return NewsBotConfig._digest(self._dic.get('keyword_config', {}), self._dic.get('detect_related_url', {}))
+
+    @staticmethod
+    def _digest(*values) -> str:
+        j = json.dumps(values, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha1(j.encode('utf-8')).hexdigest()
+
+    @property
+    def twitter_write_capacity(self) -> int:
+        return self._dic.get('twitter_config', {}).get('write_limit', {}).get('capacity', 10)
+
+    @property
+    def twitter_write_refill_per_sec(self) -> float:
+        # statuses/update and statuses/retweet share a limit of 300 requests per 3 hours
+        refill_per_hour = self._dic.get('twitter_config', {}).get('write_limit', {}).get('refill_per_hour', 100)
+        return refill_per_hour / 3600
+
+    @property
+    def retweet_ledger_ttl(self) -> int:
+        return self._dic.get('retweet', {}).get('ledger_ttl', 60 * 60 * 24 * 7)
+
     @property
     def detect_url_selectors(self) -> Dict[str, str]:
         return self._dic.get('detect_related_url', {})\
@@ -74,6 +165,26 @@ class NewsBotConfig:
         return self._dic.get('detect_related_url', {})\
             .get('ignored_urls', [])
 
+    @property
+    def detect_url_js_rendered_urls(self) -> List[str]:
+        return self._dic.get('detect_related_url', {})\
+            .get('js_rendered_urls', [])
+
+    @property
+    def detect_url_http_fast_path(self) -> bool:
+        return self._dic.get('detect_related_url', {})\
+            .get('http_fast_path', True)
+
+    @property
+    def detect_url_http_timeout(self) -> int:
+        return self._dic.get('detect_related_url', {})\
+            .get('http_timeout', 5)
+
+    @property
+    def detect_url_http_max_bytes(self) -> int:
+        return self._dic.get('detect_related_url', {})\
+            .get('http_max_bytes', 2 * 1024 * 1024)
+
     @property
     def twitter_target_lists(self) -> List[CollectTweetsListConfig]:
         lists = self._dic.get('twitter_config', {}).get('target_lists', [])
@@ -88,15 +199,57 @@ class NewsBotConfig:
                 continue
         return result
 
+    @property
+    def collect_tweets_max_pages(self) -> int:
+        return self._dic.get('twitter_config', {}).get('max_pages', 5)
+
+    @property
+    def collect_tweets_rate_limit(self) -> int:
+        return self._dic.get('twitter_config', {}).get('rate_limit', {}).get('limit', 900)
+
+    @property
+    def collect_tweets_rate_limit_window(self) -> int:
+        return self._dic.get('twitter_config', {}).get('rate_limit', {}).get('window_sec', 15 * 60)
+
+    @property
+    def collect_tweets_interval(self) -> int:
+        return self._dic.get('twitter_config', {}).get('rate_limit', {}).get('interval_sec', 60)
+
+    @property
+    def collect_tweets_adaptive_polling_enabled(self) -> bool:
+        return self._dic.get('twitter_config', {}).get('adaptive_polling', {}).get('enabled', True)
+
+    @property
+    def collect_tweets_adaptive_polling_max_interval_sec(self) -> int:
+        return self._dic.get('twitter_config', {}).get('adaptive_polling', {}).get('max_interval_sec', 15 * 60)
+
+    @property
+    def collect_tweets_adaptive_polling_headroom(self) -> float:
+        return self._dic.get('twitter_config', {}).get('adaptive_polling', {}).get('headroom', 2.0)
+
+    @property
+    def collect_tweets_adaptive_polling_smoothing(self) -> float:
+        return self._dic.get('twitter_config', {}).get('adaptive_polling', {}).get('smoothing', 0.3)
+
+    @property
+    def collect_tweets_adaptive_polling_max_count(self) -> int:
+        return self._dic.get('twitter_config', {}).get('adaptive_polling', {}).get('max_count', 200)
+
+    @property
+    def collect_tweets_shard_count(self) -> int:
+        return self._dic.get('twitter_config', {}).get('shard_count', 1)
+
     @property
     def keyword_detector(self) -> KeywordDetector:
-        keyword_config = self._dic.get('keyword_config', {})
-        return KeywordDetector(
-            global_keywords=keyword_config.get('keywords', []),
-            user_specific_keywords=keyword_config.get('user_related_keywords', {}),
-            ignored_users=keyword_config.get('ignored_users', []),
-            ignored_keywords=keyword_config.get('ignored_keywords', []),
-        )
+        if self._keyword_detector is None:
+            keyword_config = self._dic.get('keyword_config', {})
+            self._keyword_detector = KeywordDetector(
+                global_keywords=keyword_config.get('keywords', []),
+                user_specific_keywords=keyword_config.get('user_related_keywords', {}),
+                ignored_users=keyword_config.get('ignored_users', []),
+                ignored_keywords=keyword_config.get('ignored_keywords', []),
+            )
+        return self._keyword_detector
 
 
 class CollectTweetsListConfig:
@@ -116,3 +269,85 @@ class CollectTweetsListConfig:
     @property
     def count(self) -> int:
         return self._count
+
+
+class CachedNewsBotConfig:
+    def __init__(self, config: NewsBotConfig, etag: Optional[str], expires_at: float):
+        self._config = config
+        self._etag = etag
+        self._expires_at = expires_at
+
+    @property
+    def config(self) -> NewsBotConfig:
+        return self._config
+
+    @property
+    def etag(self) -> Optional[str]:
+        return self._etag
+
+    @property
+    def expires_at(self) -> float:
+        return self._expires_at
+
+    def refresh(self, now: float):
+        self._expires_at = now + self._config.config_cache_ttl
+
+
+# keeps parsed configs across warm invocations and revalidates them with If-None-Match
+class NewsBotConfigLoader:
+    def __init__(
+        self,
+        s3_client_factory: Optional[Callable[[str], object]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._s3_client_factory = s3_client_factory or NewsBotConfigLoader._s3_client
+        self._s3_clients: Dict[str, object] = {}
+        self._entries: Dict[Tuple[str, str, str], CachedNewsBotConfig] = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _s3_client(stage: str):
+        return boto3.client('s3') if stage != 'local' \
+            else boto3.client('s3', endpoint_url='http://localstack:4572')
+
+    def _get_s3_client(self, stage: str):
+        if stage not in self._s3_clients:
+            self._s3_clients[stage] = self._s3_client_factory(stage)
+        return self._s3_clients[stage]
+
+    def load(self, stage: str, config_bucket: str, config_key_name: str) -> NewsBotConfig:
+        key = (stage, config_bucket, config_key_name)
+        with self._lock:
+            now = self._clock()
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires_at:
+                return entry.config
+            params = {'Bucket': config_bucket, 'Key': config_key_name}
+            if entry is not None and entry.etag is not None:
+                params['IfNoneMatch'] = entry.etag
+            try:
+                res = self._get_s3_client(stage).get_object(**params)
+            except ClientError as e:
+                if entry is not None and NewsBotConfigLoader._is_not_modified(e):
+                    entry.refresh(now)
+                    return entry.config
+                raise
+            dic = yaml.load(res['Body'].read(), Loader=yaml.SafeLoader)
+            etag = res.get('ETag', None)
+            config = NewsBotConfig(dic or {}, etag)
+            self._entries[key] = CachedNewsBotConfig(config, etag, now + config.config_cache_ttl)
+            return config
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+
+    @staticmethod
+    def _is_not_modified(e: ClientError) -> bool:
+        code = e.response.get('Error', {}).get('Code', None)
+        status = e.response.get('ResponseMetadata', {}).get('HTTPStatusCode', None)
+        return code in ['304', 'NotModified'] or status == 304
+
+
+config_loader = NewsBotConfigLoader()
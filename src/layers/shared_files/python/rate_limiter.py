@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+
+import math
+import time
+import threading
+from abc import ABC, abstractmethod
+from decimal import Decimal
+from typing import Callable, Dict, Tuple
+from botocore.exceptions import ClientError
+
+# statuses/retweet and statuses/update count against the same limit
+TWITTER_WRITE_BUCKET = 'twitter:write'
+
+
+class TokenBucketLimiter(ABC):
+    def __init__(self, capacity: float, refill_per_sec: float, clock: Callable[[], float] = time.time):
+        self._capacity = capacity
+        self._refill_per_sec = refill_per_sec
+        self._clock = clock
+
+    @abstractmethod
+    def acquire(self, key: str, tokens: float = 1) -> float:
+        pass
+
+    def _refill(self, tokens: float, updated_at: float, now: float) -> float:
+        return min(self._capacity, tokens + max(0.0, now - updated_at) * self._refill_per_sec)
+
+    def _wait_sec(self, available: float, tokens: float) -> float:
+        if self._refill_per_sec <= 0:
+            return float('inf')
+        return (tokens - available) / self._refill_per_sec
+
+
+class InMemoryTokenBucketLimiter(TokenBucketLimiter):
+    def __init__(self, capacity: float, refill_per_sec: float, clock: Callable[[], float] = time.time):
+        super().__init__(capacity, refill_per_sec, clock)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, tokens: float = 1) -> float:
+        now = self._clock()
+        with self._lock:
+            available, updated_at = self._buckets.get(key, (self._capacity, now))
+            available = self._refill(available, updated_at, now)
+            if available < tokens:
+                self._buckets[key] = (available, now)
+                return self._wait_sec(available, tokens)
+            self._buckets[key] = (available - tokens, now)
+            return 0
+
+
+class DDBTokenBucketLimiter(TokenBucketLimiter):
+    def __init__(
+        self,
+        ddb_table,
+        capacity: float,
+        refill_per_sec: float,
+        clock: Callable[[], float] = time.time,
+        max_attempts: int = 5,
+    ):
+        super().__init__(capacity, refill_per_sec, clock)
+        self._table = ddb_table
+        self._max_attempts = max_attempts
+
+    def acquire(self, key: str, tokens: float = 1) -> float:
+        for _ in range(self._max_attempts):
+            item = self._table.get_item(Key={'bucket_key': key}, ConsistentRead=True).get('Item', None)
+            now = self._clock()
+            if item is None:
+                available, updated_at = float(self._capacity), now
+            else:
+                available, updated_at = float(item['tokens']), float(item['updated_at'])
+            available = self._refill(available, updated_at, now)
+            if available < tokens:
+                return self._wait_sec(available, tokens)
+            try:
+                # optimistic concurrency: the write only succeeds if nobody took a token since the read
+                self._table.put_item(
+                    Item={
+                        'bucket_key': key,
+                        'tokens': Decimal(str(round(available - tokens, 6))),
+                        'updated_at': Decimal(str(round(now, 6))),
+                    },
+                    **DDBTokenBucketLimiter._condition(item),
+                )
+                return 0
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+        # heavily contended; behave as if the bucket were empty for a moment
+        return 1 / self._refill_per_sec if self._refill_per_sec > 0 else float('inf')
+
+    @staticmethod
+    def _condition(item) -> dict:
+        if item is None:
+            return {'ConditionExpression': 'attribute_not_exists(bucket_key)'}
+        return {
+            'ConditionExpression': 'updated_at = :updated_at AND tokens = :tokens',
+            'ExpressionAttributeValues': {':updated_at': item['updated_at'], ':tokens': item['tokens']},
+        }
+
+
+class QueueBackoff:
+    max_delay_sec = 15 * 60
+
+    def __init__(self, sqs, queue_url: str):
+        self._sqs = sqs
+        self._queue_url = queue_url
+
+    def defer(self, body: str, wait_sec: float) -> int:
+        delay = max(1, math.ceil(min(wait_sec, QueueBackoff.max_delay_sec)))
+        self._sqs.send_message(QueueUrl=self._queue_url, MessageBody=body, DelaySeconds=delay)
+        return delay
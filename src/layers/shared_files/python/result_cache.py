@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+
+import json
+import time
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Optional
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from botocore.exceptions import ClientError
+
+from key_value_store import BoundedInMemoryKeyValueStore
+
+TRACKING_QUERY_PARAMS = frozenset([
+    'fbclid', 'gclid', 'dclid', 'yclid', 'msclkid', 'igshid', 'mc_cid', 'mc_eid', '_ga', 'ref_src', 'ref_url',
+])
+
+
+def canonicalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port is not None and (scheme, parts.port) not in [('http', 80), ('https', 443)]:
+        host = f'{host}:{parts.port}'
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not k.lower().startswith('utm_') and k.lower() not in TRACKING_QUERY_PARAMS
+    )
+    return urlunsplit((scheme, host, parts.path or '/', urlencode(query), ''))
+
+
+class ResultCache(ABC):
+    @abstractmethod
+    def get(self, key: str) -> Optional[dict]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, value: dict, ttl: int):
+        pass
+
+
+class InMemoryResultCache(ResultCache):
+    def __init__(self, max_entries: int = 10000, clock: Callable[[], float] = time.time):
+        self._store = BoundedInMemoryKeyValueStore(max_entries=max_entries, clock=clock)
+        self._clock = clock
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self._store.get(key)
+        return dict(value) if isinstance(value, dict) else None
+
+    def put(self, key: str, value: dict, ttl: int):
+        self._store.put(key, dict(value), self._clock() + ttl)
+
+
+class SQLiteResultCache(ResultCache):
+    def __init__(self, path: str, clock: Callable[[], float] = time.time):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute(
+            'CREATE TABLE IF NOT EXISTS result_cache (cache_key TEXT PRIMARY KEY, value TEXT, expires_at REAL)'
+        )
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._connection.execute(
+                'SELECT value FROM result_cache WHERE cache_key = ? AND expires_at > ?', (key, self._clock())
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, key: str, value: dict, ttl: int):
+        with self._lock, self._connection:
+            self._connection.execute(
+                'INSERT OR REPLACE INTO result_cache (cache_key, value, expires_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value, ensure_ascii=False), self._clock() + ttl)
+            )
+
+
+class DDBResultCache(ResultCache):
+    def __init__(self, ddb_table, clock: Callable[[], float] = time.time):
+        self._table = ddb_table
+        self._clock = clock
+
+    def get(self, key: str) -> Optional[dict]:
+        try:
+            item = self._table.get_item(Key={'cache_key': key}).get('Item', None)
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ResourceNotFoundException':
+                return None
+            raise
+        # expired items can be returned until DynamoDB TTL actually deletes them
+        if item is None or float(item.get('ttl', 0)) <= self._clock():
+            return None
+        return json.loads(item['value'])
+
+    def put(self, key: str, value: dict, ttl: int):
+        self._table.put_item(Item={
+            'cache_key': key,
+            'value': json.dumps(value, ensure_ascii=False),
+            'ttl': int(self._clock() + ttl),
+        })
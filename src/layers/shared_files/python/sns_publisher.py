@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import annotations
+
+import threading
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from structured_logger import StructuredLogger
+
+
+class BatchPublishResult:
+    def __init__(self, successful: Optional[Dict[Hashable, str]] = None, failed: Optional[List[Hashable]] = None):
+        self._successful = successful or {}
+        self._failed = failed or []
+
+    @property
+    def successful(self) -> Dict[Hashable, str]:
+        return self._successful
+
+    @property
+    def failed(self) -> List[Hashable]:
+        return self._failed
+
+    def extend(self, other: BatchPublishResult):
+        self._successful.update(other.successful)
+        self._failed += other.failed
+
+
+class BatchSNSPublisher:
+    max_batch_size = 10
+    max_batch_bytes = 256 * 1024
+
+    def __init__(self, sns, topic: str, log: Optional[StructuredLogger] = None, batch_size: int = max_batch_size):
+        self._sns = sns
+        self._topic = topic
+        self._log = log
+        self._batch_size = min(batch_size, BatchSNSPublisher.max_batch_size)
+        self._entries: List[Tuple[Hashable, str]] = []
+        self._entries_bytes = 0
+        self._result = BatchPublishResult()
+        self._in_flight = 0
+        self._lock = threading.Condition()
+
+    def publish(self, key: Hashable, message: str):
+        size = len(message.encode('utf-8'))
+        batches = []
+        with self._lock:
+            if self._entries and self._entries_bytes + size > BatchSNSPublisher.max_batch_bytes:
+                batches.append(self._take())
+            self._entries.append((key, message))
+            self._entries_bytes += size
+            if len(self._entries) >= self._batch_size:
+                batches.append(self._take())
+        # the request is made outside of the lock so that publishing threads do not wait for each other
+        for entries in batches:
+            self._send(entries)
+
+    def flush(self) -> BatchPublishResult:
+        with self._lock:
+            entries = self._take() if self._entries else []
+        if entries:
+            self._send(entries)
+        with self._lock:
+            self._lock.wait_for(lambda: self._in_flight == 0)
+            result = self._result
+            self._result = BatchPublishResult()
+            return result
+
+    def _take(self) -> List[Tuple[Hashable, str]]:
+        entries = self._entries
+        self._entries = []
+        self._entries_bytes = 0
+        self._in_flight += 1
+        return entries
+
+    def _send(self, entries: List[Tuple[Hashable, str]]):
+        try:
+            result, retryable = self._publish_batch(entries)
+            # failures caused by the service side (throttling, internal errors) are worth one more try
+            if retryable:
+                retried, still_failed = self._publish_batch(retryable)
+                result.extend(retried)
+                result.extend(BatchPublishResult(failed=[key for key, _ in still_failed]))
+        except Exception as e:
+            # nothing of the batch is known to be published
+            result = BatchPublishResult(failed=[key for key, _ in entries])
+            if self._log is not None:
+                self._log.error('BatchSNSPublisher:publish_batch:exception', {
+                    'topic': self._topic,
+                    'error': e.__str__(),
+                })
+        with self._lock:
+            self._result.extend(result)
+            self._in_flight -= 1
+            self._lock.notify_all()
+        if self._log is not None:
+            self._log.info('BatchSNSPublisher:publish_batch', {
+                'topic': self._topic,
+                'successful': [{'key': str(k), 'message_id': v} for k, v in result.successful.items()],
+                'failed': [str(k) for k in result.failed],
+            })
+
+    def _publish_batch(
+        self,
+        entries: List[Tuple[Hashable, str]]
+    ) -> Tuple[BatchPublishResult, List[Tuple[Hashable, str]]]:
+        res = self._sns.publish_batch(
+            TopicArn=self._topic,
+            PublishBatchRequestEntries=[{'Id': str(i), 'Message': message} for i, (_, message) in enumerate(entries)],
+        )
+        result = BatchPublishResult({entries[int(e['Id'])][0]: e.get('MessageId') for e in res.get('Successful', [])})
+        retryable = []
+        for e in res.get('Failed', []):
+            entry = entries[int(e['Id'])]
+            if e.get('SenderFault', False):
+                result.failed.append(entry[0])
+            else:
+                retryable.append(entry)
+            if self._log is not None:
+                self._log.error('BatchSNSPublisher:publish_batch:error', {'topic': self._topic, 'key': str(entry[0]), 'error': e})
+        return result, retryable
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import json
+import logging
+from logging import Logger
+from typing import Any, Callable, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, default=str)
+
+
+# writes {"event": ..., "details": ...} lines; nothing is serialized unless the level is enabled
+class StructuredLogger:
+    def __init__(self, logger: Logger, max_length: int = 16 * 1024):
+        self._logger = logger
+        self._max_length = max_length
+
+    @property
+    def logger(self) -> Logger:
+        return self._logger
+
+    def is_enabled_for(self, level: int) -> bool:
+        return self._logger.isEnabledFor(level)
+
+    def event(self, event: str, details: Union[Any, Callable[[], Any]] = None, level: int = logging.INFO):
+        if not self._logger.isEnabledFor(level):
+            return
+        if callable(details):
+            details = details()
+        text = dumps({'event': event, 'details': details})
+        if len(text) > self._max_length:
+            text = dumps({
+                'event': event,
+                'details': dumps(details)[:self._max_length],
+                'truncated': True,
+                'length': len(text),
+            })
+        self._logger.log(level, text)
+
+    def debug(self, event: str, details: Union[Any, Callable[[], Any]] = None):
+        self.event(event, details, logging.DEBUG)
+
+    def info(self, event: str, details: Union[Any, Callable[[], Any]] = None):
+        self.event(event, details, logging.INFO)
+
+    def warning(self, event: str, details: Union[Any, Callable[[], Any]] = None):
+        self.event(event, details, logging.WARNING)
+
+    def error(self, event: str, details: Union[Any, Callable[[], Any]] = None):
+        self.event(event, details, logging.ERROR)
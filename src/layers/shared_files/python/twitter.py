@@ -181,6 +181,17 @@ class TweetHandleOptions:
     def evaluate_url(self) -> TweetEvaluateOption:
         return self._evaluate_url
 
+    def merge(self, other: TweetHandleOptions) -> TweetHandleOptions:
+        order = list(TweetEvaluateOption)
+        return TweetHandleOptions(
+            always_retweet=self._always_retweet or other.always_retweet,
+            include_retweet=self._include_retweet or other.include_retweet,
+            include_reply=self._include_reply or other.include_reply,
+            include_quoted_text=self._include_quoted_text or other.include_quoted_text,
+            evaluate_image=max(self._evaluate_image, other.evaluate_image, key=order.index),
+            evaluate_url=max(self._evaluate_url, other.evaluate_url, key=order.index),
+        )
+
     @property
     def dictionary(self) -> dict:
         return {
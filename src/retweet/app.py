@@ -2,12 +2,16 @@
 
 import os
 import json
+import boto3
+from typing import Optional, Dict
 
-from logging import Logger
 from TwitterAPI import TwitterAPI
 
-from message import RetweetMessage
+from message import RetweetMessage, unwrap_record
 from news_bot_config import NewsBotConfig
+from structured_logger import StructuredLogger
+from retweet_ledger import RetweetLedger, DDBRetweetLedger
+from rate_limiter import TokenBucketLimiter, DDBTokenBucketLimiter, QueueBackoff, TWITTER_WRITE_BUCKET
 
 # env_vars
 stage = os.environ['Stage']
@@ -17,50 +21,92 @@ consumer_key = os.environ['TwitterConsumerKey']
 consumer_secret = os.environ['TwitterConsumerSecret']
 access_token_key = os.environ['TwitterAccessTokenKey']
 access_token_secret = os.environ['TwitterAccessTokenSecret']
+ddb_ledger_table_name = os.environ['DDBRetweetLedgerTable']
+ddb_rate_limit_table_name = os.environ['DDBRateLimitTable']
+backoff_queue = os.environ['BackoffQueue']
 
 # api clients
 twitter = TwitterAPI(consumer_key, consumer_secret, access_token_key, access_token_secret)
+ddb = boto3.resource('dynamodb') if stage != 'local' \
+    else boto3.resource('dynamodb', endpoint_url='http://localstack:4569')
+ddb_ledger_table = ddb.Table(ddb_ledger_table_name) if stage != 'local' \
+    else ddb.Table('RetweetLedger')
+ddb_rate_limit_table = ddb.Table(ddb_rate_limit_table_name) if stage != 'local' \
+    else ddb.Table('RateLimit')
+sqs_client = boto3.client('sqs') if stage != 'local' \
+    else boto3.client('sqs', endpoint_url='http://localstack:4576')
+
+# ledger
+retweet_ledger = DDBRetweetLedger(ddb_ledger_table)
+retweet_backoff = QueueBackoff(sqs_client, backoff_queue)
 
 
 def lambda_handler(event, _):
     config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
-    return handle(event, config)
+    limiter = DDBTokenBucketLimiter(
+        ddb_rate_limit_table, config.twitter_write_capacity, config.twitter_write_refill_per_sec
+    )
+    return handle(event, config, retweet_ledger, limiter, retweet_backoff)
 
 
-def handle(event: dict, config: NewsBotConfig):
+def handle(
+    event: dict,
+    config: NewsBotConfig,
+    ledger: Optional[RetweetLedger] = None,
+    limiter: Optional[TokenBucketLimiter] = None,
+    backoff: Optional[QueueBackoff] = None,
+):
     records = event['Records']
     ids = []
+    messages: Dict[str, RetweetMessage] = {}
     for r in records:
-        mid = r['Sns']['MessageId']
+        mid, body = unwrap_record(r)
         ids.append(mid)
-        config.logger.info(json.dumps({
-            'event': 'app:handle',
-            'details': {'MessageId': mid}
-        }))
-        message = json.loads(r['Sns']['Message'])
+        config.log.info('app:handle', {'MessageId': mid})
+        message = json.loads(body)
         retweet_message = RetweetMessage.of(message)
-        retweet(retweet_message, config.logger)
+        # one batch never retweets the same status twice
+        original_id = str(retweet_message.id_str)
+        if original_id in messages:
+            config.log.info('retweet:handle:coalesced', {'MessageId': mid, 'id': original_id})
+            continue
+        messages[original_id] = retweet_message
+    for original_id, retweet_message in messages.items():
+        if ledger is not None and not ledger.claim(original_id, config.retweet_ledger_ttl):
+            config.log.info('retweet:handle:already_retweeted', {'message': retweet_message.dictionary})
+            continue
+        wait_sec = limiter.acquire(TWITTER_WRITE_BUCKET) if limiter is not None else 0
+        if wait_sec > 0:
+            if ledger is not None:
+                ledger.release(original_id)
+            if backoff is None:
+                raise RuntimeError(f'rate limited for {wait_sec:.1f}s')
+            # retry through the backoff queue instead of failing the Twitter call
+            delay = backoff.defer(json.dumps(retweet_message.dictionary), wait_sec)
+            config.log.info('retweet:handle:backoff', {'message': retweet_message.dictionary, 'delay': delay})
+            continue
+        try:
+            retweet(retweet_message, config.log)
+        except Exception:
+            # let SNS redelivery retry the retweet
+            if ledger is not None:
+                ledger.release(original_id)
+            raise
     return {
         'MessageIds': ids
     }
 
 
-def retweet(message: RetweetMessage, logger: Logger) -> str:
+def retweet(message: RetweetMessage, log: StructuredLogger) -> str:
     r = twitter.request('statuses/retweet/:%s' % message.id_str)
     content = json.loads(r.response.content.decode())
     if r.status_code < 200 or r.status_code >= 300:
-        logger.error(json.dumps({
-            'event': 'retweet:retweet:error',
-            'details': content,
-        }))
+        log.error('retweet:retweet:error', content)
         # ignore error_code 327: You have already retweeted this Tweet.
         if not any(e.get('code', 0) == 327 for e in content.get('errors', [])):
             r.response.raise_for_status()
     else:
-        logger.info(json.dumps({
-            'event': 'retweet:retweet:done',
-            'details': {
-                'message': message.dictionary,
-            },
-        }, ensure_ascii=False))
+        log.info('retweet:retweet:done', {
+            'message': message.dictionary,
+        })
     return message.id_str
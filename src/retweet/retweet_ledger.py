@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict
+from botocore.exceptions import ClientError
+
+
+class RetweetLedger(ABC):
+    @abstractmethod
+    def claim(self, original_id: str, ttl: int) -> bool:
+        pass
+
+    @abstractmethod
+    def release(self, original_id: str):
+        pass
+
+
+class InMemoryRetweetLedger(RetweetLedger):
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self._expires_at: Dict[str, float] = {}
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def claim(self, original_id: str, ttl: int) -> bool:
+        now = self._clock()
+        with self._lock:
+            if self._expires_at.get(original_id, 0) > now:
+                return False
+            self._expires_at[original_id] = now + ttl
+            return True
+
+    def release(self, original_id: str):
+        with self._lock:
+            self._expires_at.pop(original_id, None)
+
+
+class DDBRetweetLedger(RetweetLedger):
+    def __init__(self, ddb_table, clock: Callable[[], float] = time.time):
+        self._table = ddb_table
+        self._clock = clock
+
+    def claim(self, original_id: str, ttl: int) -> bool:
+        now = int(self._clock())
+        try:
+            # expired entries may linger until DynamoDB TTL deletes them, so they can be claimed again
+            self._table.put_item(
+                Item={'original_id': original_id, 'ttl': now + ttl},
+                ConditionExpression='attribute_not_exists(original_id) OR #ttl <= :now',
+                ExpressionAttributeNames={'#ttl': 'ttl'},
+                ExpressionAttributeValues={':now': now},
+            )
+            return True
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'ConditionalCheckFailedException':
+                return False
+            raise
+
+    def release(self, original_id: str):
+        self._table.delete_item(Key={'original_id': original_id})
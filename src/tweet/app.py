@@ -2,13 +2,15 @@
 
 import os
 import json
+import boto3
 
-from typing import Optional
-from logging import Logger
+from typing import Dict, Optional
 from TwitterAPI import TwitterAPI
 
-from message import TweetMessage
+from message import TweetMessage, unwrap_record
 from news_bot_config import NewsBotConfig
+from structured_logger import StructuredLogger
+from rate_limiter import TokenBucketLimiter, DDBTokenBucketLimiter, QueueBackoff, TWITTER_WRITE_BUCKET
 
 # env_vars
 stage = os.environ['Stage']
@@ -18,49 +20,67 @@ consumer_key = os.environ['TwitterConsumerKey']
 consumer_secret = os.environ['TwitterConsumerSecret']
 access_token_key = os.environ['TwitterAccessTokenKey']
 access_token_secret = os.environ['TwitterAccessTokenSecret']
+ddb_rate_limit_table_name = os.environ['DDBRateLimitTable']
+backoff_queue = os.environ['BackoffQueue']
 
 # api clients
 twitter = TwitterAPI(consumer_key, consumer_secret, access_token_key, access_token_secret)
+ddb = boto3.resource('dynamodb') if stage != 'local' \
+    else boto3.resource('dynamodb', endpoint_url='http://localstack:4569')
+ddb_rate_limit_table = ddb.Table(ddb_rate_limit_table_name) if stage != 'local' \
+    else ddb.Table('RateLimit')
+sqs_client = boto3.client('sqs') if stage != 'local' \
+    else boto3.client('sqs', endpoint_url='http://localstack:4576')
+
+tweet_backoff = QueueBackoff(sqs_client, backoff_queue)
 
 
 def lambda_handler(event, _):
     config = NewsBotConfig.initialize(stage, config_bucket, config_key_name)
-    return handle(event, config)
+    limiter = DDBTokenBucketLimiter(
+        ddb_rate_limit_table, config.twitter_write_capacity, config.twitter_write_refill_per_sec
+    )
+    return handle(event, config, limiter, tweet_backoff)
 
 
-def handle(event: dict, config: NewsBotConfig):
+def handle(
+    event: dict,
+    config: NewsBotConfig,
+    limiter: Optional[TokenBucketLimiter] = None,
+    backoff: Optional[QueueBackoff] = None,
+):
     records = event['Records']
-    ids = {}
+    ids: Dict[str, Optional[str]] = {}
     for r in records:
-        mid = r['Sns']['MessageId']
-        config.logger.info(json.dumps({
-            'event': 'app:handle',
-            'details': {'MessageId': mid}
-        }))
-        message = json.loads(r['Sns']['Message'])
+        mid, body = unwrap_record(r)
+        config.log.info('app:handle', {'MessageId': mid})
+        message = json.loads(body)
         tweet_message = TweetMessage.of(message)
-        id_str = tweet(tweet_message, config.logger)
+        wait_sec = limiter.acquire(TWITTER_WRITE_BUCKET) if limiter is not None else 0
+        if wait_sec > 0:
+            if backoff is None:
+                raise RuntimeError(f'rate limited for {wait_sec:.1f}s')
+            # retry through the backoff queue instead of failing the Twitter call
+            delay = backoff.defer(body, wait_sec)
+            config.log.info('tweet:handle:backoff', {'MessageId': mid, 'delay': delay})
+            ids[mid] = None
+            continue
+        id_str = tweet(tweet_message, config.log)
         ids[mid] = id_str
     return {
         'Results': ids
     }
 
 
-def tweet(message: TweetMessage, logger: Logger) -> Optional[str]:
+def tweet(message: TweetMessage, log: StructuredLogger) -> Optional[str]:
     r = twitter.request('statuses/update', {'status': message.status})
     content = json.loads(r.response.content.decode())
     if r.status_code < 200 or r.status_code >= 300:
-        logger.error(json.dumps({
-            'event': 'tweet:tweet:error',
-            'details': content,
-        }))
+        log.error('tweet:tweet:error', content)
         # ignore error_code 187: Status is a duplicate.
         if not any(e.get('code', 0) == 187 for e in content.get('errors', [])):
             r.response.raise_for_status()
     else:
-        logger.debug(json.dumps({
-            'event': 'tweet:tweet:debug',
-            'details': content,
-        }))
+        log.debug('tweet:tweet:debug', content)
     return content.get('id_str', None)
 
@@ -12,3 +12,9 @@ os.environ['AWS_ACCESS_KEY_ID'] = 'dummy'
 os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
 os.environ['TargetTopic'] = 'arn:aws:sns:us-east-1:123456789012:TestTopic'
 os.environ['DDBCacheTable'] = 'CollectTweets'
+os.environ['DDBStateTable'] = 'CollectTweetsState'
+os.environ['ShardFunction'] = 'CollectTweetsShardFunction'
+os.environ['DDBResultCacheTable'] = 'DetectionResultCache'
+os.environ['DDBRetweetLedgerTable'] = 'RetweetLedger'
+os.environ['DDBRateLimitTable'] = 'RateLimit'
+os.environ['BackoffQueue'] = 'http://localhost:4576/queue/BackoffQueue'
@@ -0,0 +1,29 @@
+import json
+
+from benchmarks import corpus, detection
+from src.layers.shared_files.python.keyword_detector import KeywordDetector
+
+
+def test_generate_corpus_ratios():
+    records = list(corpus.generate(corpus.CorpusSpec(size=1000, url_ratio=0.5, media_ratio=0, quote_ratio=1)))
+    assert len(records) == 1000
+    assert 400 < sum(len(r['tweet']['entities']['urls']) for r in records) < 600
+    assert all('extended_entities' not in r['tweet'] for r in records)
+    assert all('quoted_status' in r['tweet'] for r in records)
+
+
+def test_run_detection_benchmark():
+    spec = corpus.CorpusSpec(size=50, keyword_ratio=1, quote_ratio=0)
+    lines = [json.dumps(r, ensure_ascii=False) for r in corpus.generate(spec)]
+    result = detection.run(lines, KeywordDetector(global_keywords=spec.keywords), iterations=2, warmup=10).dictionary
+    assert result['tweets'] == 100
+    assert result['decisions']['retweet'] == 100
+    assert result['latency_us']['total']['p99'] >= result['latency_us']['total']['p50'] > 0
+    assert result['allocations_per_tweet'] > 0
+
+
+def test_regressions():
+    baseline = {'tweets_per_sec': 1000, 'latency_us': {'total': {'p50': 10, 'p99': 20}}}
+    current = {'tweets_per_sec': 700, 'latency_us': {'total': {'p50': 10, 'p99': 30}}}
+    assert len(detection.regressions(baseline, current, 0.2)) == 2
+    assert detection.regressions(baseline, baseline, 0.2) == []
@@ -0,0 +1,17 @@
+from benchmarks import to_storable
+
+
+def test_implementations_agree_on_fixtures():
+    statuses = to_storable.load_fixtures()
+    assert len(statuses) > 0
+    for status in statuses:
+        assert to_storable.to_storable(status) == to_storable.json_round_trip(status)
+
+
+def test_run_to_storable_benchmark():
+    result = to_storable.run(to_storable.load_fixtures(), iterations=2)
+    assert set(result['implementations'].keys()) == {'json_round_trip', 'structural'}
+    for implementation in result['implementations'].values():
+        assert implementation['p99_us'] >= implementation['p50_us'] > 0
+        assert implementation['retained_bytes_per_status'] > 0
+    assert result['speedup'] > 0
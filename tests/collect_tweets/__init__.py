@@ -3,5 +3,8 @@ import sys
 
 os.environ['TargetTopic'] = 'arn:aws:sns:us-east-1:123456789012:TestTopic'
 os.environ['DDBCacheTable'] = 'CollectTweets'
+os.environ['DDBStateTable'] = 'CollectTweetsState'
+os.environ['ShardFunction'] = 'CollectTweetsShardFunction'
 os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
 sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../../src/layers/shared_files/python/"))
+sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../../src/collect_tweets/"))
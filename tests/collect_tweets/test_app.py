@@ -1,9 +1,16 @@
+import json
 import boto3
+import pytest
 
 from src.collect_tweets import app
 from src.layers.shared_files.python.twitter import Tweet, TweetHandleOptions, TwitterList
 from src.layers.shared_files.python.message import CollectTweetsMessage
-from src.layers.shared_files.python.news_bot_config import NewsBotConfig
+from src.layers.shared_files.python.news_bot_config import NewsBotConfig, CollectTweetsListConfig
+from src.layers.shared_files.python.sns_publisher import BatchSNSPublisher
+from src.collect_tweets.collector_state import CollectorStateStore, ListState, RateLimitState
+from src.collect_tweets.request_scheduler import RequestBudget, LISTS_STATUSES
+from src.collect_tweets.sharding import CollectTweetsShardMessage, shard_of
+from tests.fakes import FakeStateTable
 
 sns_client = boto3.client('sns', endpoint_url='http://localhost:4575')
 config = NewsBotConfig({'global_config': {'log_level': 'INFO'}})
@@ -12,14 +19,327 @@ config = NewsBotConfig({'global_config': {'log_level': 'INFO'}})
 def test_collect_tweets(mocker):
     mocker.patch('TwitterAPI.TwitterAPI.request', return_value=[{'id': 123}])
     ret = app.collect_tweets(app.twitter_api, TwitterList('slug', 'owner'), 10)
-    assert len(ret) == 1
-    assert ret[0].id == 123
+    assert len(ret.tweets) == 1
+    assert ret.tweets[0].id == 123
 
 
 def test_notify_message():
+    publisher = BatchSNSPublisher(sns_client, app.target_topic, config.log)
     app.notify_message(
-        sns_client,
-        app.target_topic,
+        publisher,
         CollectTweetsMessage(Tweet({'id': 1}), TweetHandleOptions()),
-        config.logger
+        config.log
     )
+    assert list(publisher.flush().successful.keys()) == [1]
+
+
+class FakeTwitterAPI:
+    def __init__(self, pages):
+        # a list of pages, or pages per list slug
+        self.pages = pages
+        self.served = {}
+        self.requests = []
+
+    def request(self, resource, params):
+        self.requests.append(dict(params))
+        key = params['slug'] if isinstance(self.pages, dict) else None
+        pages = self.pages[key] if key is not None else self.pages
+        served = self.served.get(key, 0)
+        self.served[key] = served + 1
+        return pages[served] if served < len(pages) else []
+
+
+def test_collect_tweets_since_id_paging():
+    api = FakeTwitterAPI([
+        [{'id': 14}, {'id': 13}],
+        [{'id': 12}, {'id': 11}],
+        [{'id': 10}],
+    ])
+    ret = app.collect_tweets(api, TwitterList('slug', 'owner'), 2, since_id=9, max_pages=5)
+    assert [t.id for t in ret.tweets] == [14, 13, 12, 11, 10]
+    # the under-filled page reaches the watermark, so no further page is requested
+    assert [r.get('max_id') for r in api.requests] == [None, 12, 10]
+    assert all(r['since_id'] == 9 for r in api.requests)
+    assert ret.complete
+    assert ret.requests == 3
+
+
+def test_collect_tweets_stops_at_under_filled_page():
+    api = FakeTwitterAPI([[{'id': 13}, {'id': 12}, {'id': 11}]])
+    ret = app.collect_tweets(api, TwitterList('slug', 'owner'), 10, since_id=9, max_pages=5)
+    assert ret.requests == 1
+    assert ret.complete
+
+    # a single page is only truncated when it is full
+    api = FakeTwitterAPI([[{'id': 13}, {'id': 12}, {'id': 11}]])
+    assert app.collect_tweets(api, TwitterList('slug', 'owner'), 10, since_id=9, max_pages=1).complete
+    api = FakeTwitterAPI([[{'id': 13}, {'id': 12}]])
+    assert not app.collect_tweets(api, TwitterList('slug', 'owner'), 2, since_id=9, max_pages=1).complete
+
+
+def test_collect_tweets_truncated_by_max_pages():
+    api = FakeTwitterAPI([[{'id': 14}, {'id': 13}], [{'id': 12}, {'id': 11}]])
+    ret = app.collect_tweets(api, TwitterList('slug', 'owner'), 2, since_id=9, max_pages=2)
+    assert [t.id for t in ret.tweets] == [14, 13, 12, 11]
+    assert not ret.complete
+
+    # the next run continues below the oldest fetched tweet
+    api = FakeTwitterAPI([[{'id': 10}]])
+    ret = app.collect_tweets(api, TwitterList('slug', 'owner'), 2, since_id=9, max_pages=2, max_id=10)
+    assert [r.get('max_id') for r in api.requests] == [10]
+    assert ret.complete
+
+
+def test_collect_tweets_without_since_id():
+    api = FakeTwitterAPI([[{'id': 14}, {'id': 13}]])
+    ret = app.collect_tweets(api, TwitterList('slug', 'owner'), 2, max_pages=5)
+    assert len(ret.tweets) == 2
+    assert ret.complete
+    assert 'since_id' not in api.requests[0]
+
+
+class FakeCachedTable:
+    def __init__(self, seen):
+        self.seen = set(seen)
+        self.items = []
+        self.writes = 0
+
+    def batch_get(self, keys):
+        return {k: {'original_id': k} for k in keys if k in self.seen}
+
+    def put_if_absent(self, item):
+        self.writes += 1
+        if item['original_id'] in self.seen:
+            return False
+        self.seen.add(item['original_id'])
+        self.items.append(item['original_id'])
+        return True
+
+    def delete(self, key):
+        self.seen.discard(key)
+        self.items.remove(key)
+
+
+class FakeSNS:
+    def __init__(self, failed_message_ids):
+        self.failed_message_ids = failed_message_ids
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        ids = [(e['Id'], json.loads(e['Message'])['tweet']['id']) for e in PublishBatchRequestEntries]
+        return {
+            'Successful': [{'Id': i, 'MessageId': str(t)} for i, t in ids if t not in self.failed_message_ids],
+            'Failed': [{'Id': i, 'SenderFault': True} for i, t in ids if t in self.failed_message_ids],
+        }
+
+
+def test_handle_tweets():
+    table = FakeCachedTable({1})
+    tweets = [Tweet({'id': i}) for i in [1, 2, 3, 2]]
+    list_config = CollectTweetsListConfig(TwitterList('slug', 'owner'), TweetHandleOptions(), 10)
+    failed = app.handle_tweets([(list_config, tweets)], table, FakeSNS({3}), config.log)
+    assert table.items == [2]
+    assert failed == {3}
+    # the tweet already seen is filtered by the batched read without a write
+    assert table.writes == 2
+
+
+def test_merge_tweets_across_lists():
+    a = CollectTweetsListConfig(TwitterList('a', 'owner'), TweetHandleOptions.of({
+        'include_reply': True, 'evaluate_image': 'ALWAYS', 'evaluate_url': 'NONE',
+    }), 10)
+    b = CollectTweetsListConfig(TwitterList('b', 'owner'), TweetHandleOptions.of({
+        'always_retweet': True, 'evaluate_image': 'EVALUATE', 'evaluate_url': 'EVALUATE',
+    }), 10)
+    retweet = Tweet({'id': 5, 'retweeted_status': {'id': 1}})
+    merged = app.merge_tweets([(a, [Tweet({'id': 1}), Tweet({'id': 2})]), (b, [retweet, Tweet({'id': 3})])])
+    assert list(merged.keys()) == [1, 2, 3]
+    status, options = merged[1]
+    assert status.id == 1
+    assert options.dictionary == {
+        'always_retweet': True,
+        'include_retweet': False,
+        'include_reply': True,
+        'include_quoted_text': False,
+        'evaluate_image': 'ALWAYS',
+        'evaluate_url': 'EVALUATE',
+    }
+    assert merged[3][1].dictionary == b.options.dictionary
+
+
+def test_handle_publishes_tweet_found_in_several_lists_once():
+    lists = [{'owner_screen_name': 'owner', 'slug': s, 'count': 10} for s in ['a', 'b']]
+    c = NewsBotConfig({'twitter_config': {'target_lists': lists}})
+    table = FakeStateTable({
+        f'list:owner/{s}': {'state_key': f'list:owner/{s}', 'since_id': 1, 'last_polled_at': 940} for s in ['a', 'b']
+    })
+    api = FakeTwitterAPI({s: [FakeResponse([{'id': 2}, {'id': 3}], remaining=899)] for s in ['a', 'b']})
+    cached_table = FakeCachedTable(set())
+    sns = FakeSNS({3})
+    app.handle(c, api, cached_table, sns, CollectorStateStore(table), now=1000)
+    assert cached_table.items == [2]
+    # the unpublished tweet stays above the watermark of both lists
+    assert table.items['list:owner/a']['since_id'] == 2
+    assert table.items['list:owner/b']['since_id'] == 2
+
+
+class FakeResponse(list):
+    def __init__(self, items, remaining, status_code=200):
+        super().__init__(items)
+        self.status_code = status_code
+        self.headers = {'x-rate-limit-limit': '900', 'x-rate-limit-remaining': str(remaining),
+                        'x-rate-limit-reset': '1900'}
+
+
+def test_handle_skips_lists_over_budget():
+    lists = [{'owner_screen_name': 'owner', 'slug': s, 'count': 10} for s in ['a', 'b']]
+    c = NewsBotConfig({'twitter_config': {'target_lists': lists}})
+    table = FakeStateTable({
+        'ratelimit:lists/statuses': {'state_key': 'ratelimit:lists/statuses', 'limit': 900, 'remaining': 1,
+                                     'reset': 1900},
+        'list:owner/a': {'state_key': 'list:owner/a', 'since_id': 1, 'last_polled_at': 900, 'last_new': 0},
+    })
+    api = FakeTwitterAPI([FakeResponse([{'id': 2}], remaining=0)])
+    app.handle(c, api, FakeCachedTable(set()), FakeSNS(set()), CollectorStateStore(table), now=1000)
+    # the never polled list goes first and the other one waits for the next run
+    assert [r['slug'] for r in api.requests] == ['b']
+    assert table.items['list:owner/b']['last_polled_at'] == 1000
+    assert table.items['list:owner/a']['last_polled_at'] == 900
+    assert table.items['ratelimit:lists/statuses']['remaining'] == 0
+
+
+def test_handle_polls_due_lists_with_adapted_count():
+    lists = [{'owner_screen_name': 'owner', 'slug': s, 'count': 10} for s in ['hot', 'quiet']]
+    c = NewsBotConfig({'twitter_config': {'target_lists': lists}})
+    table = FakeStateTable({
+        'list:owner/hot': {'state_key': 'list:owner/hot', 'since_id': 1, 'last_polled_at': 940, 'activity': 20,
+                           'next_poll_at': 970, 'count': 40},
+        'list:owner/quiet': {'state_key': 'list:owner/quiet', 'since_id': 1, 'last_polled_at': 940,
+                             'activity': 0, 'next_poll_at': 1810, 'count': 10},
+    })
+    api = FakeTwitterAPI([FakeResponse([{'id': i} for i in range(2, 22)], remaining=899)])
+    app.handle(c, api, FakeCachedTable(set()), FakeSNS(set()), CollectorStateStore(table), now=1000)
+    assert [(r['slug'], r['count']) for r in api.requests] == [('hot', 40)]
+    assert table.items['list:owner/hot']['last_new'] == 20
+    assert table.items['list:owner/quiet']['last_polled_at'] == 940
+
+
+def test_coordinate_fans_out_shards():
+    lists = [{'owner_screen_name': 'owner', 'slug': f'slug{i}'} for i in range(20)]
+    c = NewsBotConfig({'twitter_config': {'target_lists': lists, 'shard_count': 3}})
+    invoked = []
+
+    def invoke(message):
+        if message.shard == 2:
+            raise Exception('throttled')
+        invoked.append(message.dictionary)
+
+    ret = app.coordinate(c, 3, invoke, now=1000.0)
+    assert ret == {'Shards': [0, 1, 2], 'Failed': [2]}
+    assert sorted(invoked, key=lambda m: m['shard']) == [
+        {'shard': 0, 'shard_count': 3, 'scheduled_at': 1000.0},
+        {'shard': 1, 'shard_count': 3, 'scheduled_at': 1000.0},
+    ]
+
+
+def test_handle_shard_polls_own_lists():
+    lists = [{'owner_screen_name': 'owner', 'slug': f'slug{i}'} for i in range(6)]
+    c = NewsBotConfig({'twitter_config': {'target_lists': lists, 'shard_count': 2}})
+    api = FakeTwitterAPI([FakeResponse([], remaining=899)] * 6)
+    shard = CollectTweetsShardMessage(1, 2, 999.0)
+    app.handle(c, api, FakeCachedTable(set()), FakeSNS(set()), CollectorStateStore(FakeStateTable({})), 1000, shard)
+    polled = sorted(r['slug'] for r in api.requests)
+    assert polled == sorted(l['slug'] for l in lists if shard_of(TwitterList(l['slug'], 'owner'), 2) == 1)
+
+
+class RaisingSNS:
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        raise Exception('connection reset')
+
+
+def test_handle_tweets_releases_claims_when_publish_raises():
+    table = FakeCachedTable(set())
+    list_config = CollectTweetsListConfig(TwitterList('slug', 'owner'), TweetHandleOptions(), 10)
+    failed = app.handle_tweets([(list_config, [Tweet({'id': i}) for i in [1, 2]])], table, RaisingSNS(), config.log)
+    assert failed == {1, 2}
+    assert table.items == []
+    # the next run can claim and publish them again
+    assert app.handle_tweets([(list_config, [Tweet({'id': 1})])], table, FakeSNS(set()), config.log) == set()
+    assert table.items == [1]
+
+
+class FailingCachedTable(FakeCachedTable):
+    def put_if_absent(self, item):
+        if item['original_id'] == 2:
+            raise Exception('throttled')
+        return super().put_if_absent(item)
+
+
+def test_handle_tweets_releases_claims_on_error():
+    table = FailingCachedTable(set())
+    list_config = CollectTweetsListConfig(TwitterList('slug', 'owner'), TweetHandleOptions(), 10)
+    with pytest.raises(Exception, match='throttled'):
+        app.handle_tweets([(list_config, [Tweet({'id': i}) for i in [1, 2]])], table, FakeSNS({1}), config.log)
+    assert table.items == []
+
+
+class CountingSNS(FakeSNS):
+    def __init__(self):
+        super().__init__(set())
+        self.batches = 0
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.batches += 1
+        return super().publish_batch(TopicArn, PublishBatchRequestEntries)
+
+
+def test_handle_tweets_keeps_claims_of_sent_batches_on_error():
+    table = FailingCachedTable(set())
+    sns = CountingSNS()
+    list_config = CollectTweetsListConfig(TwitterList('slug', 'owner'), TweetHandleOptions(), 20)
+    tweets = [Tweet({'id': i}) for i in [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 1, 2]]
+    with pytest.raises(Exception, match='throttled'):
+        app.handle_tweets([(list_config, tweets)], table, sns, config.log)
+    # the first batch was sent before the error and the queued tweets are flushed, all of them stay claimed
+    assert sns.batches == 2
+    assert table.items == [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 1]
+
+
+def test_update_list_state_keeps_gap():
+    list_config = CollectTweetsListConfig(TwitterList('slug', 'owner'), TweetHandleOptions(), 2)
+    table = FakeStateTable({})
+    state = ListState(TwitterList('slug', 'owner'), since_id=9)
+    truncated = app.CollectedTweets([Tweet({'id': i}) for i in [14, 13, 12, 11]], 2, False)
+    app.update_list_state(list_config, state, truncated, set(), CollectorStateStore(table), config.log, 1000)
+    assert (state.since_id, state.max_id, state.top_id) == (9, 10, 14)
+
+    # the watermark moves to the newest tweet once the gap is filled
+    app.update_list_state(
+        list_config, state, app.CollectedTweets([Tweet({'id': 10})], 2, True), set(),
+        CollectorStateStore(table), config.log, 1060,
+    )
+    assert (state.since_id, state.max_id, state.top_id) == (14, None, None)
+    assert table.items['list:owner/slug']['since_id'] == 14
+
+
+def test_fetch_list_without_request_is_not_a_poll():
+    list_config = CollectTweetsListConfig(TwitterList('slug', 'owner'), TweetHandleOptions(), 2)
+    state = ListState(TwitterList('slug', 'owner'), since_id=9, last_polled_at=900)
+    budget = RequestBudget(RateLimitState(LISTS_STATUSES, 900, 0, reset=1900), 10, reserved=1)
+    api = FakeTwitterAPI([[{'id': 10}]])
+    assert app.fetch_list(api, list_config, state, 5, config.log, budget) is None
+    assert api.requests == []
+    assert budget.exhausted
+
+
+def test_handle_keeps_gap_when_budget_runs_out():
+    lists = [{'owner_screen_name': 'owner', 'slug': 'a', 'count': 2}]
+    c = NewsBotConfig({'twitter_config': {'target_lists': lists, 'adaptive_polling': {'enabled': False}}})
+    table = FakeStateTable({
+        'ratelimit:lists/statuses': {'state_key': 'ratelimit:lists/statuses', 'limit': 900, 'remaining': 1,
+                                     'reset': 1900},
+        'list:owner/a': {'state_key': 'list:owner/a', 'since_id': 9, 'last_polled_at': 900},
+    })
+    api = FakeTwitterAPI([FakeResponse([{'id': 14}, {'id': 13}], remaining=0)])
+    app.handle(c, api, FakeCachedTable(set()), FakeSNS(set()), CollectorStateStore(table), now=1000)
+    state = table.items['list:owner/a']
+    assert (state['since_id'], state['max_id'], state['top_id']) == (9, 12, 14)
@@ -0,0 +1,73 @@
+import decimal
+
+from src.collect_tweets.collector_state import CollectorStateStore, ListState, RateLimitState
+from src.layers.shared_files.python.twitter import TwitterList
+from tests.fakes import FakeStateTable
+
+
+def test_list_state_store_get_put():
+    table = FakeStateTable()
+    store = CollectorStateStore(table)
+    twitter_list = TwitterList('slug', 'owner')
+    state = store.get_list_state(twitter_list)
+    assert state.since_id is None
+    state.since_id = 123
+    store.put_list_state(state)
+    assert table.items['list:owner/slug'] == {
+        'state_key': 'list:owner/slug', 'since_id': 123, 'last_polled_at': None, 'last_new': 0,
+        'activity': None, 'next_poll_at': None, 'count': None, 'max_id': None, 'top_id': None,
+    }
+
+    table.items['list:owner/slug']['since_id'] = decimal.Decimal(123)
+    assert store.get_list_state(twitter_list).since_id == 123
+
+
+def test_list_state_of():
+    state = ListState.of(TwitterList('slug', 'owner'), {})
+    assert state.since_id is None
+
+    state.polled(1000, 3, 0.25, 1870, 20)
+    state = ListState.of(TwitterList('slug', 'owner'), state.dictionary)
+    assert (state.last_polled_at, state.activity, state.next_poll_at, state.count) == (1000, 0.25, 1870, 20)
+    assert not state.is_due(1869)
+    assert state.is_due(1870)
+
+
+def test_rate_limit_state_store_get_put():
+    table = FakeStateTable()
+    store = CollectorStateStore(table)
+    state = store.get_rate_limit_state('lists/statuses', 900)
+    assert (state.limit, state.remaining, state.reset) == (900, 900, 0)
+    state.update(900, 10, 1900)
+    store.put_rate_limit_state(state)
+    assert table.items['ratelimit:lists/statuses'] == {
+        'state_key': 'ratelimit:lists/statuses', 'limit': 900, 'remaining': 10, 'reset': 1900,
+    }
+    state = store.get_rate_limit_state('lists/statuses', 900)
+    assert (state.limit, state.remaining, state.reset) == (900, 10, 1900)
+
+
+def test_rate_limit_state_shared_by_shards():
+    table = FakeStateTable()
+    store = CollectorStateStore(table)
+    store.put_rate_limit_state(RateLimitState('lists/statuses', 900, 100, 1900))
+    assert table.items['ratelimit:lists/statuses']['remaining'] == 100
+
+    # both shards started from the same row, the requests of each are subtracted
+    shards = [store.get_rate_limit_state('lists/statuses', 900) for _ in range(2)]
+    shards[0].update(900, 95, 1900)
+    store.put_rate_limit_state(shards[0], 5)
+    shards[1].update(900, 97, 1900)
+    store.put_rate_limit_state(shards[1], 3)
+    assert table.items['ratelimit:lists/statuses']['remaining'] == 92
+
+    # the lower count reported by the API wins
+    shards[1].update(900, 80, 1900)
+    store.put_rate_limit_state(shards[1], 0)
+    assert table.items['ratelimit:lists/statuses']['remaining'] == 80
+
+    # a shard still in the previous window does not overwrite the next one
+    store.put_rate_limit_state(RateLimitState('lists/statuses', 900, 899, 2800), 1)
+    store.put_rate_limit_state(RateLimitState('lists/statuses', 900, 10, 1900), 1)
+    assert (table.items['ratelimit:lists/statuses']['remaining'], table.items['ratelimit:lists/statuses']['reset']) \
+        == (899, 2800)
@@ -0,0 +1,59 @@
+from src.collect_tweets.collector_state import ListState
+from src.collect_tweets.polling_policy import PollingPolicy
+from src.layers.shared_files.python.twitter import TwitterList
+
+
+def test_first_poll_does_not_estimate_activity():
+    policy = PollingPolicy()
+    state = ListState(TwitterList('slug', 'owner'))
+    policy.update(state, 1000, 10, 10)
+    assert state.activity is None
+    assert state.count == 10
+    assert state.next_poll_at == 1030
+
+
+def test_quiet_list_is_polled_less_often():
+    policy = PollingPolicy(max_interval_sec=900)
+    state = ListState(TwitterList('slug', 'owner'), since_id=1, last_polled_at=940, activity=0.0)
+    policy.update(state, 1000, 0, 10)
+    assert state.activity == 0.0
+    assert state.next_poll_at == 1000 + 900 - 30
+    assert state.count == 10
+
+
+def test_hot_list_gets_larger_pages():
+    policy = PollingPolicy(smoothing=0.5)
+    state = ListState(TwitterList('slug', 'owner'), since_id=1, last_polled_at=940, activity=40.0)
+    policy.update(state, 1000, 60, 10)
+    assert state.activity == 50.0
+    assert state.next_poll_at == 1030
+    assert state.count == 100
+
+    state = ListState(TwitterList('slug', 'owner'), since_id=1, last_polled_at=940, activity=400.0)
+    policy.update(state, 1000, 400, 10)
+    assert state.count == 200
+
+
+def test_moderate_list_interval():
+    policy = PollingPolicy(headroom=2.0)
+    state = ListState(TwitterList('slug', 'owner'), since_id=1, last_polled_at=400, activity=1.0)
+    policy.update(state, 1000, 10, 20)
+    # 1 new tweet per minute, half of a page of 20 fills in 10 minutes
+    assert state.activity == 1.0
+    assert state.next_poll_at == 1000 + 600 - 30
+    assert state.count == 20
+
+
+def test_disabled_policy_keeps_configured_count():
+    policy = PollingPolicy(enabled=False)
+    state = ListState(TwitterList('slug', 'owner'), since_id=1, last_polled_at=940, activity=0.0)
+    policy.update(state, 1000, 0, 10)
+    assert state.next_poll_at == 1030
+    assert state.count == 10
+
+
+def test_fetch_count_ignores_stored_count_when_disabled():
+    state = ListState(TwitterList('slug', 'owner'), since_id=1, count=100)
+    assert PollingPolicy().fetch_count(state, 10) == 100
+    assert PollingPolicy(enabled=False).fetch_count(state, 10) == 10
+    assert PollingPolicy().fetch_count(ListState(TwitterList('slug', 'owner')), 10) == 10
@@ -0,0 +1,54 @@
+from src.collect_tweets.collector_state import ListState, RateLimitState
+from src.collect_tweets.request_scheduler import ListScheduler, RequestBudget, LISTS_STATUSES
+from src.layers.shared_files.python.twitter import TwitterList
+
+
+def test_allowance_spreads_remaining_over_window():
+    scheduler = ListScheduler(window_sec=900, interval_sec=60)
+    assert scheduler.allowance(RateLimitState(LISTS_STATUSES, 900, 300, reset=1600), now=1000) == 30
+
+    # a finished window starts again from the full limit
+    state = RateLimitState(LISTS_STATUSES, 900, 0, reset=900)
+    assert scheduler.allowance(state, now=1000) == 60
+    assert state.reset == 1900
+
+
+def test_budget_reserves_first_pages():
+    budget = RequestBudget(RateLimitState(LISTS_STATUSES, 900, 900, reset=1900), 3, reserved=2)
+    assert budget.acquire()
+    assert not budget.acquire()
+    assert budget.acquire(reserved=True)
+    assert budget.acquire(reserved=True)
+    assert not budget.acquire(reserved=True)
+    assert budget.used == 3
+    assert budget.state.remaining == 897
+
+
+def test_budget_observes_headers():
+    budget = RequestBudget(RateLimitState(LISTS_STATUSES, 900, 900, reset=1900), 10)
+    budget.observe({'x-rate-limit-limit': '900', 'x-rate-limit-remaining': '5', 'x-rate-limit-reset': '1950'})
+    assert (budget.state.remaining, budget.state.reset) == (5, 1950)
+    budget.observe({'x-rate-limit-limit': '900', 'x-rate-limit-remaining': '7', 'x-rate-limit-reset': '1950'})
+    assert budget.state.remaining == 5
+    budget.observe({'x-rate-limit-limit': '900', 'x-rate-limit-remaining': '0', 'x-rate-limit-reset': '1950'})
+    assert budget.exhausted
+    assert not budget.acquire(reserved=True)
+
+
+def test_schedule_prioritizes_active_and_stale_lists():
+    never = ListState(TwitterList('never', 'owner'))
+    active = ListState(TwitterList('active', 'owner'), last_polled_at=940, activity=10.0)
+    stale = ListState(TwitterList('stale', 'owner'), last_polled_at=400, activity=0.0)
+    quiet = ListState(TwitterList('quiet', 'owner'), last_polled_at=940, activity=0.0)
+    idle = ListState(TwitterList('idle', 'owner'), last_polled_at=400, activity=0.0, next_poll_at=1200)
+    scheduled, skipped = ListScheduler().schedule([quiet, stale, idle, active, never], 3, now=1000)
+    assert [s.twitter_list.slug for s in scheduled] == ['never', 'active', 'stale']
+    assert [s.twitter_list.slug for s in skipped] == ['quiet']
+
+
+def test_budget_exhausted_by_remaining():
+    budget = RequestBudget(RateLimitState(LISTS_STATUSES, 900, 1, reset=1900), 10, reserved=2)
+    assert budget.acquire(reserved=True)
+    assert not budget.exhausted
+    assert not budget.acquire(reserved=True)
+    assert budget.exhausted
@@ -0,0 +1,29 @@
+from src.collect_tweets.sharding import CollectTweetsShardMessage, partition, shard_allowance, shard_of
+from src.layers.shared_files.python.news_bot_config import CollectTweetsListConfig
+from src.layers.shared_files.python.twitter import TweetHandleOptions, TwitterList
+
+
+def test_shard_of_is_stable():
+    assert shard_of(TwitterList('slug', 'owner'), 4) == shard_of(TwitterList('Slug', 'Owner'), 4)
+    assert shard_of(TwitterList('slug', 'owner'), 1) == 0
+    # sha1('owner/slug') is fixed, unlike the salted builtin hash()
+    assert shard_of(TwitterList('slug', 'owner'), 1000) == 582
+
+
+def test_partition():
+    lists = [CollectTweetsListConfig(TwitterList(f'slug{i}', 'owner'), TweetHandleOptions(), 10) for i in range(50)]
+    shards = partition(lists, 4)
+    assert sum(len(l) for l in shards.values()) == 50
+    assert set(shards.keys()) <= {0, 1, 2, 3}
+    for shard, shard_lists in shards.items():
+        assert all(shard_of(l.twitter_list, 4) == shard for l in shard_lists)
+
+
+def test_shard_allowance():
+    assert [shard_allowance(10, i, 4) for i in range(4)] == [3, 3, 2, 2]
+    assert [shard_allowance(2, i, 4) for i in range(4)] == [1, 1, 0, 0]
+
+
+def test_shard_message():
+    message = CollectTweetsShardMessage.of(CollectTweetsShardMessage(1, 4, 1000.0).dictionary)
+    assert (message.shard, message.shard_count, message.scheduled_at) == (1, 4, 1000.0)
@@ -3,6 +3,8 @@ import pytest
 
 from src.detect_related_image import app
 from src.layers.shared_files.python.news_bot_config import NewsBotConfig
+from src.layers.shared_files.python.result_cache import InMemoryResultCache
+from src.layers.shared_files.python.message import DetectRelatedImageMessage
 
 config = NewsBotConfig({'global_config': {'log_level': 'INFO'}})
 
@@ -16,5 +18,63 @@ def event():
 def test_app_normal(event, mocker):
     mocker.patch('src.detect_related_image.app.detect_related_image', return_value=95)
 
-    ret = app.handle(event, b'image', 90, None, config.logger)
+    ret = app.handle(event, b'image', 90, None, config.log)
     assert ret == {'similarity': 95}
+
+
+class FakeResponse:
+    def __init__(self, content: bytes):
+        self.content = content
+
+
+class FakeRekognition:
+    def __init__(self, similarity: float):
+        self.similarity = similarity
+        self.calls = 0
+
+    def compare_faces(self, SourceImage, TargetImage, SimilarityThreshold):
+        self.calls += 1
+        return {'FaceMatches': [{'Similarity': self.similarity}]}
+
+
+def test_load_source_image_per_url(mocker):
+    get = mocker.patch('src.detect_related_image.app.requests.get', side_effect=lambda url: FakeResponse(url.encode()))
+    assert app.load_source_image('https://example.com/a.jpg') == b'https://example.com/a.jpg'
+    assert app.load_source_image('https://example.com/a.jpg') == b'https://example.com/a.jpg'
+    assert app.load_source_image('https://example.com/b.jpg') == b'https://example.com/b.jpg'
+    assert get.call_count == 2
+
+
+def test_detect_related_image_uses_content_digest_cache(mocker):
+    mocker.patch('src.detect_related_image.app.requests.get', return_value=FakeResponse(b'same image'))
+    rekognition = FakeRekognition(95)
+    cache = InMemoryResultCache()
+
+    for image_url in ['https://pbs.twimg.com/media/a.jpg', 'https://pbs.twimg.com/media/b.jpg']:
+        message = DetectRelatedImageMessage(image_url)
+        similarity = app.detect_related_image(message, b'source', 90, rekognition, config.log, cache, 'v1', 60)
+        assert similarity == 95
+    assert rekognition.calls == 1
+
+    # a different source image or threshold invalidates the cached similarity
+    message = DetectRelatedImageMessage('https://pbs.twimg.com/media/a.jpg')
+    app.detect_related_image(message, b'source', 80, rekognition, config.log, cache, 'v2', 60)
+    assert rekognition.calls == 2
+
+
+def test_app_batch(mocker):
+    similarities = {'https://example.com/a.jpg': 10, 'https://example.com/b.jpg': 95}
+    mocker.patch(
+        'src.detect_related_image.app.detect_related_image',
+        side_effect=lambda message, *args: similarities[message.image_url],
+    )
+
+    with open("events/detect_related_image_batch_message.json") as f:
+        event = json.load(f)
+    event['image_urls'] = list(similarities.keys())
+    ret = app.handle(event, b'image', 90, None, config.log, max_workers=1)
+    assert ret == {
+        'similarities': similarities,
+        'matched_image_url': 'https://example.com/b.jpg',
+        'failed_image_urls': [],
+    }
@@ -0,0 +1,12 @@
+import os
+import sys
+
+os.environ['TweetTopic'] = 'arn:aws:sns:us-east-1:123456789012:TweetTopic'
+os.environ['RetweetTopic'] = 'arn:aws:sns:us-east-1:123456789012:RetweetTopic'
+os.environ['DetectImageFunction'] = 'DetectRelatedImageFunction'
+os.environ['DetectURLFunction'] = 'DetectRelatedURLFunction'
+os.environ['DDBResultCacheTable'] = 'DetectionResultCache'
+os.environ['DeferredDetectionQueue'] = 'http://localhost:4576/queue/DeferredDetectionQueue'
+os.environ['AWS_DEFAULT_REGION'] = 'us-east-1'
+sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../../src/layers/shared_files/python/"))
+sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../../src/detect_related_tweet/"))
@@ -0,0 +1,277 @@
+import io
+import json
+import pytest
+
+from src.detect_related_tweet import app
+from src.detect_related_tweet.detection_pipeline import Deadline
+from src.layers.shared_files.python.news_bot_config import NewsBotConfig
+from src.layers.shared_files.python.result_cache import InMemoryResultCache
+from src.layers.shared_files.python.twitter import Tweet, TweetHandleOptions
+from src.layers.shared_files.python.message import CollectTweetsMessage
+
+config = NewsBotConfig({
+    'global_config': {'log_level': 'INFO'},
+    'keyword_config': {'keywords': ['hoge']},
+})
+
+
+class FakeLambdaClient:
+    def __init__(self, result: dict, function_error: bool = False):
+        self.result = result
+        self.function_error = function_error
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.invocations.append(json.loads(Payload.decode('utf-8')))
+        res = {'Payload': io.BytesIO(json.dumps(self.result).encode('utf-8'))}
+        if self.function_error:
+            res['FunctionError'] = 'Unhandled'
+        return res
+
+
+def test_detect_url_uses_cache(mocker):
+    client = FakeLambdaClient({
+        'expanded_url': 'https://example.com/news?id=1',
+        'selector': 'body',
+        'detected_text': 'hoge',
+    })
+    mocker.patch('src.detect_related_tweet.app.lambda_client', client)
+    cache = InMemoryResultCache()
+
+    first = app.detect_url('https://t.co/abc', config, cache)
+    assert first['detected_text'] == 'hoge'
+    assert app.detect_url('https://t.co/abc', config, cache)['detected_text'] == 'hoge'
+    # another short URL expanding to the same page is served from the cache
+    assert app.detect_url('https://example.com/news?utm_source=twitter&id=1', config, cache)['detected_text'] == 'hoge'
+    assert len(client.invocations) == 1
+
+    # changing keywords invalidates cached results
+    updated = NewsBotConfig({
+        'global_config': {'log_level': 'INFO'},
+        'keyword_config': {'keywords': ['fuga']},
+    })
+    app.detect_url('https://t.co/abc', updated, cache)
+    assert len(client.invocations) == 2
+
+
+def test_detect_image_uses_cache(mocker):
+    client = FakeLambdaClient({'similarity': 95})
+    mocker.patch('src.detect_related_tweet.app.lambda_client', client)
+    cache = InMemoryResultCache()
+    image_config = NewsBotConfig({
+        'global_config': {
+            'log_level': 'INFO',
+            'detect_face_source_image_url': 'https://example.com/source.jpg',
+            'detect_face_similarity_threshold': 90,
+        },
+    })
+
+    assert app.detect_image('https://pbs.twimg.com/media/a.jpg', image_config, cache) == 95
+    assert app.detect_image('https://pbs.twimg.com/media/a.jpg', image_config, cache) == 95
+    assert len(client.invocations) == 1
+
+
+def test_handle_fails_message_when_detection_function_errors(mocker):
+    image_config = NewsBotConfig({
+        'global_config': {
+            'log_level': 'INFO',
+            'detect_face_source_image_url': 'https://example.com/source.jpg',
+            'detect_face_similarity_threshold': 90,
+        },
+        'keyword_config': {'keywords': ['hoge']},
+    })
+    cache = InMemoryResultCache()
+    handlers = app.TweetHandlers(
+        retweet_handler=lambda m, k: None,
+        image_handler=lambda m, s: app.image_handler(m, image_config, FakePublisher(), FakePublisher(), cache, s),
+        url_handler=lambda m, s: app.url_handler(m, image_config, FakePublisher(), FakePublisher(), cache, s),
+    )
+    event = {'Records': [
+        sqs_record('url', 'events/tweets/tweet_with_url.json', {'evaluate_url': 'EVALUATE'}),
+        sqs_record('image', 'events/tweets/tweet_with_image.json', {'evaluate_image': 'EVALUATE'}),
+    ]}
+    client = FakeLambdaClient({'errorMessage': 'Task timed out'}, function_error=True)
+    mocker.patch('src.detect_related_tweet.app.lambda_client', client)
+    ret = app.handle(event, image_config, handlers)
+    assert sorted(f['itemIdentifier'] for f in ret['batchItemFailures']) == ['image', 'url']
+
+    # the error was not cached, the redriven messages invoke the functions again and succeed
+    client = FakeLambdaClient({'similarity': 10, 'expanded_url': None, 'selector': None, 'detected_text': None})
+    mocker.patch('src.detect_related_tweet.app.lambda_client', client)
+    ret = app.handle(event, image_config, handlers)
+    assert ret['batchItemFailures'] == []
+    invocations = len(client.invocations)
+    assert invocations >= 2
+    app.handle(event, image_config, handlers)
+    assert len(client.invocations) == invocations
+
+
+class FakePublisher:
+    def __init__(self):
+        self.messages = []
+
+    def publish(self, key, message):
+        self.messages.append(message)
+
+
+class FakeImageLambdaClient:
+    def __init__(self, similarities: dict):
+        self.similarities = similarities
+        self.invocations = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        payload = json.loads(Payload.decode('utf-8'))
+        self.invocations.append(payload)
+        if 'image_urls' in payload:
+            result = {'similarities': {u: self.similarities[u] for u in payload['image_urls']}}
+        else:
+            result = {'similarity': self.similarities[payload['image_url']]}
+        return {'Payload': io.BytesIO(json.dumps(result).encode('utf-8'))}
+
+
+def image_message(image_urls) -> CollectTweetsMessage:
+    with open("events/tweets/tweet_with_image.json") as f:
+        j = json.load(f)
+    j['extended_entities']['media'] = [{'media_url_https': u} for u in image_urls]
+    return CollectTweetsMessage(Tweet(j), TweetHandleOptions())
+
+
+def test_image_handler_evaluates_images(mocker):
+    similarities = {'https://example.com/a.jpg': 10, 'https://example.com/b.jpg': 95}
+    for batch_invocation in [False, True]:
+        client = FakeImageLambdaClient(similarities)
+        mocker.patch('src.detect_related_tweet.app.lambda_client', client)
+        image_config = NewsBotConfig({
+            'global_config': {
+                'log_level': 'INFO',
+                'detect_face_source_image_url': 'https://example.com/source.jpg',
+                'detect_face_similarity_threshold': 90,
+                'detect_face_batch_invocation': batch_invocation,
+            },
+        })
+        retweet_publisher, tweet_publisher = FakePublisher(), FakePublisher()
+
+        app.image_handler(image_message(list(similarities.keys())), image_config, retweet_publisher, tweet_publisher)
+        assert len(client.invocations) == (1 if batch_invocation else 2)
+        assert len(retweet_publisher.messages) == 1
+        assert 'https://example.com/b.jpg' in retweet_publisher.messages[0]
+
+
+def test_image_handler_raises_on_failed_batch_images(mocker):
+    client = FakeLambdaClient({
+        'similarities': {'https://example.com/a.jpg': 10},
+        'matched_image_url': None,
+        'failed_image_urls': ['https://example.com/b.jpg'],
+    })
+    mocker.patch('src.detect_related_tweet.app.lambda_client', client)
+    image_config = NewsBotConfig({
+        'global_config': {
+            'log_level': 'INFO',
+            'detect_face_source_image_url': 'https://example.com/source.jpg',
+            'detect_face_similarity_threshold': 90,
+            'detect_face_batch_invocation': True,
+        },
+    })
+    message = image_message(['https://example.com/a.jpg', 'https://example.com/b.jpg'])
+    with pytest.raises(RuntimeError):
+        app.image_handler(message, image_config, FakePublisher(), FakePublisher())
+
+    # a match among the evaluated images is enough
+    client.result = {
+        'similarities': {'https://example.com/a.jpg': 95},
+        'matched_image_url': 'https://example.com/a.jpg',
+        'failed_image_urls': ['https://example.com/b.jpg'],
+    }
+    retweet_publisher = FakePublisher()
+    assert app.image_handler(message, image_config, retweet_publisher, FakePublisher())
+    assert len(retweet_publisher.messages) == 1
+
+
+def sqs_record(message_id: str, tweet_file: str, options: dict) -> dict:
+    with open(tweet_file) as f:
+        tweet = json.load(f)
+    return {'messageId': message_id, 'body': json.dumps({'tweet': tweet, 'options': options})}
+
+
+def test_handle_reports_batch_item_failures():
+    def url_handler(m, s):
+        raise RuntimeError('failed')
+
+    handlers = app.TweetHandlers(
+        retweet_handler=lambda m, k: None,
+        image_handler=lambda m, s: False,
+        url_handler=url_handler,
+    )
+    event = {'Records': [
+        sqs_record('ok', 'events/tweets/tweet.json', {}),
+        sqs_record('failed', 'events/tweets/tweet_with_url.json', {'evaluate_url': 'EVALUATE'}),
+        {'messageId': 'invalid', 'body': '{}'},
+    ]}
+    ret = app.handle(event, config, handlers)
+    assert sorted(f['itemIdentifier'] for f in ret['batchItemFailures']) == ['failed', 'invalid']
+
+
+def test_handle_defers_stages_past_deadline():
+    retweeted, deferred = [], []
+    handlers = app.TweetHandlers(
+        retweet_handler=lambda m, k: retweeted.append(m),
+        image_handler=lambda m, s: False,
+        url_handler=lambda m, s: False,
+    )
+    event = {'Records': [sqs_record('deferred', 'events/tweets/tweet_with_url.json', {'evaluate_url': 'EVALUATE'})]}
+    deadline = Deadline(lambda: 10 * 1000)
+    ret = app.handle(event, config, handlers, deadline=deadline, deferrer=deferred.append)
+    assert ret['batchItemFailures'] == []
+    assert deferred[0].stages == ['url']
+    assert deferred[0].attempts == 1
+
+    # the follow-up record only runs the deferred stage
+    called = []
+    handlers = app.TweetHandlers(
+        retweet_handler=lambda m, k: retweeted.append(m),
+        image_handler=lambda m, s: False,
+        url_handler=lambda m, s: called.append(m) or False,
+    )
+    event = {'Records': [{'messageId': 'follow-up', 'body': json.dumps(deferred[0].dictionary)}]}
+    ret = app.handle(event, config, handlers)
+    assert ret['batchItemFailures'] == []
+    assert len(called) == 1
+    assert retweeted == []
+
+
+def test_handle_gives_up_after_max_deferrals():
+    deferred = []
+    handlers = app.TweetHandlers(
+        retweet_handler=lambda m, k: None,
+        image_handler=lambda m, s: False,
+        url_handler=lambda m, s: False,
+    )
+    event = {'Records': [sqs_record('deferred', 'events/tweets/tweet_with_url.json', {'evaluate_url': 'EVALUATE'})]}
+    deadline = Deadline(lambda: 10 * 1000)
+    for attempts in range(1, 4):
+        ret = app.handle(event, config, handlers, deadline=deadline, deferrer=deferred.append)
+        assert ret['batchItemFailures'] == []
+        assert deferred[-1].attempts == attempts
+        event = {'Records': [{'messageId': 'deferred', 'body': json.dumps(deferred[-1].dictionary)}]}
+
+    ret = app.handle(event, config, handlers, deadline=deadline, deferrer=deferred.append)
+    assert ret['batchItemFailures'] == [{'itemIdentifier': 'deferred'}]
+    assert len(deferred) == 3
+
+
+def test_handle_async_mode_defers_slow_stages():
+    retweeted, deferred, called = [], [], []
+    handlers = app.TweetHandlers(
+        retweet_handler=lambda m, k: retweeted.append(k),
+        image_handler=lambda m, s: called.append(m) or False,
+        url_handler=lambda m, s: called.append(m) or False,
+    )
+    event = {'Records': [
+        sqs_record('keyword', 'events/tweets/tweet.json', {'always_retweet': True}),
+        sqs_record('url', 'events/tweets/tweet_with_url.json', {'evaluate_url': 'EVALUATE'}),
+    ]}
+    ret = app.handle(event, config, handlers, deferrer=deferred.append, mode=app.DetectionMode.ASYNC)
+    assert ret['batchItemFailures'] == []
+    assert len(retweeted) == 1
+    assert called == []
+    assert [d.stages for d in deferred] == [['url']]
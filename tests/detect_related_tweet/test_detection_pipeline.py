@@ -0,0 +1,70 @@
+import threading
+
+from src.detect_related_tweet.detection_pipeline import Deadline, DetectionPipeline, StageCancelPolicy, StageContext
+
+
+def test_pipeline_runs_stages_concurrently():
+    # both stages have to be running at the same time to pass the barrier
+    barrier = threading.Barrier(2)
+
+    def stage(_: StageContext) -> bool:
+        barrier.wait(timeout=10)
+        return False
+
+    with DetectionPipeline() as pipeline:
+        results = pipeline.run([('image', stage), ('url', stage)])
+    assert [r.name for r in results] == ['image', 'url']
+    assert all(r.error is None for r in results)
+    assert not barrier.broken
+
+
+def test_pipeline_cancels_remaining_stage_on_retweet():
+    retweeted = threading.Event()
+
+    def fast_stage(context: StageContext) -> bool:
+        assert context.claim_retweet()
+        retweeted.set()
+        return True
+
+    def slow_stage(context: StageContext) -> bool:
+        retweeted.wait(1)
+        return context.claim_retweet()
+
+    with DetectionPipeline(StageCancelPolicy.CANCEL_ON_RETWEET) as pipeline:
+        image, url = pipeline.run([('image', fast_stage), ('url', slow_stage)])
+    assert image.retweeted and not image.cancelled
+    assert not url.retweeted and url.cancelled
+
+    with DetectionPipeline(StageCancelPolicy.NONE) as pipeline:
+        image, url = pipeline.run([('image', fast_stage), ('url', slow_stage)])
+    assert image.retweeted and url.retweeted
+
+
+def test_pipeline_records_stage_error():
+    def failing_stage(_: StageContext) -> bool:
+        raise RuntimeError('failed')
+
+    with DetectionPipeline() as pipeline:
+        results = pipeline.run([('url', failing_stage)])
+    assert results[0].dictionary['error'] == 'failed'
+    assert results[0].retweeted is False
+
+
+def test_pipeline_defers_stage_without_enough_time():
+    class FakeContext:
+        def get_remaining_time_in_millis(self):
+            return 20 * 1000
+
+    deadline = Deadline.of(FakeContext(), margin_ms=2000)
+    assert deadline.remaining_ms == 18 * 1000
+
+    def url_stage(context: StageContext) -> bool:
+        context.ensure_time_for(30 * 1000)
+        return True
+
+    with DetectionPipeline(deadline=deadline, budgets_ms={'image': 15 * 1000, 'url': 30 * 1000}) as pipeline:
+        image, url = pipeline.run([('image', lambda _: False), ('url', lambda _: True)])
+        assert not image.deferred and url.deferred and not url.retweeted
+        # stages can also give up part way through
+        results = pipeline.run([('other', url_stage)])
+        assert results[0].deferred
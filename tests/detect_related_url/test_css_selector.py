@@ -24,3 +24,22 @@ def test_get_selector():
     assert s.get_selector('http://example.com') is None
     assert s.get_selector('http://example.com/hoge/fuga') is None
 
+
+
+def test_get_selector_keeps_pattern_order():
+    s = Selectors(
+        selectors={
+            'https://53ningen.com/hoge/fuga': '.first',
+            '.*/hoge': '.fallback',
+            r'https://53ningen\.com/hoge': '.second',
+        },
+        ignored_urls=[
+            'https://(www\\.)?example.com',
+        ]
+    )
+    assert s.get_selector('https://53ningen.com/hoge/fuga') == '.first'
+    assert s.get_selector('https://53ningen.com/hoge') == '.fallback'
+    assert s.get_selector('https://53ningen.com/fuga') == 'body'
+    assert s.get_selector('https://www.example.com/hoge') is None
+    assert s.get_selector('https://EXAMPLE.com/hoge') == '.fallback'
+    assert s.get_selector('https://other.com/') == 'body'
@@ -31,6 +31,7 @@ def test_app_normal(event, mocker):
     selector = 'div'
     keyword = 'hoge'
 
+    mocker.patch('src.detect_related_url.app.fetch_selected_text', return_value=None)
     mocker.patch('src.detect_related_url.app.get_selected_text', return_value={
         'url': url,
         'selector': selector,
@@ -45,3 +46,98 @@ def test_app_normal(event, mocker):
         'detected_text': keyword,
         'expanded_url': 'http://example.com',
     }
+
+
+class FakeResponse:
+    def __init__(self, url: str, content: str, content_type: str = 'text/html; charset=utf-8'):
+        self.url = url
+        self.content = content.encode('utf-8')
+        self.headers = {'Content-Type': content_type}
+        self.read_bytes = 0
+        self.closed = False
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), chunk_size):
+            self.read_bytes += len(self.content[i:i + chunk_size])
+            yield self.content[i:i + chunk_size]
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, response: FakeResponse):
+        self.response = response
+        self.requests = []
+
+    def get(self, url, **kwargs):
+        self.requests.append((url, kwargs))
+        return self.response
+
+
+def test_app_http_fast_path(mocker):
+    get_selected_text = mocker.patch('src.detect_related_url.app.get_selected_text')
+    html = '<html><body><div class="rbody">hoge<script>var fuga;</script></div></body></html>'
+    session = FakeSession(FakeResponse('https://example.com/article', html))
+    s = css_selectors.Selectors({'https://example.com': '.rbody'}, [])
+    ret = app.handle(DetectRelatedURLMessage('https://t.co/xxx'), s, {}, config, session)
+    assert ret == {
+        'url': 'https://t.co/xxx',
+        'selector': '.rbody',
+        'detected_text': 'hoge',
+        'expanded_url': 'https://example.com/article',
+    }
+    assert not get_selected_text.called
+
+
+@pytest.mark.parametrize('selectors', [
+    css_selectors.Selectors({'https://example.com': '.missing'}, []),
+    css_selectors.Selectors({'https://example.com': '.rbody'}, [], ['https://example.com']),
+])
+def test_app_http_fast_path_falls_back_to_chrome(selectors, mocker):
+    get_selected_text = mocker.patch('src.detect_related_url.app.get_selected_text', return_value=None)
+    html = '<html><body><div class="rbody">hoge</div></body></html>'
+    session = FakeSession(FakeResponse('https://example.com/article', html))
+    app.handle(DetectRelatedURLMessage('https://example.com/article'), selectors, {}, config, session)
+    assert get_selected_text.called
+
+
+def test_fetch_selected_text_ignored_url():
+    session = FakeSession(FakeResponse('https://example.com/article', '<html></html>'))
+    s = css_selectors.Selectors({}, ['https://example.com'])
+    ret = app.fetch_selected_text('https://example.com/article', s, session, 5, config.log)
+    assert ret == {'url': 'https://example.com/article', 'selector': None, 'selected_text': ''}
+
+
+def test_fetch_selected_text_skips_js_rendered_url():
+    session = FakeSession(FakeResponse('https://example.com/article', '<html></html>'))
+    s = css_selectors.Selectors({'https://example.com': 'body'}, [], ['https://example.com'])
+    assert app.fetch_selected_text('https://example.com/article', s, session, 5, config.log) is None
+    assert session.requests == []
+
+
+def test_fetch_selected_text_does_not_read_non_html():
+    response = FakeResponse('https://example.com/a.pdf', '%PDF-1.4', 'application/pdf')
+    session = FakeSession(response)
+    s = css_selectors.Selectors({'https://example.com': 'body'}, [])
+    ret = app.fetch_selected_text('https://example.com/a.pdf', s, session, 5, config.log)
+    assert ret == {'url': 'https://example.com/a.pdf', 'selector': 'body', 'selected_text': ''}
+    assert session.requests[0][1]['stream']
+    assert response.read_bytes == 0
+    assert response.closed
+
+
+def test_fetch_selected_text_caps_body():
+    html = '<html><body><div class="rbody">hoge</div>' + 'x' * 200 * 1024 + '<div class="tail">fuga</div></body></html>'
+    response = FakeResponse('https://example.com/article', html)
+    s = css_selectors.Selectors({'https://example.com': '.rbody'}, [])
+    ret = app.fetch_selected_text('https://example.com/article', s, FakeSession(response), 5, config.log, 128 * 1024)
+    assert ret['selected_text'] == 'hoge'
+    assert response.read_bytes == 128 * 1024
+    s = css_selectors.Selectors({'https://example.com': '.tail'}, [])
+    response = FakeResponse('https://example.com/article', html)
+    assert app.fetch_selected_text('https://example.com/article', s, FakeSession(response), 5, config.log, 128 * 1024) \
+        is None
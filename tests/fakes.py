@@ -0,0 +1,40 @@
+from botocore.exceptions import ClientError
+
+
+class FakeSQS:
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, QueueUrl, MessageBody, DelaySeconds):
+        self.messages.append((MessageBody, DelaySeconds))
+
+
+class FakeStateTable:
+    # understands the conditions CollectorStateStore uses for the rate limit row
+    def __init__(self, items=None):
+        self.items = items if items is not None else {}
+
+    def get_item(self, Key):
+        item = self.items.get(Key['state_key'])
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression=None, ExpressionAttributeNames=None, ExpressionAttributeValues=None):
+        current = self.items.get(Item['state_key'])
+        if ConditionExpression is not None and current is not None \
+                and current['reset'] >= ExpressionAttributeValues[':reset']:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[Item['state_key']] = Item
+        return {}
+
+    def update_item(self, Key, UpdateExpression, ConditionExpression, ExpressionAttributeNames,
+                    ExpressionAttributeValues, ReturnValues=None):
+        current = self.items.get(Key['state_key'])
+        values = ExpressionAttributeValues
+        if current is None or current['reset'] != values[':reset'] \
+                or (':remaining' in values and current['remaining'] <= values[':remaining']):
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'UpdateItem')
+        if ':used' in values:
+            current['remaining'] += values[':used']
+        else:
+            current['remaining'] = values[':remaining']
+        return {'Attributes': {'remaining': current['remaining']}}
@@ -0,0 +1,37 @@
+import threading
+
+from src.layers.shared_files.python.early_exit import evaluate_until_match
+
+
+def test_evaluate_until_match_collects_all_without_match():
+    result = evaluate_until_match([1, 2, 3], lambda i: i * 10, lambda v: v > 100)
+    assert result.results == {1: 10, 2: 20, 3: 30}
+    assert result.matched is None
+    assert result.cancelled == []
+
+
+def test_evaluate_until_match_stops_on_match():
+    release = threading.Event()
+
+    def evaluate(i: int) -> int:
+        if i != 1:
+            release.wait(5)
+        return i * 10
+
+    result = evaluate_until_match([1, 2, 3, 4, 5], evaluate, lambda v: v >= 10, max_workers=2)
+    release.set()
+    assert result.matched == 1
+    assert result.results[1] == 10
+    assert 5 in result.cancelled
+
+
+def test_evaluate_until_match_records_errors():
+    def evaluate(i: int) -> int:
+        if i == 2:
+            raise ValueError('error')
+        return i
+
+    result = evaluate_until_match([1, 2, 3], evaluate, lambda v: v == 3, max_workers=1)
+    assert result.matched == 3
+    assert result.results == {1: 1, 3: 3}
+    assert isinstance(result.errors[2], ValueError)
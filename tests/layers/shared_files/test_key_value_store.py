@@ -1,6 +1,10 @@
+import decimal
+import collections
 import boto3
+from botocore.exceptions import ClientError
 
-from src.layers.shared_files.python.key_value_store import InMemoryKeyValueStore, DDBTableWithLocalCache
+from src.layers.shared_files.python.key_value_store import InMemoryKeyValueStore, DDBTableWithLocalCache, \
+    BoundedInMemoryKeyValueStore, to_storable
 
 
 def test_in_memory_key_value_store_get_put():
@@ -49,3 +53,164 @@ def test_ddb_table_with_local_cache_get_put():
         ddb.Table(table_name).delete()
 
 
+
+
+class FakeBatchClient:
+    def __init__(self, table_name: str, items: dict, unprocessed_once: bool = False):
+        self.table_name = table_name
+        self.items = items
+        self.unprocessed_once = unprocessed_once
+        self.requests = []
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[self.table_name]['Keys']
+        self.requests.append(keys)
+        if self.unprocessed_once:
+            self.unprocessed_once = False
+            return {
+                'Responses': {self.table_name: [self.items[k['hash_key']] for k in keys[:1]]},
+                'UnprocessedKeys': {self.table_name: {'Keys': keys[1:]}},
+            }
+        found = [self.items[k['hash_key']] for k in keys if k['hash_key'] in self.items]
+        return {'Responses': {self.table_name: found}, 'UnprocessedKeys': {}}
+
+
+class FakeTable:
+    def __init__(self, client):
+        self.name = client.table_name
+        self.meta = type('Meta', (), {'client': client})()
+
+
+def test_ddb_table_with_local_cache_batch_get():
+    items = {k: {'hash_key': decimal.Decimal(k), 'v': k} for k in range(0, 250, 2)}
+    client = FakeBatchClient('table', {decimal.Decimal(k): v for k, v in items.items()})
+    in_memory = InMemoryKeyValueStore()
+    in_memory.put(1, {'hash_key': 1})
+    s = DDBTableWithLocalCache('hash_key', FakeTable(client), in_memory)
+    found = s.batch_get(list(range(250)))
+    assert sorted(found.keys()) == sorted([1] + list(range(0, 250, 2)))
+    assert [len(r) for r in client.requests] == [100, 100, 49]
+    assert in_memory.get(4) == items[4]
+    s.batch_get([4])
+    assert len(client.requests) == 3
+
+
+def test_ddb_table_with_local_cache_batch_get_skips_expired():
+    client = FakeBatchClient('table', {
+        decimal.Decimal(1): {'hash_key': 1, 'ttl': decimal.Decimal(1)},
+        decimal.Decimal(2): {'hash_key': 2, 'ttl': decimal.Decimal(4102444800)},
+    })
+    s = DDBTableWithLocalCache('hash_key', FakeTable(client), InMemoryKeyValueStore())
+    assert list(s.batch_get([1, 2]).keys()) == [2]
+
+
+def test_ddb_table_with_local_cache_batch_get_unprocessed_keys():
+    client = FakeBatchClient('table', {decimal.Decimal(1): {'hash_key': 1}, decimal.Decimal(2): {'hash_key': 2}}, True)
+    s = DDBTableWithLocalCache('hash_key', FakeTable(client), InMemoryKeyValueStore())
+    found = s.batch_get([1, 2])
+    assert sorted(found.keys()) == [1, 2]
+    assert client.requests == [[{'hash_key': 1}, {'hash_key': 2}], [{'hash_key': 2}]]
+
+
+def test_bounded_in_memory_key_value_store_lru():
+    s = BoundedInMemoryKeyValueStore(max_entries=2)
+    s.put('k1', 'v1')
+    s.put('k2', 'v2')
+    assert s.get('k1') == 'v1'
+    s.put('k3', 'v3')
+    assert s.get('k2') is None
+    assert s.get('k1') == 'v1'
+    assert s.get('k3') == 'v3'
+    assert s.stats['evictions'] == 1
+    assert s.stats['hits'] == 3
+    assert s.stats['misses'] == 1
+
+
+def test_bounded_in_memory_key_value_store_max_bytes():
+    s = BoundedInMemoryKeyValueStore(max_bytes=10, sizeof=len)
+    s.put('k1', 'aaaa')
+    s.put('k2', 'bbbb')
+    s.put('k3', 'cccc')
+    assert s.get('k1') is None
+    assert s.get('k2') == 'bbbb'
+    assert s.stats['bytes'] == 8
+    s.put('k4', 'd' * 11)
+    assert s.stats['entries'] == 0
+
+
+def test_bounded_in_memory_key_value_store_ttl():
+    now = [100.0]
+    s = BoundedInMemoryKeyValueStore(ttl=10, clock=lambda: now[0])
+    s.put('k1', 'v1')
+    s.put('k2', 'v2', expires_at=200.0)
+    now[0] = 110.0
+    assert s.get('k1') is None
+    assert s.get('k2') == 'v2'
+    assert s.stats['expirations'] == 1
+
+
+class FakeConditionalTable:
+    def __init__(self, items=None):
+        self.items = items or {}
+        self.requests = []
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        self.requests.append(ConditionExpression)
+        current = self.items.get(Item['hash_key'])
+        if current is not None and current['ttl'] > ExpressionAttributeValues[':now']:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[Item['hash_key']] = Item
+        return {}
+
+    def delete_item(self, Key):
+        self.items.pop(Key['hash_key'], None)
+
+
+def test_ddb_table_with_local_cache_put_if_absent():
+    table = FakeConditionalTable({
+        'old': {'hash_key': 'old', 'ttl': decimal.Decimal(1)},
+        'other': {'hash_key': 'other', 'ttl': decimal.Decimal(10 ** 10)},
+    })
+    in_memory = InMemoryKeyValueStore()
+    s = DDBTableWithLocalCache('hash_key', table, in_memory)
+    item = {'hash_key': 'new', 'v': 1.5}
+    assert s.put_if_absent(item)
+    assert 'ttl' not in item
+    assert table.items['new']['v'] == decimal.Decimal('1.5')
+    # the local cache answers without another write
+    assert not s.put_if_absent({'hash_key': 'new'})
+    assert len(table.requests) == 1
+    # an item written by another collector
+    assert not s.put_if_absent({'hash_key': 'other'})
+    assert in_memory.get('other') is not None
+    # an expired item which DynamoDB has not deleted yet
+    assert s.put_if_absent({'hash_key': 'old'})
+
+    s.delete('new')
+    assert 'new' not in table.items
+    assert in_memory.get('new') is None
+    assert s.put_if_absent({'hash_key': 'new'})
+
+
+def test_to_storable():
+    item = {
+        'text': 'a: "" b',
+        'empty': '',
+        'score': 0.1,
+        'nested': {'values': [1.5, '', True, None, 2], 'tuple': (1, 2)},
+        1: 'int key',
+    }
+    assert to_storable(item) == {
+        'text': 'a: "" b',
+        'empty': None,
+        'score': decimal.Decimal('0.1'),
+        'nested': {'values': [decimal.Decimal('1.5'), None, True, None, 2], 'tuple': [1, 2]},
+        '1': 'int key',
+    }
+    assert item['score'] == 0.1
+
+
+def test_to_storable_subclasses():
+    item = collections.OrderedDict([('score', 0.5), ('values', collections.deque([0.25]))])
+    assert to_storable(item) == {'score': decimal.Decimal('0.5'), 'values': collections.deque([0.25])}
+    assert to_storable(collections.defaultdict(list, {'empty': ''})) == {'empty': None}
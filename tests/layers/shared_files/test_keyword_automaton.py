@@ -0,0 +1,18 @@
+from src.layers.shared_files.python.keyword_automaton import KeywordAutomaton
+
+
+def test_keyword_automaton_matches():
+    a = KeywordAutomaton([('he', 1), ('she', 2), ('his', 3), ('hers', 4)])
+    assert sorted(a.iter_matches('ushers')) == [1, 2, 4]
+    assert list(a.iter_matches('hi')) == []
+
+
+def test_keyword_automaton_overlapping_multibyte():
+    a = KeywordAutomaton([('イチロー', 'a'), ('ロー', 'b'), ('鈴木一郎', 'c')])
+    assert sorted(a.iter_matches('鈴木一郎(イチロー)')) == ['a', 'b', 'c']
+
+
+def test_keyword_automaton_empty_keyword():
+    a = KeywordAutomaton([('', 'empty'), ('x', 'x')])
+    assert list(a.iter_matches('')) == ['empty']
+    assert list(a.iter_matches('x')) == ['empty', 'x']
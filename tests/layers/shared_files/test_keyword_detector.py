@@ -37,3 +37,25 @@ def test_keyword_detector_ignored_users():
     assert d.find_related_keyword('test', 'user2') is None
     assert d.find_related_keyword('hoge', 'user1') is None
     assert d.find_related_keyword('hoge', 'user2') is None
+
+
+def test_keyword_detector_keeps_keyword_order():
+    d = KeywordDetector(
+        global_keywords=['fuga', 'hoge'],
+        user_specific_keywords={'user1': ['piyo', 'ho']},
+    )
+    assert d.find_related_keyword('hoge fuga') == 'fuga'
+    assert d.find_related_keyword('hoge') == 'hoge'
+    assert d.find_related_keyword('ho piyo', 'user1') == 'piyo'
+    assert d.find_related_keyword('ho', 'user1') == 'ho'
+
+
+def test_keyword_detector_matched_ignore_condition():
+    d = KeywordDetector(
+        global_keywords=['hoge'],
+        ignored_keywords=['ignored'],
+        ignored_users=['user1'],
+    )
+    assert d.matched_ignore_condition('hoge ignored')
+    assert d.matched_ignore_condition('hoge', 'user1')
+    assert not d.matched_ignore_condition('hoge', 'user2')
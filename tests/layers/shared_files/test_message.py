@@ -1,5 +1,8 @@
+import json
+
 from src.layers.shared_files.python.twitter import Tweet, TweetHandleOptions, TweetEvaluateOption
-from src.layers.shared_files.python.message import CollectTweetsMessage
+from src.layers.shared_files.python.message import CollectTweetsMessage, DetectRelatedImageBatchMessage, \
+    DeferredDetectionMessage, unwrap_record
 
 
 def test_collect_tweets_message_init():
@@ -26,3 +29,28 @@ def test_collect_tweets_message_of():
     assert not message.options.include_quoted_text
     assert message.options.evaluate_url.value == TweetEvaluateOption.NONE.value
     assert message.options.evaluate_image.value == TweetEvaluateOption.NONE.value
+
+
+def test_detect_related_image_batch_message_of():
+    with open("events/detect_related_image_batch_message.json") as f:
+        j = json.load(f)
+    m = DetectRelatedImageBatchMessage.of(j)
+    assert m.image_urls == j['image_urls']
+    assert m.dictionary == j
+    assert DetectRelatedImageBatchMessage.of({'image_url': 'https://example.com'}) is None
+
+
+def test_deferred_detection_message_of():
+    with open("events/tweets/tweet_with_url.json") as f:
+        tweet = Tweet(json.load(f))
+    m = DeferredDetectionMessage(CollectTweetsMessage(tweet, TweetHandleOptions()), ['url'], 2)
+    d = DeferredDetectionMessage.of(m.dictionary)
+    assert d.stages == ['url']
+    assert d.attempts == 2
+    assert d.message.tweet.id == tweet.id
+    assert DeferredDetectionMessage.of({'stages': ['url']}) is None
+
+
+def test_unwrap_record():
+    assert unwrap_record({'Sns': {'MessageId': 'a', 'Message': '{}'}}) == ('a', '{}')
+    assert unwrap_record({'messageId': 'b', 'body': '{}'}) == ('b', '{}')
@@ -1,4 +1,6 @@
-from src.layers.shared_files.python.news_bot_config import NewsBotConfig
+from botocore.exceptions import ClientError
+
+from src.layers.shared_files.python.news_bot_config import NewsBotConfig, NewsBotConfigLoader
 
 
 def test_config_default():
@@ -8,8 +10,71 @@ def test_config_default():
     assert config.detect_face_source_image_url is None
     assert config.twitter_target_lists == []
     assert config.image_detection_message_template is None
+    assert config.config_cache_ttl == 0
+    assert config.version is None
+    assert config.collect_tweets_adaptive_polling_enabled
+    assert config.collect_tweets_adaptive_polling_max_count == 200
 
 
 def test_image_detection_message_template():
     config = NewsBotConfig({'detect_related_tweet': {'image_detection_message_template': 'template'}})
     assert config.image_detection_message_template == 'template'
+
+
+def test_detection_choices_fall_back_to_default():
+    config = NewsBotConfig({
+        'detect_related_tweet': {'detection_mode': 'ASYNC', 'stage_cancel_policy': 'CANCEL_ON_RETWEET'},
+    })
+    assert (config.detection_mode, config.detection_stage_cancel_policy) == ('ASYNC', 'CANCEL_ON_RETWEET')
+    config = NewsBotConfig({'detect_related_tweet': {'detection_mode': 'async', 'stage_cancel_policy': 'CANCEL'}})
+    assert (config.detection_mode, config.detection_stage_cancel_policy) == ('SYNC', 'NONE')
+
+
+class FakeBody:
+    def __init__(self, content: bytes):
+        self._content = content
+
+    def read(self) -> bytes:
+        return self._content
+
+
+class FakeS3Client:
+    def __init__(self, content: str, etag: str):
+        self.content = content
+        self.etag = etag
+        self.requests = []
+
+    def get_object(self, **kwargs):
+        self.requests.append(kwargs)
+        if kwargs.get('IfNoneMatch') == self.etag:
+            raise ClientError({'Error': {'Code': '304'}, 'ResponseMetadata': {'HTTPStatusCode': 304}}, 'GetObject')
+        return {'Body': FakeBody(self.content.encode()), 'ETag': self.etag}
+
+
+def test_config_loader_revalidates_with_etag():
+    client = FakeS3Client('global_config:\n  log_level: INFO\n', '"v1"')
+    loader = NewsBotConfigLoader(lambda _: client)
+    config = loader.load('local', 'bucket', 'config.yaml')
+    assert config.version == '"v1"'
+    assert loader.load('local', 'bucket', 'config.yaml') is config
+    assert client.requests[1]['IfNoneMatch'] == '"v1"'
+
+    client.content = 'global_config:\n  log_level: DEBUG\n'
+    client.etag = '"v2"'
+    updated = loader.load('local', 'bucket', 'config.yaml')
+    assert updated is not config
+    assert updated.log_level == 'DEBUG'
+    assert updated.version == '"v2"'
+
+
+def test_config_loader_ttl():
+    now = [1000.0]
+    client = FakeS3Client('global_config:\n  config_cache_ttl: 60\n', '"v1"')
+    loader = NewsBotConfigLoader(lambda _: client, clock=lambda: now[0])
+    config = loader.load('local', 'bucket', 'config.yaml')
+    now[0] += 59
+    assert loader.load('local', 'bucket', 'config.yaml') is config
+    assert len(client.requests) == 1
+    now[0] += 1
+    assert loader.load('local', 'bucket', 'config.yaml') is config
+    assert len(client.requests) == 2
@@ -0,0 +1,89 @@
+from botocore.exceptions import ClientError
+
+from src.layers.shared_files.python.rate_limiter import InMemoryTokenBucketLimiter, DDBTokenBucketLimiter, \
+    QueueBackoff
+from tests.fakes import FakeSQS
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key, ConsistentRead):
+        item = self.items.get(Key['bucket_key'], None)
+        return {'Item': dict(item)} if item is not None else {}
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeValues=None):
+        current = self.items.get(Item['bucket_key'], None)
+        if ConditionExpression.startswith('attribute_not_exists'):
+            ok = current is None
+        else:
+            ok = current is not None and current['updated_at'] == ExpressionAttributeValues[':updated_at'] \
+                and current['tokens'] == ExpressionAttributeValues[':tokens']
+        if not ok:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[Item['bucket_key']] = Item
+
+
+def test_token_bucket_limiters():
+    clock = FakeClock()
+    for limiter in [InMemoryTokenBucketLimiter(2, 0.5, clock), DDBTokenBucketLimiter(FakeTable(), 2, 0.5, clock)]:
+        clock.now = 1000.0
+        assert limiter.acquire('twitter:write') == 0
+        assert limiter.acquire('twitter:write') == 0
+        assert limiter.acquire('twitter:write') == 2
+        assert limiter.acquire('other') == 0
+        clock.now = 1002.0
+        assert limiter.acquire('twitter:write') == 0
+        assert limiter.acquire('twitter:write') == 2
+
+
+def test_ddb_token_bucket_limiter_retries_on_conflict():
+    clock = FakeClock()
+    table = FakeTable()
+    limiter = DDBTokenBucketLimiter(table, 5, 1, clock)
+    assert limiter.acquire('twitter:write') == 0
+
+    original_get_item = table.get_item
+    conflicts = [True]
+
+    def get_item(Key, ConsistentRead):
+        res = original_get_item(Key, ConsistentRead)
+        if conflicts:
+            conflicts.pop()
+            # another function takes a token between the read and the write
+            other = DDBTokenBucketLimiter(FakeTableView(table), 5, 1, clock)
+            assert other.acquire('twitter:write') == 0
+        return res
+
+    table.get_item = get_item
+    assert limiter.acquire('twitter:write') == 0
+    assert float(table.items['twitter:write']['tokens']) == 2
+
+
+class FakeTableView:
+    def __init__(self, table: FakeTable):
+        self._table = table
+
+    def get_item(self, Key, ConsistentRead):
+        return FakeTable.get_item(self._table, Key, ConsistentRead)
+
+    def put_item(self, **kwargs):
+        return self._table.put_item(**kwargs)
+
+
+def test_queue_backoff_delay():
+    sqs = FakeSQS()
+    backoff = QueueBackoff(sqs, 'queue')
+    assert backoff.defer('a', 0.2) == 1
+    assert backoff.defer('b', 12.5) == 13
+    assert backoff.defer('c', float('inf')) == 15 * 60
+    assert sqs.messages == [('a', 1), ('b', 13), ('c', 900)]
@@ -0,0 +1,46 @@
+from src.layers.shared_files.python.result_cache import canonicalize_url, InMemoryResultCache, SQLiteResultCache, \
+    DDBResultCache
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable:
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, Key):
+        item = self.items.get(Key['cache_key'], None)
+        return {'Item': item} if item is not None else {}
+
+    def put_item(self, Item):
+        self.items[Item['cache_key']] = Item
+
+
+def test_canonicalize_url():
+    assert canonicalize_url('HTTPS://Example.COM:443') == 'https://example.com/'
+    assert canonicalize_url('http://example.com:8080/a#top') == 'http://example.com:8080/a'
+    assert canonicalize_url('https://example.com/a?b=2&utm_source=twitter&a=1&fbclid=x') == \
+        'https://example.com/a?a=1&b=2'
+    assert canonicalize_url('https://example.com/a?b=2&a=1') == canonicalize_url('https://example.com/a?a=1&b=2')
+
+
+def test_result_cache_backends():
+    clock = FakeClock()
+    caches = [
+        InMemoryResultCache(clock=clock),
+        SQLiteResultCache(':memory:', clock=clock),
+        DDBResultCache(FakeTable(), clock=clock),
+    ]
+    for cache in caches:
+        clock.now = 1000.0
+        assert cache.get('url:https://example.com/') is None
+        cache.put('url:https://example.com/', {'detected_text': 'テスト', 'selector': None}, 60)
+        assert cache.get('url:https://example.com/') == {'detected_text': 'テスト', 'selector': None}
+        clock.now = 1061.0
+        assert cache.get('url:https://example.com/') is None
@@ -0,0 +1,70 @@
+from src.layers.shared_files.python.sns_publisher import BatchSNSPublisher
+
+
+class FakeSNS:
+    def __init__(self, failures=None):
+        self.failures = failures or []
+        self.batches = []
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        self.batches.append([e['Message'] for e in PublishBatchRequestEntries])
+        successful = []
+        failed = []
+        for e in PublishBatchRequestEntries:
+            if self.failures and self.failures[0][0] == e['Message']:
+                failed.append({'Id': e['Id'], 'Code': 'Error', 'SenderFault': self.failures.pop(0)[1]})
+            else:
+                successful.append({'Id': e['Id'], 'MessageId': 'id-' + e['Message']})
+        return {'Successful': successful, 'Failed': failed}
+
+
+def test_batch_sns_publisher_batches():
+    sns = FakeSNS()
+    publisher = BatchSNSPublisher(sns, 'topic')
+    for i in range(25):
+        publisher.publish(i, str(i))
+    assert len(sns.batches) == 2
+    result = publisher.flush()
+    assert [len(b) for b in sns.batches] == [10, 10, 5]
+    assert result.successful[24] == 'id-24'
+    assert result.failed == []
+    assert publisher.flush().successful == {}
+
+
+def test_batch_sns_publisher_max_batch_bytes():
+    sns = FakeSNS()
+    publisher = BatchSNSPublisher(sns, 'topic')
+    message = 'a' * 100 * 1024
+    for i in range(3):
+        publisher.publish(i, message)
+    publisher.flush()
+    assert [len(b) for b in sns.batches] == [2, 1]
+
+
+def test_batch_sns_publisher_failures():
+    sns = FakeSNS(failures=[('1', False), ('2', True)])
+    publisher = BatchSNSPublisher(sns, 'topic')
+    for i in range(3):
+        publisher.publish(i, str(i))
+    result = publisher.flush()
+    assert sns.batches == [['0', '1', '2'], ['1']]
+    assert sorted(result.successful.keys()) == [0, 1]
+    assert result.failed == [2]
+
+
+class RaisingSNS(FakeSNS):
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        if len(self.batches) == 0:
+            self.batches.append([])
+            raise Exception('connection reset')
+        return super().publish_batch(TopicArn, PublishBatchRequestEntries)
+
+
+def test_batch_sns_publisher_exception():
+    sns = RaisingSNS()
+    publisher = BatchSNSPublisher(sns, 'topic', batch_size=2)
+    for i in range(3):
+        publisher.publish(i, str(i))
+    result = publisher.flush()
+    assert result.failed == [0, 1]
+    assert sorted(result.successful.keys()) == [2]
@@ -0,0 +1,49 @@
+import json
+import logging
+
+from src.layers.shared_files.python.structured_logger import StructuredLogger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record.getMessage())
+
+
+def get_logger(name: str, level: int):
+    logger = logging.getLogger(name)
+    handler = ListHandler()
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger, handler
+
+
+def test_structured_logger_event():
+    logger, handler = get_logger('test_structured_logger_event', logging.INFO)
+    log = StructuredLogger(logger)
+    log.info('test:event', {'key': '値'})
+    assert json.loads(handler.records[0]) == {'event': 'test:event', 'details': {'key': '値'}}
+
+
+def test_structured_logger_skips_disabled_level():
+    logger, handler = get_logger('test_structured_logger_skips_disabled_level', logging.INFO)
+    log = StructuredLogger(logger)
+    called = []
+    log.debug('test:event', lambda: called.append(1))
+    assert called == []
+    assert handler.records == []
+    log.info('test:event', lambda: {'lazy': True})
+    assert json.loads(handler.records[0])['details'] == {'lazy': True}
+
+
+def test_structured_logger_truncates_details():
+    logger, handler = get_logger('test_structured_logger_truncates_details', logging.INFO)
+    log = StructuredLogger(logger, max_length=100)
+    log.info('test:event', {'text': 'a' * 1000})
+    record = json.loads(handler.records[0])
+    assert record['truncated']
+    assert len(record['details']) == 100
@@ -0,0 +1,4 @@
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.dirname(os.path.abspath(__file__)) + "/../../src/retweet"))
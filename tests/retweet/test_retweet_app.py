@@ -5,6 +5,9 @@ import TwitterAPI
 
 from src.retweet import app
 from src.layers.shared_files.python.news_bot_config import NewsBotConfig
+from src.retweet.retweet_ledger import InMemoryRetweetLedger
+from src.layers.shared_files.python.rate_limiter import InMemoryTokenBucketLimiter, QueueBackoff
+from tests.fakes import FakeSQS
 
 config = NewsBotConfig({'global_config': {'log_level': 'INFO'}})
 
@@ -48,3 +51,46 @@ def test_app_abnormal(event, mocker):
     with pytest.raises(Exception):
         app.handle(event, config)
 
+
+def test_app_skips_duplicates(mocker):
+    retweet = mocker.patch('src.retweet.app.retweet')
+    event = {'Records': [
+        {'Sns': {'MessageId': 'a', 'Message': '{"id": 1}'}},
+        {'Sns': {'MessageId': 'b', 'Message': '{"id": 1}'}},
+        {'Sns': {'MessageId': 'c', 'Message': '{"id": 2}'}},
+    ]}
+    ledger = InMemoryRetweetLedger()
+
+    ret = app.handle(event, config, ledger)
+    assert ret == {'MessageIds': ['a', 'b', 'c']}
+    assert retweet.call_count == 2
+
+    app.handle(event, config, ledger)
+    assert retweet.call_count == 2
+
+
+def test_app_releases_ledger_on_failure(event, mocker):
+    mocker.patch('src.retweet.app.retweet', side_effect=RuntimeError('failed'))
+    ledger = InMemoryRetweetLedger()
+
+    with pytest.raises(RuntimeError):
+        app.handle(event, config, ledger)
+    assert ledger.claim('1136286647664779266', 60)
+
+
+def test_app_backs_off_when_rate_limited(event, mocker):
+    retweet = mocker.patch('src.retweet.app.retweet')
+    sqs = FakeSQS()
+    ledger = InMemoryRetweetLedger()
+    limiter = InMemoryTokenBucketLimiter(0, 1)
+
+    app.handle(event, config, ledger, limiter, QueueBackoff(sqs, 'queue'))
+    assert retweet.call_count == 0
+    assert json.loads(sqs.messages[0][0])['id'] == 1136286647664779266
+    # the ledger claim is released so the delayed message can retweet
+    assert ledger.claim('1136286647664779266', 60)
+
+    backoff_event = {'Records': [{'messageId': 'backoff', 'body': sqs.messages[0][0]}]}
+    ret = app.handle(backoff_event, config, InMemoryRetweetLedger(), InMemoryTokenBucketLimiter(1, 1))
+    assert ret == {'MessageIds': ['backoff']}
+    assert retweet.call_count == 1
@@ -0,0 +1,39 @@
+from botocore.exceptions import ClientError
+
+from src.retweet.retweet_ledger import InMemoryRetweetLedger, DDBRetweetLedger
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable:
+    def __init__(self, clock):
+        self.items = {}
+        self.clock = clock
+
+    def put_item(self, Item, ConditionExpression, ExpressionAttributeNames, ExpressionAttributeValues):
+        current = self.items.get(Item['original_id'], None)
+        if current is not None and current['ttl'] > ExpressionAttributeValues[':now']:
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException'}}, 'PutItem')
+        self.items[Item['original_id']] = Item
+
+    def delete_item(self, Key):
+        self.items.pop(Key['original_id'], None)
+
+
+def test_retweet_ledger_backends():
+    clock = FakeClock()
+    for ledger in [InMemoryRetweetLedger(clock), DDBRetweetLedger(FakeTable(clock), clock)]:
+        clock.now = 1000.0
+        assert ledger.claim('1', 60)
+        assert not ledger.claim('1', 60)
+        assert ledger.claim('2', 60)
+        ledger.release('2')
+        assert ledger.claim('2', 60)
+        clock.now = 1061.0
+        assert ledger.claim('1', 60)
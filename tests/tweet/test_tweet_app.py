@@ -5,6 +5,8 @@ import TwitterAPI
 
 from src.tweet import app
 from src.layers.shared_files.python.news_bot_config import NewsBotConfig
+from src.layers.shared_files.python.rate_limiter import InMemoryTokenBucketLimiter, QueueBackoff
+from tests.fakes import FakeSQS
 
 config = NewsBotConfig({'global_config': {'log_level': 'INFO'}})
 
@@ -48,3 +50,16 @@ def test_app_abnormal(event, mocker):
     with pytest.raises(Exception):
         app.handle(event, config)
 
+
+def test_app_backs_off_when_rate_limited(event, mocker):
+    tweet = mocker.patch('src.tweet.app.tweet', return_value='12345')
+    sqs = FakeSQS()
+
+    ret = app.handle(event, config, InMemoryTokenBucketLimiter(0, 1), QueueBackoff(sqs, 'queue'))
+    assert ret == {'Results': {'dummy': None}}
+    assert tweet.call_count == 0
+    assert sqs.messages == [('{"status":"test"}', 1)]
+
+    backoff_event = {'Records': [{'messageId': 'backoff', 'body': sqs.messages[0][0]}]}
+    ret = app.handle(backoff_event, config, InMemoryTokenBucketLimiter(1, 1), QueueBackoff(sqs, 'queue'))
+    assert ret == {'Results': {'backoff': '12345'}}